@@ -3,7 +3,7 @@ from zoneinfo import ZoneInfo
 from google.cloud import secretmanager
 
 from recorders.alpaca_recorder import AlpacaOptionsChainRecorder
-from persistence.gcp_bigquery import BigQueryPersistence
+from persistence.gcp_bigquery import BigQueryLoadPersistence
 
 PROJECT_ID = 797853389585
 
@@ -21,7 +21,8 @@ def main():
         "secret": access_secret(PROJECT_ID, "ALPACA_SECRET"),
     }
 
-    pl = BigQueryPersistence(
+    # Rows are sent as a single load job when the recorder closes its sinks
+    pl = BigQueryLoadPersistence(
         project_id="market-data-model-20",
         dataset_id="alpaca_dataset",
         table_id="options_latest_quote_chain",
@@ -1,12 +1,42 @@
 import configparser
+import json
 import os
-from flask import Flask, request, jsonify
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+from typing import Iterator, List, Optional
 
+from flask import Flask, Response, request, jsonify
+
+from brokerage_systems.alpaca_br.alpaca_defs import decode_snapshots
+from brokerage_systems.alpaca_br.alpaca_main import AlpacaClient
 from recorders.alpaca_recorder import AlpacaSnapshotRecorder
+from persistence.encoders import encode_ndjson
 from persistence.gcp_cloud_storage import GCSPersistence
+from persistence.latest_state import LatestStateCache
 
 app = Flask(__name__)
 
+# Latest quote, trade and bars per symbol, kept across requests of a warm instance
+latest_state = LatestStateCache()
+
+# The recorder (with its Alpaca and GCS clients) is created on the first request
+# and reused by the following requests of the instance. It is dropped after a
+# failed tick, so that the next request starts over with new clients.
+_recorder: Optional[AlpacaSnapshotRecorder] = None
+_recorder_lock = threading.Lock()
+_last_success: Optional[float] = None
+_consecutive_failures = 0
+
+SNAPSHOT_BATCH_SIZE = 100  # Symbols per get_snapshot call
+SNAPSHOT_WORKERS = 4  # get_snapshot calls in flight at once, for all streams together
+
+# Spool of the GCS writes, on Cloud Run's in-memory file system: it survives failed
+# GCS writes (replayed by the following ticks) but not the instance
+SPOOL_DIR = "/tmp/spool/snapshots_logs"
+SPOOL_DRAIN_TIMEOUT = 10.0  # Seconds a tick waits for its records to reach GCS
+
 
 @app.route("/", methods=["GET", "POST"])
 def handler():
@@ -15,34 +45,199 @@ def handler():
     context = {}
 
     # Call the main function with these parameters
-    result = main(event, context)
+    try:
+        result = main(event, context)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
 
     return jsonify({"status": "success", "result": result})
 
 
-def main(event, context):
-    # Get config from file config.ini
-    config = {
+@app.route("/latest", methods=["GET"])
+def latest():
+    """
+    Latest state of symbols, e.g. /latest?symbols=SPY,VOO&sections=latest_quote.
+
+    All symbols (and sections) are returned if none are given.
+    """
+    symbols = request.args.get("symbols")
+    sections = request.args.get("sections")
+    return jsonify(
+        latest_state.get_many(
+            symbols.split(",") if symbols else None,
+            sections.split(",") if sections else None,
+        )
+    )
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """Whether the instance is serving: its recorder and the last successful tick."""
+    return jsonify(
+        {
+            "recorder_ready": _recorder is not None,
+            "last_success": _last_success,
+            "consecutive_failures": _consecutive_failures,
+        }
+    )
+
+
+@app.route("/snapshots", methods=["GET", "POST"])
+def snapshots():
+    """
+    Snapshots of any number of symbols, streamed as newline-delimited JSON.
+
+    Symbols are given as /snapshots?symbols=SPY,VOO or as a JSON body
+    {"symbols": [...]}, with an optional feed ("iex" by default). They are
+    fetched in batches of SNAPSHOT_BATCH_SIZE, SNAPSHOT_WORKERS batches at a
+    time, and every batch is written out as soon as it arrives, in
+    completion order: one AlpacaSnapshot object per line, as the GCS sink
+    stores them. A batch that fails is reported as an {"error": ...,
+    "symbols": [...]} line and does not end the stream.
+    """
+    body = request.get_json(silent=True) or {}
+    symbols = body.get("symbols") or request.args.get("symbols", "")
+    if isinstance(symbols, str):
+        symbols = symbols.split(",")
+    # Unique, in the order given
+    symbols = list(
+        dict.fromkeys(symbol.strip().upper() for symbol in symbols if symbol.strip())
+    )
+    if not symbols:
+        return jsonify({"status": "error", "message": "No symbols given"}), 400
+    feed = body.get("feed") or request.args.get("feed", "iex")
+    try:
+        batch_size = int(request.args.get("batch_size", SNAPSHOT_BATCH_SIZE))
+    except ValueError:
+        batch_size = 0
+    if batch_size < 1:
+        return (
+            jsonify(
+                {"status": "error", "message": "batch_size must be a positive integer"}
+            ),
+            400,
+        )
+
+    return Response(
+        _stream_snapshots(symbols, feed, batch_size),
+        mimetype="application/x-ndjson",
+    )
+
+
+def _stream_snapshots(
+    symbols: List[str], feed: str, batch_size: int
+) -> Iterator[bytes]:
+    """
+    NDJSON chunks of the snapshots of symbols, one chunk per batch.
+
+    At most SNAPSHOT_WORKERS batches are requested ahead of the client, so a
+    response never holds more than that many batches in memory.
+    """
+    client = get_alpaca_client()
+    executor = _snapshot_executor()
+    batches = (
+        symbols[start : start + batch_size]
+        for start in range(0, len(symbols), batch_size)
+    )
+
+    pending = {}
+    try:
+        while True:
+            for batch in batches:
+                future = executor.submit(
+                    client.get_snapshot, symbols=batch, feed=feed, raw_data=True
+                )
+                pending[future] = batch
+                if len(pending) >= SNAPSHOT_WORKERS:
+                    break
+            if not pending:
+                return
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = pending.pop(future)
+                try:
+                    records = decode_snapshots(future.result())
+                except Exception as e:
+                    error = {"error": str(e), "symbols": batch}
+                    yield (json.dumps(error) + "\n").encode()
+                    continue
+                if len(records):
+                    yield encode_ndjson(records)
+    finally:
+        # The client went away: drop the batches not started yet
+        for future in pending:
+            future.cancel()
+
+
+@lru_cache(maxsize=None)
+def get_alpaca_client() -> AlpacaClient:
+    """Alpaca client of the /snapshots endpoint, created on first use."""
+    config = get_config()
+    return AlpacaClient(api_key=config["key"], secret_key=config["secret"])
+
+
+@lru_cache(maxsize=None)
+def _snapshot_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(
+        max_workers=SNAPSHOT_WORKERS, thread_name_prefix="snapshots"
+    )
+
+
+@lru_cache(maxsize=None)
+def get_config() -> dict:
+    """Alpaca credentials, read from the environment once per instance."""
+    return {
         "key": os.environ.get("ALPACA_KEY"),
         "secret": os.environ.get("ALPACA_SECRET"),
     }
 
-    pl = GCSPersistence(
-        bucket_name="alpaca_intraday_data",
-        gcs_prefix="stocks/intraday_data",
-        filename="snapshots_logs",
-        format="json",
-        file_per_day=True,
+
+def _create_recorder() -> AlpacaSnapshotRecorder:
+    from persistence.spool import SpooledPersistence
+
+    # Write through a local spool, like run_alpaca_recorder: run_once closes the
+    # persistence layers every tick, which drains the spool into GCS
+    pl = SpooledPersistence(
+        GCSPersistence(
+            bucket_name="alpaca_intraday_data",
+            gcs_prefix="stocks/intraday_data",
+            filename="snapshots_logs",
+            format="json",
+            file_per_day=True,
+        ),
+        spool_dir=SPOOL_DIR,
+        fsync=False,
+        drain_timeout=SPOOL_DRAIN_TIMEOUT,
     )
 
-    alpaca_recorder = AlpacaSnapshotRecorder(
+    return AlpacaSnapshotRecorder(
         stocks=["SPY", "VOO"],
-        config=config,
-        persistences=[pl],
+        config=get_config(),
+        persistences=[pl, latest_state],
     )
 
-    alpaca_recorder.run_once()
-    return {"message": "AlpacaSnapshotRecorder executed successfully"}
+
+def main(event, context):
+    global _recorder, _last_success, _consecutive_failures
+
+    # One tick at a time: the GCS sink appends to a single object
+    with _recorder_lock:
+        if _recorder is None:
+            try:
+                _recorder = _create_recorder()
+            except Exception:
+                _consecutive_failures += 1
+                raise
+
+        if _recorder.run_once():
+            _last_success = time.time()
+            _consecutive_failures = 0
+            return {"message": "AlpacaSnapshotRecorder executed successfully"}
+
+        _recorder = None
+        _consecutive_failures += 1
+        raise RuntimeError("AlpacaSnapshotRecorder failed to log records")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,263 @@
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from persistence.schema import SYMBOL_COLUMN, normalize_frame
+
+BUY = 1
+SELL = -1
+UNKNOWN = 0
+
+
+def _to_ns(timestamps: pd.Series) -> np.ndarray:
+    """Timestamps (datetimes or float epoch seconds) as int64 nanoseconds since the epoch."""
+    if pd.api.types.is_numeric_dtype(timestamps.dtype):
+        return np.round(timestamps.to_numpy(dtype=float) * 1e9).astype(np.int64)
+    return pd.DatetimeIndex(pd.to_datetime(timestamps, utc=True)).as_unit("ns").asi8
+
+
+def _last_nonzero(signs: np.ndarray, initial: int) -> np.ndarray:
+    """Forward fill zeros with the last nonzero sign, starting from `initial`."""
+    signs = np.concatenate([[initial], signs])
+    positions = np.where(signs != 0, np.arange(len(signs)), 0)
+    return signs[np.maximum.accumulate(positions)][1:]
+
+
+class _SymbolQuotes:
+    """Quotes of one symbol, sorted by time."""
+
+    __slots__ = ("timestamps", "bid", "ask")
+
+    def __init__(self, timestamps: np.ndarray, bid: np.ndarray, ask: np.ndarray):
+        self.timestamps = timestamps
+        self.bid = bid
+        self.ask = ask
+
+    def append(self, other: "_SymbolQuotes") -> "_SymbolQuotes":
+        timestamps = np.concatenate([self.timestamps, other.timestamps])
+        order = np.argsort(timestamps, kind="stable")
+        return _SymbolQuotes(
+            timestamps[order],
+            np.concatenate([self.bid, other.bid])[order],
+            np.concatenate([self.ask, other.ask])[order],
+        )
+
+    def after(self, cutoff: int) -> "_SymbolQuotes":
+        """The quotes after cutoff, and the last one at or before it."""
+        first = max(np.searchsorted(self.timestamps, cutoff, side="right") - 1, 0)
+        return _SymbolQuotes(
+            self.timestamps[first:], self.bid[first:], self.ask[first:]
+        )
+
+
+class AsofJoiner:
+    """
+    As-of join of trades to the prevailing quotes, with Lee-Ready trade signs.
+
+    Every trade gets the last quote of its symbol at (or, with
+    allow_exact_matches=False, strictly before) the trade time. Timestamps
+    are compared as int64 nanoseconds and each symbol is matched with one
+    vectorized binary search of its trade times in its quote times.
+
+    The joiner is fed in chunks, e.g. time windows from the trades and quotes
+    downloaders: quotes are buffered until the trades up to them have been
+    joined, and only the last quote of each symbol (plus any quotes newer
+    than the joined trades) is kept afterwards. The last trade price and tick
+    direction of each symbol are carried over too, so joining in chunks gives
+    the same result as joining everything at once, with memory bounded by
+    the chunk sizes.
+
+    Added columns:
+        bid_price, ask_price, quote_timestamp (epoch seconds) of the prevailing quote,
+        mid and spread (NaN without a valid quote), and side: 1 for buyer
+        initiated, -1 for seller initiated and 0 if unknown. Trades above the
+        mid are buys and below it sells; trades at the mid (or without a valid
+        quote) are signed by the tick test against the previous different
+        trade price.
+    """
+
+    def __init__(
+        self,
+        allow_exact_matches: bool = True,
+        tolerance: Optional[float] = None,
+    ):
+        """
+        Args:
+            allow_exact_matches (bool): Match quotes with the same timestamp as the trade.
+            tolerance (Optional[float]): Ignore quotes older than this many seconds.
+        """
+        self._allow_exact_matches = allow_exact_matches
+        self._tolerance = None if tolerance is None else int(tolerance * 1e9)
+        self._quotes: Dict[str, _SymbolQuotes] = {}
+        self._last_trade: Dict[str, Tuple[float, int]] = {}  # Last price and tick sign
+        self._quotes_until: Optional[int] = None  # Newest buffered quote time
+
+    @property
+    def quotes_until(self) -> Optional[int]:
+        """Time (int64 nanoseconds) of the newest quote added so far."""
+        return self._quotes_until
+
+    def add_quotes(self, quotes: pd.DataFrame):
+        """
+        Buffer a chunk of quotes.
+
+        Args:
+            quotes (pd.DataFrame): Quotes with symbol, timestamp, bid_price and ask_price, as returned by Alpaca.
+        """
+        if not len(quotes):
+            return
+        quotes = normalize_frame(quotes)
+        timestamps = _to_ns(quotes["timestamp"])
+        bid = quotes["bid_price"].to_numpy(dtype=float)
+        ask = quotes["ask_price"].to_numpy(dtype=float)
+
+        codes, symbols = pd.factorize(quotes[SYMBOL_COLUMN].astype(str))
+        order = np.lexsort((timestamps, codes))
+        bounds = np.searchsorted(codes[order], np.arange(len(symbols) + 1))
+        for code, symbol in enumerate(symbols):
+            rows = order[bounds[code] : bounds[code + 1]]
+            chunk = _SymbolQuotes(timestamps[rows], bid[rows], ask[rows])
+            current = self._quotes.get(symbol)
+            self._quotes[symbol] = chunk if current is None else current.append(chunk)
+
+        newest = int(timestamps.max())
+        if self._quotes_until is None or newest > self._quotes_until:
+            self._quotes_until = newest
+
+    def join(self, trades: pd.DataFrame) -> pd.DataFrame:
+        """
+        Join a chunk of trades to the buffered quotes.
+
+        Chunks must be given in time order, after the quotes up to their last trade.
+
+        Args:
+            trades (pd.DataFrame): Trades with symbol, timestamp and price, as returned by Alpaca.
+
+        Returns:
+            pd.DataFrame: The trades (index reset, in their original order) with the quote, mid, spread and side columns.
+        """
+        trades = normalize_frame(trades).reset_index(drop=True)
+        count = len(trades)
+        bid = np.full(count, np.nan)
+        ask = np.full(count, np.nan)
+        quote_ns = np.zeros(count, dtype=np.int64)
+        has_quote = np.zeros(count, dtype=bool)
+        side = np.zeros(count, dtype=np.int8)
+        if not count:
+            return self._with_columns(trades, bid, ask, quote_ns, has_quote, side)
+
+        timestamps = _to_ns(trades["timestamp"])
+        prices = trades["price"].to_numpy(dtype=float)
+        codes, symbols = pd.factorize(trades[SYMBOL_COLUMN].astype(str))
+        order = np.lexsort((timestamps, codes))
+        bounds = np.searchsorted(codes[order], np.arange(len(symbols) + 1))
+
+        for code, symbol in enumerate(symbols):
+            rows = order[bounds[code] : bounds[code + 1]]
+            trade_ns = timestamps[rows]
+
+            quotes = self._quotes.get(symbol)
+            if quotes is not None and len(quotes.timestamps):
+                side_of_search = "right" if self._allow_exact_matches else "left"
+                match = (
+                    np.searchsorted(quotes.timestamps, trade_ns, side=side_of_search)
+                    - 1
+                )
+                found = match >= 0
+                if self._tolerance is not None:
+                    found &= trade_ns - quotes.timestamps[match] <= self._tolerance
+                matched = rows[found]
+                bid[matched] = quotes.bid[match[found]]
+                ask[matched] = quotes.ask[match[found]]
+                quote_ns[matched] = quotes.timestamps[match[found]]
+                has_quote[matched] = True
+                # Keep the last quote that later trades may still match
+                cutoff = int(trade_ns[-1]) - (0 if self._allow_exact_matches else 1)
+                self._quotes[symbol] = quotes.after(cutoff)
+
+            side[rows] = self._lee_ready(symbol, prices[rows], bid[rows], ask[rows])
+
+        return self._with_columns(trades, bid, ask, quote_ns, has_quote, side)
+
+    def _lee_ready(
+        self, symbol: str, prices: np.ndarray, bid: np.ndarray, ask: np.ndarray
+    ) -> np.ndarray:
+        """Trade signs of the time ordered trades of one symbol."""
+        last_price, last_tick = self._last_trade.get(symbol, (np.nan, UNKNOWN))
+        previous = np.concatenate([[last_price], prices[:-1]])
+        with np.errstate(invalid="ignore"):
+            ticks = np.nan_to_num(np.sign(prices - previous)).astype(np.int8)
+        ticks = _last_nonzero(ticks, last_tick)
+        self._last_trade[symbol] = (prices[-1], int(ticks[-1]))
+
+        valid = (bid > 0) & (ask >= bid)
+        mid = (bid + ask) / 2
+        with np.errstate(invalid="ignore"):
+            quote_sign = np.where(
+                valid, np.sign(prices - np.where(valid, mid, 0)), 0
+            ).astype(np.int8)
+        return np.where(quote_sign != 0, quote_sign, ticks).astype(np.int8)
+
+    @staticmethod
+    def _with_columns(trades, bid, ask, quote_ns, has_quote, side) -> pd.DataFrame:
+        valid = (bid > 0) & (ask >= bid)
+        return trades.assign(
+            bid_price=bid,
+            ask_price=ask,
+            quote_timestamp=np.where(has_quote, quote_ns / 1e9, np.nan),
+            mid=np.where(valid, (bid + ask) / 2, np.nan),
+            spread=np.where(valid, ask - bid, np.nan),
+            side=side,
+        )
+
+
+def asof_join(
+    trades: pd.DataFrame,
+    quotes: pd.DataFrame,
+    allow_exact_matches: bool = True,
+    tolerance: Optional[float] = None,
+) -> pd.DataFrame:
+    """
+    Join trades to the prevailing quotes in one go. See AsofJoiner.
+
+    Returns:
+        pd.DataFrame: The trades with bid_price, ask_price, quote_timestamp, mid, spread and side.
+    """
+    joiner = AsofJoiner(allow_exact_matches, tolerance)
+    joiner.add_quotes(quotes)
+    return joiner.join(trades)
+
+
+def iter_asof_join(
+    trade_chunks: Iterable[pd.DataFrame],
+    quote_chunks: Iterable[pd.DataFrame],
+    allow_exact_matches: bool = True,
+    tolerance: Optional[float] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Join time ordered chunks of trades to time ordered chunks of quotes.
+
+    Quote chunks are only read as far as the trades being joined need, e.g.
+    with AlpacaClient.iter_trades and iter_quotes over the same day.
+
+    Yields:
+        pd.DataFrame: Each trade chunk with the columns added by AsofJoiner.
+    """
+    joiner = AsofJoiner(allow_exact_matches, tolerance)
+    quote_chunks = iter(quote_chunks)
+    exhausted = False
+
+    for trades in trade_chunks:
+        if not len(trades):
+            continue
+        until = int(_to_ns(normalize_frame(trades)["timestamp"]).max())
+        while not exhausted and (
+            joiner.quotes_until is None or joiner.quotes_until < until
+        ):
+            quotes = next(quote_chunks, None)
+            if quotes is None:
+                exhausted = True
+            else:
+                joiner.add_quotes(quotes)
+        yield joiner.join(trades)
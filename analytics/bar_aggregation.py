@@ -0,0 +1,386 @@
+import math
+from collections import deque
+from typing import Dict, List, Optional, Tuple, Union
+
+import pandas as pd
+
+from brokerage_systems.alpaca_br.alpaca_defs import AlpacaSnapshot
+from definitions import BarData, QuoteData, TickerRecord, TradeData
+from persistence.persistence import PersistenceLayer
+from persistence.record_batch import RecordBatch
+from persistence.schema import normalize_frame
+
+ALLOWED_LATENESS_DEFAULT = 2.0  # Seconds
+TRADE_ID_HISTORY_DEFAULT = 1024  # Recent trade ids remembered per symbol
+
+
+class _BarRing:
+    """
+    Fixed-size ring of open bars of one symbol at one resolution.
+
+    Slot i holds the bar of bucket number b with b % size == i. The ring
+    only needs to span the allowed lateness, so its size is fixed.
+    """
+
+    __slots__ = (
+        "size",
+        "bucket",
+        "open",
+        "high",
+        "low",
+        "close",
+        "volume",
+        "notional",
+        "count",
+        "quote_open",
+        "quote_high",
+        "quote_low",
+        "quote_close",
+    )
+
+    def __init__(self, size: int):
+        self.size = size
+        self.bucket: List[Optional[int]] = [None] * size
+        self.open = [math.nan] * size
+        self.high = [math.nan] * size
+        self.low = [math.nan] * size
+        self.close = [math.nan] * size
+        self.volume = [0.0] * size
+        self.notional = [0.0] * size
+        self.count = [0] * size
+        self.quote_open = [math.nan] * size
+        self.quote_high = [math.nan] * size
+        self.quote_low = [math.nan] * size
+        self.quote_close = [math.nan] * size
+
+    def clear(self, i: int, bucket: Optional[int]):
+        self.bucket[i] = bucket
+        self.open[i] = self.high[i] = self.low[i] = self.close[i] = math.nan
+        self.volume[i] = self.notional[i] = 0.0
+        self.count[i] = 0
+        self.quote_open[i] = self.quote_high[i] = math.nan
+        self.quote_low[i] = self.quote_close[i] = math.nan
+
+    def bar(self, i: int, symbol: str, resolution: float) -> BarData:
+        """The bar of slot i. Bars without trades take their prices from the quote midpoints."""
+        if self.count[i]:
+            prices = (self.open[i], self.high[i], self.low[i], self.close[i])
+            vwap = (
+                self.notional[i] / self.volume[i] if self.volume[i] else self.close[i]
+            )
+        else:
+            prices = (
+                self.quote_open[i],
+                self.quote_high[i],
+                self.quote_low[i],
+                self.quote_close[i],
+            )
+            vwap = math.nan
+        return BarData(
+            close=prices[3],
+            high=prices[1],
+            low=prices[2],
+            open=prices[0],
+            symbol=symbol,
+            timestamp=float(self.bucket[i] * resolution),
+            trade_count=float(self.count[i]),
+            volume=self.volume[i],
+            vwap=vwap,
+        )
+
+
+class BarAggregator(PersistenceLayer):
+    """
+    Incremental OHLCV/VWAP bar aggregation stage.
+
+    Used as a persistence layer of a recorder, it turns the recorded trades
+    and quotes into bars at several resolutions as they arrive, and saves the
+    completed bars to the sinks of each resolution. Every event is an O(1)
+    update of a fixed-size per-symbol ring of open bars.
+
+    Accepts lists (or RecordBatches) of TradeData, QuoteData, TickerRecord and
+    AlpacaSnapshot records (their latest trade and quote) and trades
+    DataFrames as returned by AlpacaClient.get_trades. Trades repeated across
+    snapshots are counted once, by trade id.
+
+    Bars are closed by a per-symbol event-time watermark: the latest event
+    time seen for the symbol minus `allowed_lateness`. A bar is emitted once
+    its end passes the watermark of its symbol. Events more than
+    `allowed_lateness` behind the latest event time of their symbol, in the
+    same batch or an earlier one, are dropped and counted in `late_events`,
+    so they never evict an open bar newer than themselves. Symbols do not
+    hold each other back, nor make each other's events late: the first
+    snapshot of a symbol whose last trade is minutes old is still aggregated. The open bars of a
+    symbol are emitted by its next events, or on close().
+    Bars without trades take their prices from the quote midpoints and have
+    zero volume and a NaN VWAP; bars without any event are not emitted.
+    """
+
+    def __init__(
+        self,
+        sinks: Dict[float, List[PersistenceLayer]],
+        allowed_lateness: float = ALLOWED_LATENESS_DEFAULT,
+        trade_id_history: int = TRADE_ID_HISTORY_DEFAULT,
+    ):
+        """
+        Args:
+            sinks (Dict[float, List[PersistenceLayer]]): Bar resolution in seconds to the sinks of its bars, e.g. {1: [...], 60: [...]}.
+            allowed_lateness (float): Seconds an event may arrive behind the latest event time.
+            trade_id_history (int): Number of recent trade ids per symbol used to drop repeated trades.
+        """
+        super().__init__()
+        if not sinks:
+            raise ValueError("At least one bar resolution is required")
+
+        self._sinks = sinks
+        self._resolutions = sorted(sinks)
+        self._allowed_lateness = allowed_lateness
+        self._trade_id_history = trade_id_history
+
+        # Enough slots to hold every bar that may still receive events
+        self._ring_sizes = {
+            resolution: math.ceil(allowed_lateness / resolution) + 2
+            for resolution in self._resolutions
+        }
+        self._rings: Dict[str, Dict[float, _BarRing]] = {}
+        self._trade_ids: Dict[str, Tuple[set, deque]] = {}
+        self._last_quote: Dict[str, Tuple[float, float, float]] = {}
+
+        self._max_event_time: Dict[str, float] = {}
+        self._watermarks: Dict[str, float] = {}
+        self._touched = set()  # Symbols with events since the last _advance
+        self._pending: Dict[float, List[BarData]] = {r: [] for r in self._resolutions}
+        self.late_events = 0
+
+    def _symbol_rings(self, symbol: str) -> Dict[float, _BarRing]:
+        rings = self._rings.get(symbol)
+        if rings is None:
+            rings = self._rings[symbol] = {
+                resolution: _BarRing(self._ring_sizes[resolution])
+                for resolution in self._resolutions
+            }
+        return rings
+
+    def _slot(self, ring: _BarRing, symbol: str, resolution: float, bucket: int) -> int:
+        i = bucket % ring.size
+        if ring.bucket[i] != bucket:
+            # _is_late drops events older than the span of the ring, so the slot never holds a newer bar
+            if ring.bucket[i] is not None:
+                # The slot still holds an older bar, which is complete by now
+                self._pending[resolution].append(ring.bar(i, symbol, resolution))
+            ring.clear(i, bucket)
+        return i
+
+    def _is_late(self, symbol: str, timestamp: float) -> bool:
+        self._touched.add(symbol)
+        max_event_time = self._max_event_time.get(symbol, -math.inf)
+        if timestamp > max_event_time:
+            self._max_event_time[symbol] = max_event_time = timestamp
+        # Checked against the running latest event time, not only the watermark of
+        # earlier batches: an event further behind would need the ring slot of an open,
+        # newer bar (e.g. a snapshot quote lagging its own trade)
+        if timestamp < max(
+            max_event_time - self._allowed_lateness,
+            self._watermarks.get(symbol, -math.inf),
+        ):
+            self.late_events += 1
+            return True
+        return False
+
+    def _is_repeated_trade(self, symbol: str, trade_id) -> bool:
+        if trade_id is None:
+            return False
+        seen = self._trade_ids.get(symbol)
+        if seen is None:
+            seen = self._trade_ids[symbol] = (set(), deque())
+        ids, order = seen
+        if trade_id in ids:
+            return True
+        ids.add(trade_id)
+        order.append(trade_id)
+        if len(order) > self._trade_id_history:
+            ids.discard(order.popleft())
+        return False
+
+    def add_trade(
+        self, symbol: str, timestamp: float, price: float, size: float, trade_id=None
+    ):
+        """Add a trade to the open bars of its symbol."""
+        if self._is_repeated_trade(symbol, trade_id) or self._is_late(
+            symbol, timestamp
+        ):
+            return
+        for resolution, ring in self._symbol_rings(symbol).items():
+            bucket = int(timestamp // resolution)
+            i = self._slot(ring, symbol, resolution, bucket)
+            if not ring.count[i]:
+                ring.open[i] = ring.high[i] = ring.low[i] = price
+            elif price > ring.high[i]:
+                ring.high[i] = price
+            elif price < ring.low[i]:
+                ring.low[i] = price
+            ring.close[i] = price
+            ring.volume[i] += size
+            ring.notional[i] += price * size
+            ring.count[i] += 1
+
+    def add_quote(self, symbol: str, timestamp: float, bid: float, ask: float):
+        """Add a quote midpoint to the open bars of its symbol."""
+        quote = (timestamp, bid, ask)
+        if self._last_quote.get(symbol) == quote:
+            return  # Same quote as in the previous snapshot
+        self._last_quote[symbol] = quote
+        if self._is_late(symbol, timestamp):
+            return
+        mid = (bid + ask) / 2
+        for resolution, ring in self._symbol_rings(symbol).items():
+            bucket = int(timestamp // resolution)
+            i = self._slot(ring, symbol, resolution, bucket)
+            if math.isnan(ring.quote_open[i]):
+                ring.quote_open[i] = ring.quote_high[i] = ring.quote_low[i] = mid
+            elif mid > ring.quote_high[i]:
+                ring.quote_high[i] = mid
+            elif mid < ring.quote_low[i]:
+                ring.quote_low[i] = mid
+            ring.quote_close[i] = mid
+
+    def _add_trades(self, symbols, timestamps, prices, sizes, ids):
+        for symbol, timestamp, price, size, trade_id in zip(
+            symbols, timestamps, prices, sizes, ids
+        ):
+            if symbol is not None and not math.isnan(price):
+                self.add_trade(symbol, timestamp, price, size, trade_id)
+
+    def _add_quotes(self, symbols, timestamps, bids, asks):
+        for symbol, timestamp, bid, ask in zip(symbols, timestamps, bids, asks):
+            if symbol is not None and bid > 0 and ask > 0:
+                self.add_quote(symbol, timestamp, bid, ask)
+
+    def _add_batch(self, batch: RecordBatch):
+        def column(name: str) -> list:
+            return batch.column(name).tolist()
+
+        record_type = batch.record_type
+        if record_type is AlpacaSnapshot:
+            trade, quote = "latest_trade_", "latest_quote_"
+        elif record_type is TradeData:
+            trade, quote = "", None
+        elif record_type is QuoteData:
+            trade, quote = None, ""
+        elif record_type is TickerRecord:
+            symbols, timestamps = column("symbol"), column("timestamp")
+            self._add_quotes(symbols, timestamps, column("bid"), column("ask"))
+            return
+        else:
+            raise TypeError(
+                f"Cannot aggregate {record_type.__name__} records into bars"
+            )
+
+        if trade is not None:
+            self._add_trades(
+                column(f"{trade}symbol"),
+                column(f"{trade}timestamp"),
+                column(f"{trade}price"),
+                column(f"{trade}size"),
+                column(f"{trade}id"),
+            )
+        if quote is not None:
+            self._add_quotes(
+                column(f"{quote}symbol"),
+                column(f"{quote}timestamp"),
+                column(f"{quote}bid_price"),
+                column(f"{quote}ask_price"),
+            )
+
+    def _add_frame(self, df: pd.DataFrame):
+        """Trades (or quotes) DataFrame with symbol and timestamp columns, as returned by Alpaca."""
+        df = normalize_frame(df)
+        timestamps = df["timestamp"]
+        if pd.api.types.is_datetime64_any_dtype(timestamps.dtype):
+            epoch = pd.Timestamp(0, tz=getattr(timestamps.dtype, "tz", None))
+            timestamps = (timestamps - epoch) / pd.Timedelta(seconds=1)
+        timestamps = timestamps.tolist()
+
+        if "price" in df.columns:
+            ids = df["id"].tolist() if "id" in df.columns else [None] * len(df)
+            self._add_trades(
+                df["symbol"].tolist(),
+                timestamps,
+                df["price"].astype(float).tolist(),
+                df["size"].astype(float).tolist(),
+                ids,
+            )
+        elif "bid_price" in df.columns:
+            self._add_quotes(
+                df["symbol"].tolist(),
+                timestamps,
+                df["bid_price"].tolist(),
+                df["ask_price"].tolist(),
+            )
+        else:
+            raise ValueError("DataFrame has neither trade nor quote columns")
+
+    def _advance(self, final: bool = False):
+        """
+        Emit every open bar that ends at or before the watermark of its symbol.
+
+        Only the symbols with new events can have moved their watermark, unless
+        final, which emits all open bars.
+        """
+        symbols = list(self._rings) if final else self._touched
+        for symbol in symbols:
+            rings = self._rings.get(symbol)
+            if rings is None:
+                continue
+            if final:
+                watermark = math.inf
+            else:
+                watermark = self._max_event_time[symbol] - self._allowed_lateness
+            if watermark > self._watermarks.get(symbol, -math.inf):
+                self._watermarks[symbol] = watermark
+            for resolution, ring in rings.items():
+                for i, bucket in enumerate(ring.bucket):
+                    if bucket is not None and (bucket + 1) * resolution <= watermark:
+                        self._pending[resolution].append(
+                            ring.bar(i, symbol, resolution)
+                        )
+                        ring.clear(i, None)
+        self._touched = set()
+
+        for resolution, bars in self._pending.items():
+            if not bars:
+                continue
+            bars.sort(key=lambda bar: (bar.timestamp, bar.symbol))
+            for sink in self._sinks[resolution]:
+                sink.save_data(bars)
+            self._pending[resolution] = []
+
+    def save_data(self, data: Union[List[tuple], RecordBatch, pd.DataFrame]):
+        """
+        Aggregate a batch of trades and quotes and emit the bars it completes.
+
+        Args:
+            data (Union[List[tuple], RecordBatch, pd.DataFrame]): Records, a RecordBatch or a trades DataFrame.
+        """
+        if len(data) == 0:
+            return
+        if isinstance(data, pd.DataFrame):
+            self._add_frame(data)
+        elif isinstance(data, RecordBatch):
+            self._add_batch(data)
+        else:
+            self._add_batch(RecordBatch.from_records(data))
+
+        self._advance()
+
+    def _rotate_files(self):
+        for sinks in self._sinks.values():
+            for sink in sinks:
+                sink._rotate_files()
+
+    def close(self):
+        """Emit all open bars and close the bar sinks."""
+        self._advance(final=True)
+        for sinks in self._sinks.values():
+            for sink in sinks:
+                sink.close()
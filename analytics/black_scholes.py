@@ -0,0 +1,384 @@
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Optional, Union
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+from analytics.occ import CONTRACT_COLUMNS, expiry_days, parse_occ_symbols
+
+DAYS_PER_YEAR = 365.0
+SIGMA_MIN = 1e-4
+SIGMA_MAX = 5.0
+IV_TOLERANCE_DEFAULT = 1e-8  # Absolute price tolerance
+IV_MAX_ITERATIONS_DEFAULT = 50
+
+GREEK_COLUMNS = ("delta", "gamma", "theta", "vega", "rho")
+
+# US equity options expire at the close, 16:00 New York time (20:00 or 21:00 UTC)
+_EXPIRY_CLOSE = time(16)
+_EXPIRY_TIMEZONE = ZoneInfo("America/New_York")
+_EPOCH_DATE = date(1970, 1, 1)
+
+
+def norm_pdf(x: np.ndarray) -> np.ndarray:
+    return np.exp(-0.5 * x * x) / np.sqrt(2 * np.pi)
+
+
+def norm_cdf(x: np.ndarray) -> np.ndarray:
+    """
+    Standard normal CDF, NumPy only.
+
+    Hart's double precision rational approximation (as given by West, "Better
+    approximations to cumulative normal functions"), accurate to about 1e-14
+    so that deep in-the-money prices are not off by more than the IV tolerance.
+    """
+    x = np.asarray(x, dtype=float)
+    z = np.abs(x)
+    pdf = np.exp(-0.5 * z * z)
+
+    numerator = 3.52624965998911e-02 * z + 0.700383064443688
+    for coefficient in (
+        6.37396220353165,
+        33.912866078383,
+        112.079291497871,
+        221.213596169931,
+        220.206867912376,
+    ):
+        numerator = numerator * z + coefficient
+    denominator = 8.83883476483184e-02 * z + 1.75566716318264
+    for coefficient in (
+        16.064177579207,
+        86.7807322029461,
+        296.564248779674,
+        637.333633378831,
+        793.826512519948,
+        440.413735824752,
+    ):
+        denominator = denominator * z + coefficient
+
+    # Continued fraction for the tail
+    with np.errstate(divide="ignore"):
+        fraction = z + 1 / (z + 2 / (z + 3 / (z + 4 / (z + 0.65))))
+    tail = np.where(
+        z < 7.07106781186547,
+        pdf * numerator / denominator,
+        pdf / (fraction * 2.506628274631),
+    )
+    return np.where(x > 0, 1.0 - tail, tail)
+
+
+def _d1_d2(spot, strike, years, rate, dividend_yield, sigma):
+    sqrt_t = np.sqrt(years)
+    d1 = (
+        np.log(spot / strike) + (rate - dividend_yield + 0.5 * sigma * sigma) * years
+    ) / (sigma * sqrt_t)
+    return d1, d1 - sigma * sqrt_t
+
+
+def bs_price(spot, strike, years, rate, dividend_yield, sigma, is_call) -> np.ndarray:
+    """
+    Black-Scholes-Merton price of European options, vectorized over all arguments.
+
+    Args:
+        spot: Underlying price.
+        strike: Strike price.
+        years: Time to expiry in years.
+        rate: Continuously compounded risk-free rate.
+        dividend_yield: Continuous dividend yield.
+        sigma: Volatility.
+        is_call: True for calls, False for puts.
+    """
+    d1, d2 = _d1_d2(spot, strike, years, rate, dividend_yield, sigma)
+    spot_df = spot * np.exp(-dividend_yield * years)
+    strike_df = strike * np.exp(-rate * years)
+    call = spot_df * norm_cdf(d1) - strike_df * norm_cdf(d2)
+    put = strike_df * norm_cdf(-d2) - spot_df * norm_cdf(-d1)
+    return np.where(is_call, call, put)
+
+
+def _vega(spot, years, dividend_yield, d1) -> np.ndarray:
+    """Vega per unit of volatility."""
+    return spot * np.exp(-dividend_yield * years) * norm_pdf(d1) * np.sqrt(years)
+
+
+def greeks(
+    spot, strike, years, rate, dividend_yield, sigma, is_call
+) -> Dict[str, np.ndarray]:
+    """
+    Black-Scholes-Merton greeks, vectorized over all arguments.
+
+    Theta is per calendar day; vega and rho are per 1 percentage point of
+    volatility and rate, the conventions of the Alpaca (OPRA) greeks.
+
+    Returns:
+        Dict[str, np.ndarray]: delta, gamma, theta, vega and rho.
+    """
+    d1, d2 = _d1_d2(spot, strike, years, rate, dividend_yield, sigma)
+    sqrt_t = np.sqrt(years)
+    spot_df = spot * np.exp(-dividend_yield * years)
+    strike_df = strike * np.exp(-rate * years)
+    pdf_d1 = norm_pdf(d1)
+
+    call_delta = np.exp(-dividend_yield * years) * norm_cdf(d1)
+    put_delta = call_delta - np.exp(-dividend_yield * years)
+
+    decay = -spot_df * pdf_d1 * sigma / (2 * sqrt_t)
+    call_theta = (
+        decay
+        - rate * strike_df * norm_cdf(d2)
+        + dividend_yield * spot_df * norm_cdf(d1)
+    )
+    put_theta = (
+        decay
+        + rate * strike_df * norm_cdf(-d2)
+        - dividend_yield * spot_df * norm_cdf(-d1)
+    )
+
+    return {
+        "delta": np.where(is_call, call_delta, put_delta),
+        "gamma": np.exp(-dividend_yield * years) * pdf_d1 / (spot * sigma * sqrt_t),
+        "theta": np.where(is_call, call_theta, put_theta) / DAYS_PER_YEAR,
+        "vega": _vega(spot, years, dividend_yield, d1) / 100,
+        "rho": np.where(
+            is_call,
+            strike_df * years * norm_cdf(d2),
+            -strike_df * years * norm_cdf(-d2),
+        )
+        / 100,
+    }
+
+
+def implied_volatility(
+    price,
+    spot,
+    strike,
+    years,
+    rate,
+    dividend_yield,
+    is_call,
+    tolerance: float = IV_TOLERANCE_DEFAULT,
+    max_iterations: int = IV_MAX_ITERATIONS_DEFAULT,
+) -> np.ndarray:
+    """
+    Implied volatility of option prices, vectorized.
+
+    Every contract is solved by Newton's method on volatility, safeguarded by
+    a bisection bracket [SIGMA_MIN, SIGMA_MAX]: whenever a Newton step leaves
+    the bracket (or vega vanishes) the contract takes a bisection step
+    instead. Prices outside the no-arbitrage bounds, and contracts that do not
+    converge, get NaN.
+
+    Returns:
+        np.ndarray: Implied volatilities.
+    """
+    price, spot, strike, years, rate, dividend_yield, is_call = np.broadcast_arrays(
+        *(
+            np.asarray(value, dtype=float if i < 6 else bool)
+            for i, value in enumerate(
+                (price, spot, strike, years, rate, dividend_yield, is_call)
+            )
+        )
+    )
+
+    spot_df = spot * np.exp(-dividend_yield * years)
+    strike_df = strike * np.exp(-rate * years)
+    lower = np.where(
+        is_call, np.maximum(spot_df - strike_df, 0), np.maximum(strike_df - spot_df, 0)
+    )
+    upper = np.where(is_call, spot_df, strike_df)
+    valid = (
+        np.isfinite(price)
+        & np.isfinite(spot)
+        & (years > 0)
+        & (spot > 0)
+        & (strike > 0)
+        & (price > lower)
+        & (price < upper)
+    )
+
+    sigma = np.full(price.shape, np.nan)
+    index = np.flatnonzero(valid)
+    if not len(index):
+        return sigma
+
+    p, s, k, t = price[index], spot[index], strike[index], years[index]
+    r, q, c = rate[index], dividend_yield[index], is_call[index]
+    low = np.full(len(index), SIGMA_MIN)
+    high = np.full(len(index), SIGMA_MAX)
+    # Brenner-Subrahmanyam initial guess, kept inside the bracket
+    guess = np.sqrt(2 * np.pi / t) * p / s
+    x = np.clip(np.where(np.isfinite(guess), guess, 0.2), 0.01, 2.0)
+    converged = np.zeros(len(index), dtype=bool)
+
+    active = np.arange(len(index))
+    for _ in range(max_iterations):
+        xa = x[active]
+        args = (s[active], k[active], t[active], r[active], q[active])
+        d1, _d2 = _d1_d2(*args, xa)
+        diff = bs_price(*args, xa, c[active]) - p[active]
+
+        done = np.abs(diff) < tolerance
+        converged[active[done]] = True
+
+        # Price increases with volatility: shrink the bracket around the root
+        too_high = diff > 0
+        high[active] = np.where(too_high, xa, high[active])
+        low[active] = np.where(too_high, low[active], xa)
+
+        vega = _vega(args[0], args[2], args[4], d1)
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            newton = xa - diff / vega
+        in_bracket = (newton > low[active]) & (newton < high[active]) & (vega > 1e-12)
+        x[active] = np.where(
+            done,
+            xa,
+            np.where(in_bracket, newton, 0.5 * (low[active] + high[active])),
+        )
+
+        active = active[~done]
+        if not len(active):
+            break
+
+    sigma[index[converged]] = x[converged]
+    return sigma
+
+
+def years_to_expiry(expiry: np.ndarray, now: Union[float, np.ndarray]) -> np.ndarray:
+    """
+    Time to the expiry close in years.
+
+    Args:
+        expiry: Expiry dates as days since the epoch (see analytics.occ.expiry_days).
+        now: Valuation time in epoch seconds.
+    """
+    return (expiry_close(expiry) - now) / (86400 * DAYS_PER_YEAR)
+
+
+def expiry_close(expiry: np.ndarray) -> np.ndarray:
+    """
+    Epoch seconds of the close (16:00 New York time) on expiry days.
+
+    The UTC offset follows daylight saving time, so it is looked up once per
+    distinct expiry day.
+
+    Args:
+        expiry: Expiry dates as days since the epoch. NaN stays NaN.
+    """
+    expiry = np.asarray(expiry, dtype=float)
+    close = np.full(expiry.shape, np.nan)
+    valid = ~np.isnan(expiry)
+    days, inverse = np.unique(expiry[valid], return_inverse=True)
+    closes = np.array(
+        [
+            datetime.combine(
+                _EPOCH_DATE + timedelta(days=int(day)),
+                _EXPIRY_CLOSE,
+                tzinfo=_EXPIRY_TIMEZONE,
+            ).timestamp()
+            for day in days
+        ]
+    )
+    close[valid] = closes[inverse] if len(days) else closes
+    return close
+
+
+def enrich_option_chain(
+    df: pd.DataFrame,
+    spot: Union[float, Dict[str, float]],
+    rate: float = 0.04,
+    dividend_yield: Union[float, Dict[str, float]] = 0.0,
+    valuation_time: Optional[datetime] = None,
+    overwrite: bool = False,
+) -> pd.DataFrame:
+    """
+    Fill in implied volatility and greeks of an option chain DataFrame.
+
+    Implied volatilities are solved from the quote midpoints and the greeks
+    are computed from them, for the whole chain at once. Only missing values
+    are filled, unless overwrite is set, so the values provided by Alpaca are
+    kept.
+
+    Args:
+        df (pd.DataFrame): Option chain rows as returned by AlpacaClient.get_option_chain.
+        spot (Union[float, Dict[str, float]]): Underlying price, or prices by underlying symbol.
+        rate (float): Continuously compounded risk-free rate.
+        dividend_yield (Union[float, Dict[str, float]]): Continuous dividend yield, or yields by underlying symbol.
+        valuation_time (Optional[datetime]): Time of the quotes. Defaults to the insert_timestamp column, else now.
+        overwrite (bool): Replace the values provided by Alpaca as well.
+
+    Returns:
+        pd.DataFrame: A copy of df with implied_volatility and the greek columns filled in.
+    """
+    df = df.copy()
+    if not len(df):
+        return df
+
+    if all(column in df.columns for column in CONTRACT_COLUMNS):
+        contracts = df[list(CONTRACT_COLUMNS)]
+    else:
+        contracts = parse_occ_symbols(df["symbol"])
+    underlying = contracts["underlying"].astype(object)
+    if isinstance(spot, dict):
+        spot_values = underlying.map(spot).astype(float).to_numpy()
+    else:
+        spot_values = np.full(len(df), float(spot))
+    if isinstance(dividend_yield, dict):
+        yields = underlying.map(dividend_yield).fillna(0.0).astype(float).to_numpy()
+    else:
+        yields = np.full(len(df), float(dividend_yield))
+
+    if valuation_time is not None:
+        now = pd.Timestamp(valuation_time)
+        now = now.tz_localize("UTC") if now.tzinfo is None else now
+        now = np.full(len(df), now.timestamp())
+    elif "insert_timestamp" in df.columns:
+        inserted = pd.to_datetime(df["insert_timestamp"], utc=True)
+        now = (
+            (inserted - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)
+        ).to_numpy()
+    else:
+        now = np.full(len(df), datetime.now(timezone.utc).timestamp())
+    years = years_to_expiry(expiry_days(contracts["expiry"]), now)
+
+    bid = df["bid_price"].to_numpy(dtype=float)
+    ask = df["ask_price"].to_numpy(dtype=float)
+    mid = np.where((bid > 0) & (ask > 0), (bid + ask) / 2, np.nan)
+
+    strike = contracts["strike_mills"].to_numpy() / 1000
+    is_call = contracts["is_call"].to_numpy()
+
+    columns = ("implied_volatility",) + GREEK_COLUMNS
+    for column in columns:
+        if column not in df.columns:
+            df[column] = np.nan
+    missing = np.ones(len(df), dtype=bool)
+    if not overwrite:
+        missing = df[list(columns)].isna().any(axis=1).to_numpy()
+    if not missing.any():
+        return df
+
+    known_iv = df["implied_volatility"].to_numpy(dtype=float)
+    solved_iv = np.full(len(df), np.nan)
+    rows = np.flatnonzero(missing)
+    solved_iv[rows] = implied_volatility(
+        mid[rows],
+        spot_values[rows],
+        strike[rows],
+        years[rows],
+        rate,
+        yields[rows],
+        is_call[rows],
+    )
+    # Greeks of rows with a known IV are computed from that IV
+    sigma = np.where(np.isnan(known_iv) | overwrite, solved_iv, known_iv)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = greeks(spot_values, strike, years, rate, yields, sigma, is_call)
+    values["implied_volatility"] = sigma
+
+    for column in columns:
+        current = df[column].to_numpy(dtype=float)
+        fill = missing & (np.isnan(current) | overwrite)
+        df[column] = np.where(fill, values[column], current)
+    return df
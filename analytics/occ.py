@@ -0,0 +1,207 @@
+import threading
+from typing import Iterable, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Every OCC symbol ends with YYMMDD, C or P and the strike in mills (8 digits),
+# e.g. "SPY250303C00593000": SPY, 2025-03-03, call, strike 593.000
+OCC_SUFFIX_LENGTH = 15
+CACHE_SIZE_DEFAULT = 1_000_000
+
+CONTRACT_COLUMNS = ("underlying", "expiry", "is_call", "strike_mills")
+
+_ZERO = ord("0")
+_CALL = ord("C")
+_PUT = ord("P")
+
+
+def _to_bytes(symbols: np.ndarray) -> np.ndarray:
+    """Fixed width bytes array of the symbols."""
+    try:
+        return symbols.astype("S")
+    except UnicodeEncodeError:
+        raise ValueError("OCC symbols must be ASCII")
+
+
+def _decode(symbols: np.ndarray):
+    """
+    Decode OCC symbols in bulk, on the bytes of the symbols.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: Roots (bytes), expiries
+        (days since the epoch), call flags and strikes in mills.
+    """
+    encoded = _to_bytes(symbols)
+    count, width = len(encoded), encoded.dtype.itemsize
+    if count == 0:
+        return (
+            np.empty(0, dtype="S1"),
+            np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=bool),
+            np.empty(0, dtype=np.int64),
+        )
+
+    chars = encoded.view(np.uint8).reshape(count, width)
+    lengths = np.count_nonzero(chars, axis=1)
+    if width <= OCC_SUFFIX_LENGTH or (lengths <= OCC_SUFFIX_LENGTH).any():
+        bad = symbols[np.argmax(lengths <= OCC_SUFFIX_LENGTH)]
+        raise ValueError(f"Not an OCC option symbol: {bad!r}")
+
+    # The 15 suffix characters of every symbol, right aligned
+    suffix_start = lengths - OCC_SUFFIX_LENGTH
+    suffix = chars[
+        np.arange(count)[:, None],
+        suffix_start[:, None] + np.arange(OCC_SUFFIX_LENGTH),
+    ]
+    digits = suffix.astype(np.int64) - _ZERO
+    kinds = suffix[:, 6]
+    valid = ((digits[:, :6] >= 0) & (digits[:, :6] <= 9)).all(axis=1)
+    valid &= ((digits[:, 7:] >= 0) & (digits[:, 7:] <= 9)).all(axis=1)
+    valid &= (kinds == _CALL) | (kinds == _PUT)
+    if not valid.all():
+        raise ValueError(f"Not an OCC option symbol: {symbols[np.argmin(valid)]!r}")
+
+    year = 2000 + digits[:, 0] * 10 + digits[:, 1]
+    month = digits[:, 2] * 10 + digits[:, 3]
+    day = digits[:, 4] * 10 + digits[:, 5]
+    months = ((year - 1970) * 12 + month - 1).astype("datetime64[M]")
+    expiry = (months.astype("datetime64[D]") + (day - 1)).astype(np.int64)
+
+    strike = digits[:, 7:] @ (10 ** np.arange(7, -1, -1, dtype=np.int64))
+
+    # Blank out the suffixes; trailing NUL bytes are dropped from "S" values
+    roots = chars.copy()
+    roots[np.arange(width) >= suffix_start[:, None]] = 0
+    roots = roots.view(f"S{width}").ravel()
+
+    return roots, expiry.astype(np.int32), kinds == _CALL, strike
+
+
+class OccSymbolParser:
+    """
+    Vectorized parser of OCC option symbols, with a cache of parsed symbols.
+
+    Symbols are decoded on their bytes as a whole, without per-symbol Python
+    work. A chain is polled over and over with mostly the same contracts, so
+    parsed symbols are kept in a hash index: a call looks all its symbols up
+    in one go and only decodes the ones it has not seen. The cache is reset
+    once it holds `max_size` symbols, which drops expired contracts.
+    """
+
+    def __init__(self, max_size: int = CACHE_SIZE_DEFAULT):
+        """
+        Args:
+            max_size (int): Number of cached symbols above which the cache is reset.
+        """
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._symbols = pd.Index([], dtype=object)
+        self._roots: list = []  # Distinct underlyings, as bytes
+        self._root_codes = np.empty(0, dtype=np.int32)
+        self._expiry = np.empty(0, dtype=np.int32)
+        self._is_call = np.empty(0, dtype=bool)
+        self._strike = np.empty(0, dtype=np.int64)
+
+    def _add(self, symbols: np.ndarray):
+        """Decode symbols and add them to the cache."""
+        roots, expiry, is_call, strike = _decode(symbols)
+
+        codes, distinct = pd.factorize(roots)
+        known = {root: code for code, root in enumerate(self._roots)}
+        mapping = np.array(
+            [known.setdefault(root, len(known)) for root in distinct.tolist()],
+            dtype=np.int32,
+        )
+        self._roots = list(known)
+
+        self._symbols = self._symbols.append(pd.Index(symbols, dtype=object))
+        self._root_codes = np.concatenate([self._root_codes, mapping[codes]])
+        self._expiry = np.concatenate([self._expiry, expiry])
+        self._is_call = np.concatenate([self._is_call, is_call])
+        self._strike = np.concatenate([self._strike, strike])
+
+    def parse(self, symbols: Union[pd.Series, Iterable[str]]) -> pd.DataFrame:
+        """
+        Split OCC symbols into their parts.
+
+        Args:
+            symbols (Union[pd.Series, Iterable[str]]): OCC option symbols, e.g. "SPY250303C00593000".
+
+        Returns:
+            pd.DataFrame: One row per symbol (with the index of a given Series):
+            underlying (categorical), expiry (date32), is_call (bool) and
+            strike_mills (int64, the strike in tenths of a cent).
+
+        Raises:
+            ValueError: If a symbol is not an OCC option symbol.
+        """
+        index = symbols.index if isinstance(symbols, pd.Series) else None
+        values = np.asarray(
+            symbols.astype(str) if isinstance(symbols, pd.Series) else list(symbols),
+            dtype=object,
+        )
+
+        with self._lock:
+            positions = self._symbols.get_indexer(values)
+            missing = positions < 0
+            if missing.any():
+                new = pd.unique(values[missing])
+                if len(self._symbols) + len(new) > self._max_size:
+                    self._reset()
+                    new = pd.unique(values)
+                self._add(new)
+                positions = self._symbols.get_indexer(values)
+
+            root_codes = self._root_codes[positions]
+            roots = [root.decode("ascii") for root in self._roots]
+            expiry = self._expiry[positions]
+            is_call = self._is_call[positions]
+            strike = self._strike[positions]
+
+        return pd.DataFrame(
+            {
+                "underlying": pd.Categorical.from_codes(root_codes, categories=roots),
+                "expiry": pd.array(
+                    pa.array(expiry, type=pa.int32()).cast(pa.date32()),
+                    dtype=pd.ArrowDtype(pa.date32()),
+                ),
+                "is_call": is_call,
+                "strike_mills": strike,
+            },
+            index=index,
+        )
+
+    def __len__(self) -> int:
+        return len(self._symbols)
+
+
+_PARSER = OccSymbolParser()
+
+
+def parse_occ_symbols(symbols: Union[pd.Series, Iterable[str]]) -> pd.DataFrame:
+    """
+    Split OCC symbols into underlying, expiry, is_call and strike_mills columns.
+
+    Uses a process wide OccSymbolParser, so symbols seen before are not decoded again.
+    """
+    return _PARSER.parse(symbols)
+
+
+def add_contract_columns(
+    df: pd.DataFrame, symbol_column: str = "symbol"
+) -> pd.DataFrame:
+    """Add the parsed contract columns of the OCC symbols of df, in place. Returns df."""
+    contracts = parse_occ_symbols(df[symbol_column])
+    for column in CONTRACT_COLUMNS:
+        df[column] = contracts[column]
+    return df
+
+
+def expiry_days(expiry: pd.Series) -> np.ndarray:
+    """Days since the epoch of a date32 expiry column."""
+    return pa.array(expiry).cast(pa.int32()).to_numpy(zero_copy_only=False)
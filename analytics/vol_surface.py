@@ -0,0 +1,462 @@
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timezone
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from analytics.black_scholes import DAYS_PER_YEAR, years_to_expiry
+from analytics.occ import CONTRACT_COLUMNS, expiry_days, parse_occ_symbols
+
+MONEYNESS_MIN_DEFAULT = 0.5
+MONEYNESS_MAX_DEFAULT = 1.5
+MONEYNESS_STEPS_DEFAULT = 100  # Strike / spot steps of 1%
+TENOR_STEP_DEFAULT = 7 / DAYS_PER_YEAR  # Weekly tenors
+TENOR_STEPS_DEFAULT = 104  # Up to two years
+REBASE_THRESHOLD_DEFAULT = 0.02
+CACHE_SIZE_DEFAULT = 64
+
+_EPOCH = date(1970, 1, 1)
+
+
+def _epoch_seconds(value: Union[datetime, pd.Timestamp, float]) -> float:
+    if isinstance(value, (int, float, np.floating)):
+        return float(value)
+    value = pd.Timestamp(value)
+    if value.tzinfo is None:
+        value = value.tz_localize("UTC")
+    return value.timestamp()
+
+
+def _as_days(expiry) -> np.ndarray:
+    """Expiry dates (dates, datetimes or days since the epoch) as days since the epoch."""
+    if isinstance(expiry, (date, datetime)):
+        expiry = [expiry]
+    values = np.asarray(expiry)
+    if values.dtype.kind in "iuf":
+        return values.astype(np.int64)
+    if values.dtype.kind == "M":
+        return values.astype("datetime64[D]").astype(np.int64)
+    return np.array(
+        [
+            ((value.date() if isinstance(value, datetime) else value) - _EPOCH).days
+            for value in values.ravel()
+        ],
+        dtype=np.int64,
+    ).reshape(values.shape)
+
+
+def _smile(
+    strikes: np.ndarray,
+    is_call: np.ndarray,
+    iv: np.ndarray,
+    grid_strikes: np.ndarray,
+    spot: float,
+) -> np.ndarray:
+    """
+    IV of one expiry on the strike grid.
+
+    Out of the money contracts (puts below the spot, calls above) are used
+    where a strike has both. Linear between strikes, flat beyond the
+    outermost ones. All NaN if the expiry has no IV.
+    """
+    valid = np.isfinite(iv) & (iv > 0)
+    if not valid.any():
+        return np.full(len(grid_strikes), np.nan)
+    strikes, is_call, iv = strikes[valid], is_call[valid], iv[valid]
+
+    out_of_the_money = is_call == (strikes >= spot)
+    # Sort by strike, out of the money contracts first, and keep one per strike
+    order = np.lexsort((~out_of_the_money, strikes))
+    strikes, iv = strikes[order], iv[order]
+    first = np.r_[True, strikes[1:] != strikes[:-1]]
+    return np.interp(grid_strikes, strikes[first], iv[first])
+
+
+class VolSurface:
+    """
+    Gridded implied volatility surface of one underlying at one chain snapshot.
+
+    The grid is moneyness (strike / reference spot) by tenor (years), both
+    uniformly spaced, so a lookup is index arithmetic plus a bilinear
+    interpolation: O(1) per point, vectorized over arrays of points.
+
+    Every expiry's smile is interpolated over strike onto the moneyness grid,
+    and the smiles are interpolated linearly in total variance (IV^2 * tenor)
+    onto the tenor grid, flat in IV beyond the first and last expiries.
+
+    Smiles are kept per expiry in strike terms (sticky strike) relative to
+    the reference spot. An update from a newer snapshot only rebuilds the
+    smiles of expiries whose contracts changed, unless the spot moved by more
+    than the rebase threshold, which rebuilds them all around the new spot.
+    """
+
+    def __init__(
+        self,
+        underlying: str,
+        timestamp: float,
+        spot: float,
+        moneyness: np.ndarray,
+        tenors: np.ndarray,
+        contracts: pd.DataFrame,
+        smiles: Dict[int, np.ndarray],
+    ):
+        """
+        Use VolSurface.build or VolSurfaceCache.update instead.
+
+        Args:
+            underlying (str): Underlying symbol.
+            timestamp (float): Snapshot time in epoch seconds.
+            spot (float): Reference spot price of the moneyness grid.
+            moneyness (np.ndarray): Uniform moneyness grid.
+            tenors (np.ndarray): Uniform tenor grid in years.
+            contracts (pd.DataFrame): expiry (days since the epoch), strike, is_call and iv by OCC symbol.
+            smiles (Dict[int, np.ndarray]): IV on the moneyness grid by expiry.
+        """
+        self.underlying = underlying
+        self.timestamp = timestamp
+        self.spot = spot
+        self.moneyness = moneyness
+        self.tenors = tenors
+        self._contracts = contracts
+        self._smiles = smiles
+        self.grid = self._grid()
+
+    @staticmethod
+    def _contract_frame(chain: pd.DataFrame) -> pd.DataFrame:
+        """expiry, strike, is_call and iv of the chain rows, by symbol."""
+        if all(column in chain.columns for column in CONTRACT_COLUMNS):
+            contracts = chain[list(CONTRACT_COLUMNS)]
+        else:
+            contracts = parse_occ_symbols(chain["symbol"])
+        frame = pd.DataFrame(
+            {
+                "expiry": expiry_days(contracts["expiry"]).astype(np.int64),
+                "strike": contracts["strike_mills"].to_numpy() / 1000,
+                "is_call": contracts["is_call"].to_numpy(dtype=bool),
+                "iv": chain["implied_volatility"].to_numpy(dtype=float),
+            },
+            index=pd.Index(chain["symbol"].astype(str).to_numpy(), name="symbol"),
+        )
+        # The latest row of a symbol wins
+        return frame[~frame.index.duplicated(keep="last")]
+
+    @classmethod
+    def build(
+        cls,
+        underlying: str,
+        chain: pd.DataFrame,
+        spot: float,
+        timestamp: Union[datetime, float],
+        moneyness: Optional[np.ndarray] = None,
+        tenors: Optional[np.ndarray] = None,
+    ) -> "VolSurface":
+        """
+        Build the surface of one underlying from its chain rows.
+
+        Args:
+            underlying (str): Underlying symbol.
+            chain (pd.DataFrame): Chain rows of the underlying with implied_volatility (see enrich_option_chain).
+            spot (float): Underlying price.
+            timestamp (Union[datetime, float]): Snapshot time.
+            moneyness (Optional[np.ndarray]): Uniform moneyness grid. 0.5 to 1.5 in steps of 1% by default.
+            tenors (Optional[np.ndarray]): Uniform tenor grid in years. Weekly up to two years by default.
+
+        Returns:
+            VolSurface: The surface.
+        """
+        if moneyness is None:
+            moneyness = np.linspace(
+                MONEYNESS_MIN_DEFAULT,
+                MONEYNESS_MAX_DEFAULT,
+                MONEYNESS_STEPS_DEFAULT + 1,
+            )
+        if tenors is None:
+            tenors = TENOR_STEP_DEFAULT * np.arange(1, TENOR_STEPS_DEFAULT + 1)
+
+        return cls._from_contracts(
+            underlying,
+            cls._contract_frame(chain),
+            spot,
+            _epoch_seconds(timestamp),
+            moneyness,
+            tenors,
+        )
+
+    @classmethod
+    def _from_contracts(
+        cls,
+        underlying: str,
+        contracts: pd.DataFrame,
+        spot: float,
+        timestamp: float,
+        moneyness: np.ndarray,
+        tenors: np.ndarray,
+    ) -> "VolSurface":
+        alive = years_to_expiry(contracts["expiry"].to_numpy(), timestamp) > 0
+        contracts = contracts[alive]
+        smiles = cls._smiles_of(
+            contracts, contracts["expiry"].unique(), moneyness, spot
+        )
+        return cls(underlying, timestamp, spot, moneyness, tenors, contracts, smiles)
+
+    @staticmethod
+    def _smiles_of(
+        contracts: pd.DataFrame, expiries, moneyness: np.ndarray, spot: float
+    ) -> Dict[int, np.ndarray]:
+        grid_strikes = moneyness * spot
+        smiles = {}
+        for expiry, rows in contracts[contracts["expiry"].isin(expiries)].groupby(
+            "expiry", sort=False
+        ):
+            smiles[int(expiry)] = _smile(
+                rows["strike"].to_numpy(),
+                rows["is_call"].to_numpy(),
+                rows["iv"].to_numpy(),
+                grid_strikes,
+                spot,
+            )
+        return smiles
+
+    def updated(
+        self,
+        chain: pd.DataFrame,
+        timestamp: Union[datetime, float],
+        spot: float,
+        rebase_threshold: float = REBASE_THRESHOLD_DEFAULT,
+    ) -> "VolSurface":
+        """
+        Surface of a newer snapshot, rebuilding only what changed.
+
+        Args:
+            chain (pd.DataFrame): Chain rows of the underlying. May hold only the contracts that changed;
+                contracts that are not in it keep their previous IV.
+            timestamp (Union[datetime, float]): Snapshot time.
+            spot (float): Underlying price.
+            rebase_threshold (float): Relative spot move that rebuilds every smile around the new spot.
+
+        Returns:
+            VolSurface: The new surface. This one is left unchanged.
+        """
+        timestamp = _epoch_seconds(timestamp)
+        new = self._contract_frame(chain)
+        if abs(spot / self.spot - 1) > rebase_threshold:
+            merged = pd.concat([self._contracts, new])
+            return VolSurface._from_contracts(
+                self.underlying,
+                merged[~merged.index.duplicated(keep="last")],
+                spot,
+                timestamp,
+                self.moneyness,
+                self.tenors,
+            )
+
+        previous = self._contracts["iv"].reindex(new.index)
+        changed = ~(
+            np.isclose(new["iv"], previous, rtol=0, atol=1e-9)
+            | (new["iv"].isna() & previous.isna())
+        )
+
+        contracts = pd.concat(
+            [self._contracts.drop(new.index[changed], errors="ignore"), new[changed]]
+        )
+        alive = years_to_expiry(contracts["expiry"].to_numpy(), timestamp) > 0
+        contracts = contracts[alive]
+
+        rebuilt = self._smiles_of(
+            contracts, new["expiry"][changed].unique(), self.moneyness, self.spot
+        )
+        expiries = set(contracts["expiry"].unique().tolist())
+        smiles = {
+            expiry: smile
+            for expiry, smile in {**self._smiles, **rebuilt}.items()
+            if expiry in expiries
+        }
+        return VolSurface(
+            self.underlying,
+            timestamp,
+            self.spot,
+            self.moneyness,
+            self.tenors,
+            contracts,
+            smiles,
+        )
+
+    def _grid(self) -> np.ndarray:
+        """Interpolate the smiles onto the tenor grid (tenors x moneyness)."""
+        grid = np.full((len(self.tenors), len(self.moneyness)), np.nan)
+        expiries = [e for e, smile in self._smiles.items() if not np.isnan(smile).all()]
+        if not expiries:
+            return grid
+
+        expiries = np.sort(np.array(expiries))
+        smiles = np.stack([self._smiles[int(expiry)] for expiry in expiries])
+        times = years_to_expiry(expiries.astype(float), self.timestamp)
+        if len(times) == 1:
+            grid[:] = smiles[0]
+            return grid
+
+        variance = smiles**2 * times[:, None]
+        upper = np.clip(np.searchsorted(times, self.tenors), 1, len(times) - 1)
+        lower = upper - 1
+        weight = np.clip(
+            (self.tenors - times[lower]) / (times[upper] - times[lower]), 0, 1
+        )[:, None]
+        interpolated = variance[lower] + weight * (variance[upper] - variance[lower])
+        grid[:] = np.sqrt(np.maximum(interpolated, 0) / self.tenors[:, None])
+
+        # Flat in IV before the first and after the last expiry
+        grid[self.tenors <= times[0]] = smiles[0]
+        grid[self.tenors >= times[-1]] = smiles[-1]
+        return grid
+
+    def iv_at(self, moneyness, tenor) -> np.ndarray:
+        """
+        Bilinear interpolation of the grid, clamped to its edges.
+
+        Args:
+            moneyness: Strike / reference spot, scalar or array.
+            tenor: Time to expiry in years, scalar or array.
+        """
+        moneyness, tenor = np.broadcast_arrays(
+            np.asarray(moneyness, dtype=float), np.asarray(tenor, dtype=float)
+        )
+
+        def position(values, axis):
+            scaled = (values - axis[0]) / (axis[1] - axis[0])
+            scaled = np.clip(scaled, 0, len(axis) - 1)
+            index = np.minimum(scaled.astype(np.int64), len(axis) - 2)
+            return index, scaled - index
+
+        i, u = position(tenor, self.tenors)
+        j, v = position(moneyness, self.moneyness)
+        grid = self.grid
+        return (1 - u) * ((1 - v) * grid[i, j] + v * grid[i, j + 1]) + u * (
+            (1 - v) * grid[i + 1, j] + v * grid[i + 1, j + 1]
+        )
+
+    def iv(self, strike, expiry) -> np.ndarray:
+        """
+        Implied volatility at arbitrary strikes and expiries.
+
+        Args:
+            strike: Strike price, scalar or array.
+            expiry: Expiry dates (date, datetime64 or days since the epoch), scalar or array.
+        """
+        tenor = years_to_expiry(_as_days(expiry).astype(float), self.timestamp)
+        return self.iv_at(np.asarray(strike, dtype=float) / self.spot, tenor)
+
+    def to_frame(self) -> pd.DataFrame:
+        """The grid as a DataFrame, tenors (years) by moneyness."""
+        return pd.DataFrame(
+            self.grid,
+            index=pd.Index(self.tenors, name="tenor"),
+            columns=pd.Index(self.moneyness, name="moneyness"),
+        )
+
+
+class VolSurfaceCache:
+    """
+    Volatility surfaces by underlying and snapshot time.
+
+    Each chain snapshot updates the latest surface of its underlyings
+    incrementally (see VolSurface.updated). Surfaces are kept in an LRU cache
+    keyed by (underlying, snapshot time), so strategies looking at the same
+    snapshot share one surface instead of rebuilding it.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CACHE_SIZE_DEFAULT,
+        moneyness: Optional[np.ndarray] = None,
+        tenors: Optional[np.ndarray] = None,
+        rebase_threshold: float = REBASE_THRESHOLD_DEFAULT,
+    ):
+        """
+        Args:
+            max_entries (int): Number of cached surfaces.
+            moneyness (Optional[np.ndarray]): Uniform moneyness grid. See VolSurface.build.
+            tenors (Optional[np.ndarray]): Uniform tenor grid in years. See VolSurface.build.
+            rebase_threshold (float): Relative spot move that rebuilds every smile.
+        """
+        self._max_entries = max_entries
+        self._moneyness = moneyness
+        self._tenors = tenors
+        self._rebase_threshold = rebase_threshold
+        self._surfaces: "OrderedDict[Tuple[str, float], VolSurface]" = OrderedDict()
+        self._latest: Dict[str, VolSurface] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self, underlying: str, timestamp: Union[datetime, float]
+    ) -> Optional[VolSurface]:
+        """The surface of an underlying at a snapshot time, if cached."""
+        key = (underlying, _epoch_seconds(timestamp))
+        with self._lock:
+            surface = self._surfaces.get(key)
+            if surface is not None:
+                self._surfaces.move_to_end(key)
+            return surface
+
+    def latest(self, underlying: str) -> Optional[VolSurface]:
+        """The surface of the newest snapshot of an underlying."""
+        return self._latest.get(underlying)
+
+    def update(
+        self,
+        chain: pd.DataFrame,
+        spot: Union[float, Dict[str, float]],
+        timestamp: Union[datetime, float, None] = None,
+    ) -> Dict[str, VolSurface]:
+        """
+        Build or update the surfaces of the underlyings of a chain snapshot.
+
+        Args:
+            chain (pd.DataFrame): Chain rows with implied_volatility (see enrich_option_chain).
+            spot (Union[float, Dict[str, float]]): Underlying price, or prices by underlying symbol.
+            timestamp (Union[datetime, float, None]): Snapshot time. Defaults to the latest insert_timestamp, else now.
+
+        Returns:
+            Dict[str, VolSurface]: The surface of each underlying of the chain.
+        """
+        if timestamp is None:
+            if "insert_timestamp" in chain.columns and len(chain):
+                timestamp = pd.to_datetime(chain["insert_timestamp"], utc=True).max()
+            else:
+                timestamp = datetime.now(timezone.utc)
+        timestamp = _epoch_seconds(timestamp)
+
+        if "underlying" in chain.columns:
+            underlyings = chain["underlying"].astype(str)
+        else:
+            underlyings = parse_occ_symbols(chain["symbol"])["underlying"].astype(str)
+
+        surfaces = {}
+        for underlying, rows in chain.groupby(underlyings.to_numpy(), sort=False):
+            price = spot[underlying] if isinstance(spot, dict) else spot
+            key = (underlying, timestamp)
+            with self._lock:
+                surface = self._surfaces.get(key)
+                latest = self._latest.get(underlying)
+
+            if surface is not None:
+                surfaces[underlying] = surface
+                continue
+            if latest is not None and latest.timestamp <= timestamp:
+                surface = latest.updated(
+                    rows, timestamp, price, rebase_threshold=self._rebase_threshold
+                )
+            else:
+                surface = VolSurface.build(
+                    underlying, rows, price, timestamp, self._moneyness, self._tenors
+                )
+
+            with self._lock:
+                self._surfaces[key] = surface
+                while len(self._surfaces) > self._max_entries:
+                    self._surfaces.popitem(last=False)
+                if latest is None or latest.timestamp <= timestamp:
+                    self._latest[underlying] = surface
+            surfaces[underlying] = surface
+        return surfaces
@@ -0,0 +1,149 @@
+"""
+Benchmark of the record encoders against recursive_asdict + json.dumps.
+
+Usage:
+    python -m benchmarks.bench_encoders [--batch-size 500] [--existing-records 20000] [--repeat 20]
+"""
+
+import argparse
+import json
+import random
+import time
+from typing import Callable, List
+
+from brokerage_systems.alpaca_br.alpaca_defs import AlpacaSnapshot
+from definitions import BarData, QuoteData, TradeData
+from persistence.encoders import (
+    encode_csv,
+    encode_json,
+    encode_json_items,
+    encode_msgpack,
+)
+from persistence.gcp_cloud_storage import recursive_asdict
+
+
+def make_snapshots(count: int) -> List[AlpacaSnapshot]:
+    """Random but realistic snapshots."""
+    now = time.time()
+    snapshots = []
+    for i in range(count):
+        symbol = f"SYM{i % 500}"
+        price = random.uniform(10, 500)
+
+        def bar():
+            return BarData(
+                close=price,
+                high=price * 1.01,
+                low=price * 0.99,
+                open=price * 1.002,
+                symbol=symbol,
+                timestamp=now - 60,
+                trade_count=float(random.randint(1, 10_000)),
+                volume=float(random.randint(100, 1_000_000)),
+                vwap=price * 1.001,
+            )
+
+        snapshots.append(
+            AlpacaSnapshot(
+                daily_bar=bar(),
+                latest_quote=QuoteData(
+                    ask_exchange="V",
+                    ask_price=price + 0.01,
+                    ask_size=float(random.randint(1, 10)),
+                    bid_exchange="V",
+                    bid_price=price - 0.01,
+                    bid_size=float(random.randint(1, 10)),
+                    conditions=["R"],
+                    symbol=symbol,
+                    tape="C",
+                    timestamp=now,
+                ),
+                latest_trade=TradeData(
+                    conditions=["@", "I"],
+                    exchange="V",
+                    id=random.randint(1, 10**12),
+                    price=price,
+                    size=float(random.randint(1, 100)),
+                    symbol=symbol,
+                    tape="C",
+                    timestamp=now,
+                ),
+                minute_bar=bar(),
+                previous_daily_bar=bar(),
+                symbol=symbol,
+            )
+        )
+    return snapshots
+
+
+def baseline_json(records) -> bytes:
+    return json.dumps([recursive_asdict(record) for record in records]).encode()
+
+
+def baseline_append(existing: str, records) -> bytes:
+    """The previous GCS JSON append: parse the file, extend and re-encode everything."""
+    existing_data = json.loads(existing)
+    return json.dumps(
+        existing_data + [recursive_asdict(record) for record in records]
+    ).encode()
+
+
+def encoder_append(existing: bytes, records) -> bytes:
+    """The GCS JSON append with the encoders: splice the new items into the array."""
+    return existing[:-1] + b", " + encode_json_items(records) + b"]"
+
+
+def best_of(function: Callable, records, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        function(records)
+        best = min(best, time.perf_counter() - tic)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--existing-records", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    snapshots = make_snapshots(args.batch_size)
+    assert encode_json(snapshots) == baseline_json(snapshots)
+
+    existing = encode_json(make_snapshots(args.existing_records))
+    existing_text = existing.decode()
+    assert encoder_append(existing, snapshots) == baseline_append(
+        existing_text, snapshots
+    )
+
+    cases = [
+        ("json", baseline_json, encode_json),
+        (
+            f"json append to {args.existing_records} records",
+            lambda records: baseline_append(existing_text, records),
+            lambda records: encoder_append(existing, records),
+        ),
+    ]
+    print(f"Batch of {args.batch_size} AlpacaSnapshots, best of {args.repeat}:")
+    for name, baseline, encoder in cases:
+        baseline_time = best_of(baseline, snapshots, args.repeat)
+        encoder_time = best_of(encoder, snapshots, args.repeat)
+        print(
+            f"  {name}: baseline {baseline_time * 1e3:.2f} ms,"
+            f" encoder {encoder_time * 1e3:.2f} ms,"
+            f" speedup {baseline_time / encoder_time:.1f}x"
+        )
+
+    csv_time = best_of(encode_csv, snapshots, args.repeat)
+    print(f"  csv: encoder {csv_time * 1e3:.2f} ms")
+    try:
+        msgpack_time = best_of(encode_msgpack, snapshots, args.repeat)
+        print(f"  msgpack: encoder {msgpack_time * 1e3:.2f} ms")
+    except ImportError:
+        print("  msgpack: not installed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmark of the per-symbol cost of decoding a get_snapshot response.
+
+Compares the previous path (SDK Snapshot models + AlpacaSnapshot.from_dict)
+with decode_snapshots on the SDK models and on the raw JSON payload.
+
+Usage:
+    python -m benchmarks.bench_snapshot_decode [--symbols 500] [--repeat 20]
+"""
+
+import argparse
+import random
+import time
+from typing import Callable
+
+import numpy as np
+from alpaca.data.models import Snapshot
+
+from brokerage_systems.alpaca_br.alpaca_defs import AlpacaSnapshot, decode_snapshots
+from persistence.record_batch import RecordBatch
+
+
+def _rfc3339(epoch: float) -> str:
+    nanoseconds = np.datetime64(int(epoch * 1e9) + random.randint(0, 999), "ns")
+    return f"{nanoseconds}Z"
+
+
+def make_raw_response(count: int) -> dict:
+    """A raw snapshot payload ({symbol: snapshot JSON}) like the Alpaca API returns."""
+    now = time.time()
+    response = {}
+    for i in range(count):
+        price = random.uniform(10, 500)
+
+        def bar(epoch):
+            return {
+                "t": _rfc3339(epoch),
+                "o": price * 1.002,
+                "h": price * 1.01,
+                "l": price * 0.99,
+                "c": price,
+                "v": random.randint(100, 1_000_000),
+                "n": random.randint(1, 10_000),
+                "vw": price * 1.001,
+            }
+
+        response[f"SYM{i}"] = {
+            "latestTrade": {
+                "t": _rfc3339(now),
+                "x": "V",
+                "p": price,
+                "s": random.randint(1, 100),
+                "i": random.randint(1, 10**12),
+                "c": ["@", "I"],
+                "z": "C",
+            },
+            "latestQuote": {
+                "t": _rfc3339(now),
+                "ax": "V",
+                "ap": price + 0.01,
+                "as": random.randint(1, 10),
+                "bx": "V",
+                "bp": price - 0.01,
+                "bs": random.randint(1, 10),
+                "c": ["R"],
+                "z": "C",
+            },
+            "minuteBar": bar(now - 60),
+            "dailyBar": bar(now - 3600),
+            "prevDailyBar": bar(now - 86400),
+        }
+    return response
+
+
+def parse_models(raw: dict) -> dict:
+    """What the SDK does with the payload when raw_data=False."""
+    return {symbol: Snapshot(symbol, payload) for symbol, payload in raw.items()}
+
+
+def baseline(raw: dict):
+    return [
+        AlpacaSnapshot.from_dict(snapshot) for snapshot in parse_models(raw).values()
+    ]
+
+
+def best_of(function: Callable, argument, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        function(argument)
+        best = min(best, time.perf_counter() - tic)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    raw = make_raw_response(args.symbols)
+    models = parse_models(raw)
+
+    # All paths decode to the same records
+    expected = RecordBatch.from_records(baseline(raw))
+    for batch in (decode_snapshots(models), decode_snapshots(raw)):
+        assert batch.rows() == expected.rows()
+
+    cases = [
+        ("models + from_dict (before)", baseline, raw),
+        ("models + decode_snapshots", lambda r: decode_snapshots(parse_models(r)), raw),
+        ("decode_snapshots on parsed models", decode_snapshots, models),
+        ("decode_snapshots on raw payload", decode_snapshots, raw),
+    ]
+    print(f"Decoding {args.symbols} snapshots, best of {args.repeat}:")
+    for name, function, argument in cases:
+        elapsed = best_of(function, argument, args.repeat)
+        print(f"  {name}: {elapsed / args.symbols * 1e6:.2f} us per symbol")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Import time of an entry point, with the modules that cost the most.
+
+Each measurement imports the module in a fresh interpreter, as a cold start
+does. The per-module breakdown comes from `python -X importtime`: "self" is
+the time spent in the module itself, "cumulative" includes the modules it
+imported first. With --budget-ms the command exits with status 1 when the
+import takes longer, so it can run as a check before deploying.
+tests/test_import_time.py checks that the entry point defers the heavy
+modules, and holds it to a fixed budget when CHECK_IMPORT_TIME is set.
+
+Usage:
+    python -m benchmarks.import_time [--module alpaca_recorder_function] [--top 25] [--repeat 5] [--budget-ms 500]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import List, NamedTuple
+
+ENTRY_POINT_DEFAULT = "alpaca_recorder_function"  # The Cloud Run snapshot recorder
+# Modules the entry point imports where they are used, not at import time
+DEFERRED_MODULES = ("pandas", "pyarrow", "alpaca", "google.cloud.storage")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ModuleImport(NamedTuple):
+    name: str
+    self_us: int
+    cumulative_us: int
+    depth: int  # Nesting level in the import tree, 0 for top level imports
+
+
+def _run(code: str, *flags: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *flags, "-c", code],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def import_seconds(module: str) -> float:
+    """Wall clock time to import a module in a fresh interpreter."""
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - start)"
+    )
+    return float(_run(code).stdout.strip().splitlines()[-1])
+
+
+def imported_modules(module: str, names) -> List[str]:
+    """Those of the named modules that importing a module loads, in a fresh interpreter."""
+    code = (
+        f"import sys, {module}; "
+        f"print(','.join(name for name in {list(names)!r} if name in sys.modules))"
+    )
+    output = _run(code).stdout.strip().splitlines()
+    return [name for name in output[-1].split(",") if name] if output else []
+
+
+def import_profile(module: str) -> List[ModuleImport]:
+    """Per-module import times of a module, as reported by python -X importtime."""
+    stderr = _run(f"import {module}", "-X", "importtime").stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        stripped = name.lstrip()
+        imports.append(
+            ModuleImport(
+                name=stripped,
+                self_us=int(self_us),
+                cumulative_us=int(cumulative_us),
+                depth=(len(name) - len(stripped) - 1) // 2,
+            )
+        )
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default=ENTRY_POINT_DEFAULT)
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=None,
+        help="Fail if the best import time is above this many milliseconds",
+    )
+    args = parser.parse_args()
+
+    imports = import_profile(args.module)
+    print(f"Slowest imports of {args.module} (cumulative includes dependencies):")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for entry in sorted(imports, key=lambda entry: -entry.cumulative_us)[: args.top]:
+        print(
+            f"{entry.cumulative_us / 1e3:14.1f} {entry.self_us / 1e3:9.1f}  "
+            f"{'  ' * entry.depth}{entry.name}"
+        )
+
+    times = [import_seconds(args.module) for _ in range(args.repeat)]
+    best_ms = min(times) * 1e3
+    print(
+        f"import {args.module}: best {best_ms:.0f} ms, "
+        f"median {sorted(times)[len(times) // 2] * 1e3:.0f} ms over {args.repeat} runs"
+    )
+
+    if args.budget_ms is not None:
+        if best_ms > args.budget_ms:
+            print(
+                f"FAIL: {best_ms:.0f} ms is over the budget of {args.budget_ms:.0f} ms"
+            )
+            sys.exit(1)
+        print(f"OK: within the budget of {args.budget_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,21 +3,15 @@ from datetime import datetime
 import json
 from typing import List, Optional
 from zoneinfo import ZoneInfo
-from alpaca.data.historical.stock import StockHistoricalDataClient
-from alpaca.data.historical.option import OptionHistoricalDataClient
 
-from alpaca.data.requests import (
-    StockSnapshotRequest,
-    StockTradesRequest,
-    StockLatestQuoteRequest,
-    StockQuotesRequest,
-    OptionChainRequest,
-)
-
-import pandas as pd
+# The Alpaca SDK (and pandas, which it imports) take most of the import time of
+# the recorders, so they are imported where they are used.
 
 
 def example_snapshots():
+    from alpaca.data.historical.stock import StockHistoricalDataClient
+    from alpaca.data.requests import StockSnapshotRequest
+
     from .alpaca_defs import AlpacaSnapshot, get_config_from_env
 
     alpaca_config = get_config_from_env()
@@ -43,6 +37,7 @@ def example_snapshots():
 
 def get_trades_example():
 
+    from alpaca.data.historical.stock import StockHistoricalDataClient
     from alpaca.data.requests import (
         CorporateActionsRequest,
         StockBarsRequest,
@@ -92,6 +87,7 @@ def get_trades_example():
 
 def get_bar_example():
 
+    from alpaca.data.historical.stock import StockHistoricalDataClient
     from alpaca.data.requests import (
         CorporateActionsRequest,
         StockBarsRequest,
@@ -132,17 +128,9 @@ def get_bar_example():
     print(df)
 
 
-def recursive_asdict(obj):
-    """Recursively converts NamedTuple instances into dictionaries."""
-    if hasattr(obj, "_asdict"):  # If obj is a NamedTuple
-        return {key: recursive_asdict(value) for key, value in obj._asdict().items()}
-    elif isinstance(obj, list):  # If obj is a list, process each item
-        return [recursive_asdict(item) for item in obj]
-    else:
-        return obj  # Return as-is if not a NamedTuple or list
-
-
 def get_options_chain_examples():
+    from alpaca.data.historical.option import OptionHistoricalDataClient
+
     from .alpaca_defs import AlpacaSnapshot, get_config_from_env
 
     from alpaca.data.requests import OptionChainRequest
@@ -178,6 +166,8 @@ def get_options_chain_examples():
 
 
 def get_options_latest_trade_examples():
+    from alpaca.data.historical.option import OptionHistoricalDataClient
+
     from .alpaca_defs import AlpacaSnapshot, get_config_from_env
 
     from alpaca.data.requests import (
@@ -211,6 +201,8 @@ def get_options_latest_trade_examples():
 
 
 def get_options_latest_quote_examples():
+    from alpaca.data.historical.option import OptionHistoricalDataClient
+
     from .alpaca_defs import AlpacaSnapshot, get_config_from_env
 
     from alpaca.data.requests import (
@@ -263,35 +255,72 @@ class AlpacaClient:
         """
 
         self._retries = api_retries
-
+        self._api_key = api_key
+        self._secret_key = secret_key
+        self._data_api_url = data_api_url
+        # SDK clients, created on first use: the snapshot recorder only needs the raw one
+        self._stock_client = None
+        self._option_client = None
+        self._raw_client = None
+
+    def _create_client(self, client_class, raw_data: bool = False):
         for _ in range(self._retries):
             try:
-                self._client = StockHistoricalDataClient(
-                    api_key, secret_key, url_override=data_api_url
+                return client_class(
+                    self._api_key,
+                    self._secret_key,
+                    url_override=self._data_api_url,
+                    raw_data=raw_data,
                 )
-                self._option_client = OptionHistoricalDataClient(
-                    api_key, secret_key, url_override=data_api_url
-                )
-                break
             except Exception as e:
                 print(f"Failed to connect to Alpaca: {e}")
                 print("Retrying...")
                 continue
-        else:
-            raise ConnectionError("Failed to connect to Alpaca.")
+        raise ConnectionError("Failed to connect to Alpaca.")
+
+    @property
+    def _client(self):
+        """Stock data client, returning SDK models."""
+        if self._stock_client is None:
+            from alpaca.data.historical.stock import StockHistoricalDataClient
+
+            self._stock_client = self._create_client(StockHistoricalDataClient)
+        return self._stock_client
+
+    @property
+    def _options(self):
+        """Option data client."""
+        if self._option_client is None:
+            from alpaca.data.historical.option import OptionHistoricalDataClient
+
+            self._option_client = self._create_client(OptionHistoricalDataClient)
+        return self._option_client
 
-    def get_snapshot(self, symbols: List[str], feed: str = "iex"):
+    def get_snapshot(
+        self, symbols: List[str], feed: str = "iex", raw_data: bool = False
+    ):
         """
         Fetches snapshot data for given stock symbols.
 
         :param symbols: List of stock symbols to retrieve snapshot data for.
         :param feed: The data feed source (default: "iex").
+        :param raw_data: Return the raw JSON payload ({symbol: dict}) instead of Snapshot models.
         :return: Snapshot data from Alpaca API.
         """
+        from alpaca.data.requests import StockSnapshotRequest
+
+        if raw_data and self._raw_client is None:
+            from alpaca.data.historical.stock import StockHistoricalDataClient
+
+            self._raw_client = self._create_client(
+                StockHistoricalDataClient, raw_data=True
+            )
+        client = self._raw_client if raw_data else self._client
+
         for _ in range(self._retries):
             try:
                 ssr = StockSnapshotRequest(symbol_or_symbols=symbols, feed=feed)
-                return self._client.get_stock_snapshot(ssr)
+                return client.get_stock_snapshot(ssr)
             except Exception as e:
                 print(f"Failed to fetch snapshot data: {e}")
                 print("Retrying...")
@@ -310,6 +339,7 @@ class AlpacaClient:
         :param feed: The data feed source (default: "iex").
         :return: Trade data from Alpaca API.
         """
+        from alpaca.data.requests import StockTradesRequest
 
         for _ in range(self._retries):
             try:
@@ -334,10 +364,13 @@ class AlpacaClient:
         :param feed: The data feed source (default: "iex").
         :return: Last quote data from Alpaca API.
         """
+        from alpaca.data.requests import StockQuotesRequest
 
         for _ in range(self._retries):
             try:
-                req = StockQuotesRequest(symbol_or_symbols=symbols, feed=feed)
+                req = StockQuotesRequest(
+                    symbol_or_symbols=symbols, feed=feed, start=start, end=end
+                )
                 return self._client.get_stock_quotes(req).df
             except Exception as e:
                 print(f"Failed to fetch last quote data: {e}")
@@ -346,6 +379,73 @@ class AlpacaClient:
         else:
             raise ConnectionError("Failed to fetch last quote data.")
 
+    @staticmethod
+    def _windowed(fetch, start: datetime, end: datetime, window: timedelta):
+        """Call fetch(start, end) per window, yielding the non-empty DataFrames."""
+        while start < end:
+            window_end = min(start + window, end)
+            df = fetch(start, window_end)
+            if window_end < end and len(df):
+                # The API includes the end time; rows at it belong to the next window
+                df = df[df.index.get_level_values("timestamp") < window_end]
+            if len(df):
+                yield df
+            start = window_end
+
+    def iter_trades(
+        self,
+        symbols: List[str],
+        start: datetime,
+        end: datetime,
+        window: timedelta = timedelta(minutes=30),
+        feed: str = "iex",
+    ):
+        """
+        Fetches trade data in consecutive time windows, so a whole day is never held at once.
+
+        :param symbols: List of stock symbols to retrieve trade data for.
+        :param start: Start of the first window.
+        :param end: End of the last window.
+        :param window: Length of each window (default: 30 minutes).
+        :param feed: The data feed source (default: "iex").
+        :return: Iterator over the non-empty trade DataFrames, in time order.
+        """
+        return self._windowed(
+            lambda window_start, window_end: self.get_trades(
+                symbols, window_start, window_end, feed=feed
+            ),
+            start,
+            end,
+            window,
+        )
+
+    def iter_quotes(
+        self,
+        symbols: List[str],
+        start: datetime,
+        end: datetime,
+        window: timedelta = timedelta(minutes=30),
+        feed: str = "iex",
+    ):
+        """
+        Fetches quote data in consecutive time windows, so a whole day is never held at once.
+
+        :param symbols: List of stock symbols to retrieve quote data for.
+        :param start: Start of the first window.
+        :param end: End of the last window.
+        :param window: Length of each window (default: 30 minutes).
+        :param feed: The data feed source (default: "iex").
+        :return: Iterator over the non-empty quote DataFrames, in time order.
+        """
+        return self._windowed(
+            lambda window_start, window_end: self.get_qoutes(
+                symbols, window_start, window_end, feed=feed
+            ),
+            start,
+            end,
+            window,
+        )
+
     def get_option_chain(
         self, underlying_symbol: str, as_rows: bool = True, as_df: bool = True
     ):
@@ -358,13 +458,14 @@ class AlpacaClient:
 
         :return: Option chain data from Alpaca API.
         """
+        from alpaca.data.requests import OptionChainRequest
 
         data = {}
 
         for _ in range(self._retries):
             try:
                 req = OptionChainRequest(underlying_symbol=underlying_symbol)
-                data = self._option_client.get_option_chain(req)
+                data = self._options.get_option_chain(req)
                 break
             except Exception as e:
                 print(f"Failed to fetch option chain data: {e}")
@@ -399,12 +500,20 @@ class AlpacaClient:
             rows.append(json_obj)
 
         if as_df:
+            import pandas as pd
+
+            from analytics.occ import add_contract_columns
+
             df = pd.DataFrame(rows)
 
             # Correct timestamps columns types
             df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True)
             df["insert_timestamp"] = pd.to_datetime(df["insert_timestamp"], utc=True)
 
+            # underlying, expiry, is_call and strike_mills of the OCC symbols
+            if len(df):
+                add_contract_columns(df)
+
             return df
 
         return rows
@@ -0,0 +1,179 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from ib_insync import Contract, Stock, util
+
+TTL_DEFAULT = 7 * 24 * 60 * 60  # Seconds; conIds of listed stocks rarely change
+
+Key = Tuple[str, str, str]  # (symbol, exchange, currency)
+
+
+def _key(contract: Contract) -> Key:
+    return (contract.symbol, contract.exchange, contract.currency)
+
+
+def _key_string(key: Key) -> str:
+    return ":".join(key)
+
+
+def _contract_fields(contract: Contract) -> dict:
+    """The non-default scalar fields of a qualified contract, e.g. conId and primaryExchange."""
+    return {
+        name: value
+        for name, value in util.dataclassNonDefaults(contract).items()
+        if isinstance(value, (str, int, float, bool))
+    }
+
+
+class ContractCache:
+    """
+    On-disk cache of qualified IBKR contracts.
+
+    Maps (symbol, exchange, currency) to the details IB filled in when the
+    contract was qualified (conId, primaryExchange, ...), so that a recorder
+    does not ask IB about the same contracts at every startup. Entries older
+    than `ttl` seconds are revalidated: they are qualified again together
+    with the misses, in a single batched qualifyContracts call. The cache is
+    a small JSON document, written (atomically) only when it changed.
+    """
+
+    def __init__(self, path: str, ttl: float = TTL_DEFAULT):
+        """
+        Args:
+            path (str): JSON file of the cache. Created on the first save.
+            ttl (float): Seconds after which an entry is qualified again.
+        """
+        self._path = path
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # {"SPY:SMART:USD": {"fields": {...}, "qualified_at": epoch seconds}}
+        self._entries: Dict[str, dict] = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self._path, "r") as f:
+                self._entries = json.load(f)["contracts"]
+        except FileNotFoundError:
+            return
+        except (ValueError, KeyError):
+            print(f"Ignoring unreadable contract cache {self._path}")
+
+    def save(self):
+        """Write the cache."""
+        with self._lock:
+            state = json.dumps({"contracts": self._entries})
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(state)
+        os.replace(tmp_path, self._path)
+
+    def get(
+        self, contract: Contract, now: Optional[float] = None
+    ) -> Optional[Contract]:
+        """
+        The cached qualified version of a contract.
+
+        Args:
+            contract (Contract): The contract to look up, e.g. Stock("SPY", "SMART", "USD").
+            now (Optional[float]): Current epoch time. time.time() if not given.
+
+        Returns:
+            Optional[Contract]: The qualified contract, None if not cached or expired.
+        """
+        entry = self._entries.get(_key_string(_key(contract)))
+        if entry is None:
+            return None
+        now = now if now is not None else time.time()
+        if now - entry["qualified_at"] > self._ttl:
+            return None
+        return Contract.create(**entry["fields"])
+
+    def put(self, contract: Contract, now: Optional[float] = None):
+        """Add (or refresh) a qualified contract."""
+        with self._lock:
+            self._entries[_key_string(_key(contract))] = {
+                "fields": _contract_fields(contract),
+                "qualified_at": now if now is not None else time.time(),
+            }
+
+    def _lookup(
+        self, contracts: Sequence[Union[str, Contract]], now: float
+    ) -> Tuple[List[Contract], List[Optional[Contract]], List[Contract]]:
+        """The contracts, their cached qualified versions and the ones to ask IB about."""
+        contracts = [
+            Stock(contract, "SMART", "USD") if isinstance(contract, str) else contract
+            for contract in contracts
+        ]
+        qualified = [self.get(contract, now) for contract in contracts]
+        missing = [
+            contract for contract, cached in zip(contracts, qualified) if cached is None
+        ]
+        return contracts, qualified, missing
+
+    def _resolve(
+        self,
+        contracts: List[Contract],
+        qualified: List[Optional[Contract]],
+        missing: List[Contract],
+        resolved: List[Contract],
+        now: float,
+    ) -> List[Contract]:
+        """Cache what IB qualified and fill it in, in the given order."""
+        resolved = {_key(contract): contract for contract in resolved}
+        for contract in resolved.values():
+            self.put(contract, now)
+        with self._lock:
+            for contract in missing:
+                if _key(contract) not in resolved:
+                    # No longer valid (e.g. delisted); ask again next time
+                    self._entries.pop(_key_string(_key(contract)), None)
+        qualified = [
+            cached if cached is not None else resolved.get(_key(contract))
+            for contract, cached in zip(contracts, qualified)
+        ]
+        self.save()
+        return qualified
+
+    def qualify(self, ib, contracts: Sequence[Union[str, Contract]]) -> List[Contract]:
+        """
+        Qualify contracts, asking IB only about the ones missing or expired in the cache.
+
+        Blocks on ib.qualifyContracts, so it cannot be called from a running
+        event loop (e.g. inside a coroutine); use qualify_async there.
+
+        Args:
+            ib: The ib_insync.IB client.
+            contracts (Sequence[Union[str, Contract]]): Contracts, or stock symbols (SMART, USD).
+
+        Returns:
+            List[Contract]: The qualified contracts, in the given order. Contracts IB
+            cannot qualify are left out, as qualifyContracts does.
+        """
+        now = time.time()
+        contracts, qualified, missing = self._lookup(contracts, now)
+        if missing:
+            # One batched request for all the misses and expired entries
+            resolved = ib.qualifyContracts(*missing)
+            qualified = self._resolve(contracts, qualified, missing, resolved, now)
+        return [contract for contract in qualified if contract is not None]
+
+    async def qualify_async(
+        self, ib, contracts: Sequence[Union[str, Contract]]
+    ) -> List[Contract]:
+        """Async version of qualify, awaiting ib.qualifyContractsAsync for the misses."""
+        now = time.time()
+        contracts, qualified, missing = self._lookup(contracts, now)
+        if missing:
+            resolved = await ib.qualifyContractsAsync(*missing)
+            qualified = self._resolve(contracts, qualified, missing, resolved, now)
+        return [contract for contract in qualified if contract is not None]
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,211 @@
+"""
+Local stand-in for ib_insync.IB, for running the IBKR recorders without TWS.
+
+Only the calls the recorders make are implemented. Market data is pushed by
+the caller with FakeIB.push and delivered, like the real client does, through
+pendingTickersEvent the next time the event loop runs (FakeIB.sleep).
+Historical data requests can be made to fail with FakeIB.fail_historical.
+"""
+
+import asyncio
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional, Tuple
+
+from eventkit import Event
+from ib_insync import BarData, BarDataList, Contract, Ticker
+
+_DURATION_UNITS = {"S": 1, "D": 24 * 60 * 60, "W": 7 * 24 * 60 * 60}
+_BAR_SECONDS = {
+    "secs": 1,
+    "min": 60,
+    "mins": 60,
+    "hour": 3600,
+    "hours": 3600,
+    "day": 86400,
+}
+
+
+class FakeIB:
+    """Fake of the ib_insync.IB interface used by the IBKR recorders."""
+
+    def __init__(self, unknown_symbols: Optional[List[str]] = None):
+        """
+        Args:
+            unknown_symbols (Optional[List[str]]): Symbols qualifyContracts cannot resolve.
+        """
+        self.pendingTickersEvent = Event("pendingTickersEvent")
+        self.errorEvent = Event("errorEvent")
+        self._unknown_symbols = set(unknown_symbols or [])
+        self._connected = False
+        self._next_con_id = 1000
+        self._con_ids: Dict[str, int] = {}
+        self._tickers: Dict[int, Ticker] = {}  # Subscribed tickers by conId
+        self._pending = {}  # Updated tickers not delivered yet, by id
+        self._next_req_id = 1
+        self._historical_failures: Deque[Tuple[Optional[int], str]] = deque()
+        self.requests: List[str] = []  # Names of the API calls made, for assertions
+
+    def connect(self, host: str = "127.0.0.1", port: int = 7497, clientId: int = 1):
+        self.requests.append("connect")
+        self._connected = True
+        return self
+
+    def disconnect(self):
+        self.requests.append("disconnect")
+        self._connected = False
+
+    def isConnected(self) -> bool:
+        return self._connected
+
+    def qualifyContracts(self, *contracts: Contract) -> List[Contract]:
+        """
+        Fill in the conId of the contracts, in one request like the real call.
+
+        Like IB.qualifyContracts, it runs qualifyContractsAsync to completion,
+        so it fails when called from a running event loop.
+        """
+        return self.run(self.qualifyContractsAsync(*contracts))
+
+    async def qualifyContractsAsync(self, *contracts: Contract) -> List[Contract]:
+        self.requests.append("qualifyContracts")
+        qualified = []
+        for contract in contracts:
+            if contract.symbol in self._unknown_symbols:
+                continue
+            if contract.symbol not in self._con_ids:
+                self._con_ids[contract.symbol] = self._next_con_id
+                self._next_con_id += 1
+            contract.conId = self._con_ids[contract.symbol]
+            contract.primaryExchange = contract.primaryExchange or "ARCA"
+            qualified.append(contract)
+        return qualified
+
+    async def reqHistoricalDataAsync(
+        self,
+        contract: Contract,
+        endDateTime: datetime,
+        durationStr: str,
+        barSizeSetting: str,
+        whatToShow: str,
+        useRTH: bool,
+        formatDate: int = 1,
+        keepUpToDate: bool = False,
+        chartOptions=[],
+        timeout: float = 60,
+    ) -> BarDataList:
+        """Synthetic bars covering the duration before endDateTime."""
+        self.requests.append("reqHistoricalData")
+        bars = BarDataList()
+        bars.reqId = self._next_req_id
+        self._next_req_id += 1
+        await asyncio.sleep(0)
+
+        if self._historical_failures:
+            # Like the real client: no bars, and no exception
+            error_code, error_string = self._historical_failures.popleft()
+            if error_code is None:
+                await asyncio.sleep(timeout)
+            else:
+                self.errorEvent.emit(bars.reqId, error_code, error_string, contract)
+            return bars
+
+        count, unit = durationStr.split()
+        length, name = barSizeSetting.split()
+        bar_seconds = int(length) * _BAR_SECONDS[name]
+        end = int(endDateTime.timestamp())
+        start = end - int(count) * _DURATION_UNITS[unit]
+
+        for timestamp in range(start - start % bar_seconds, end, bar_seconds):
+            price = 100 + (timestamp // bar_seconds) % 100 / 100
+            bars.append(
+                BarData(
+                    date=datetime.fromtimestamp(timestamp, tz=timezone.utc),
+                    open=price,
+                    high=price + 0.05,
+                    low=price - 0.05,
+                    close=price,
+                    volume=100,
+                    average=price,
+                    barCount=10,
+                )
+            )
+        return bars
+
+    def fail_historical(
+        self, count: int = 1, error_code: Optional[int] = None, error_string: str = ""
+    ):
+        """
+        Make the next historical data requests fail the way the real client does.
+
+        Args:
+            count (int): Number of requests that fail.
+            error_code (Optional[int]): Error reported through errorEvent, e.g. 162. A timeout if None.
+            error_string (str): Message of the error.
+        """
+        self._historical_failures.extend([(error_code, error_string)] * count)
+
+    def reqMktData(
+        self,
+        contract: Contract,
+        genericTickList: str = "",
+        snapshot: bool = False,
+        regulatorySnapshot: bool = False,
+        mktDataOptions=None,
+    ) -> Ticker:
+        self.requests.append("reqMktData")
+        ticker = self._tickers.get(contract.conId)
+        if ticker is None:
+            ticker = Ticker(contract=contract)
+            self._tickers[contract.conId] = ticker
+        return ticker
+
+    def cancelMktData(self, contract: Contract):
+        self.requests.append("cancelMktData")
+        ticker = self._tickers.pop(contract.conId, None)
+        if ticker is not None:
+            self._pending.pop(id(ticker), None)
+
+    def reqTickers(self, *contracts: Contract) -> List[Ticker]:
+        """Snapshot of the current values, without delivering pending updates."""
+        self.requests.append("reqTickers")
+        return [
+            self._tickers.get(contract.conId) or Ticker(contract=contract)
+            for contract in contracts
+        ]
+
+    def push(self, symbol: str, timestamp: Optional[datetime] = None, **fields):
+        """
+        Update the ticker of a subscribed symbol, e.g. push("SPY", bid=600.1, ask=600.2).
+
+        The update is delivered at the next sleep, as the real client does.
+        """
+        for ticker in self._tickers.values():
+            if ticker.contract.symbol == symbol:
+                for name, value in fields.items():
+                    setattr(ticker, name, value)
+                ticker.time = timestamp or datetime.now(timezone.utc)
+                self._pending[id(ticker)] = ticker
+                return
+        raise KeyError(f"{symbol} is not subscribed")
+
+    def run(self, *awaitables, timeout: Optional[float] = None):
+        """Run awaitables to completion, like IB.run."""
+        if len(awaitables) == 1:
+            return asyncio.run(awaitables[0])
+
+        async def gather():
+            return await asyncio.gather(*awaitables)
+
+        return asyncio.run(gather())
+
+    def sleep(self, seconds: float = 0):
+        """Deliver the pending ticker updates, then wait."""
+        if self._pending:
+            tickers = set(self._pending.values())
+            self._pending.clear()
+            self.pendingTickersEvent.emit(tickers)
+        if seconds > 0:
+            time.sleep(seconds)
+        return True
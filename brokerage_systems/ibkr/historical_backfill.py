@@ -0,0 +1,460 @@
+"""
+Historical bar backfill from IBKR, within IB's pacing limits.
+
+A backfill request (symbol, bar size, time range) is split into chunks no
+longer than the longest duration IB serves for that bar size. Chunks are
+requested concurrently with reqHistoricalDataAsync, each one only once
+PacingLimiter allows it, and written to the persistence layers as BarData
+record batches. Completed chunks are checkpointed, so an interrupted
+backfill resumes where it stopped.
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from datetime import date, datetime, timezone
+from typing import Deque, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from ib_insync import Contract, RequestError, Stock
+
+from brokerage_systems.ibkr.contract_cache import ContractCache
+from definitions import BarData
+from persistence.persistence import PersistenceLayer
+from persistence.record_batch import RecordBatch
+
+DAY = 24 * 60 * 60
+WEEK = 7 * DAY
+
+# Bar size setting: (bar length, longest duration per request), in seconds
+BAR_SIZES = {
+    "1 secs": (1, 1800),
+    "5 secs": (5, 3600),
+    "10 secs": (10, 4 * 3600),
+    "15 secs": (15, 4 * 3600),
+    "30 secs": (30, 8 * 3600),
+    "1 min": (60, DAY),
+    "2 mins": (120, 2 * DAY),
+    "3 mins": (180, WEEK),
+    "5 mins": (300, WEEK),
+    "10 mins": (600, WEEK),
+    "15 mins": (900, 2 * WEEK),
+    "20 mins": (1200, 2 * WEEK),
+    "30 mins": (1800, 4 * WEEK),
+    "1 hour": (3600, 4 * WEEK),
+    "2 hours": (7200, 4 * WEEK),
+    "4 hours": (4 * 3600, 4 * WEEK),
+    "1 day": (DAY, 52 * WEEK),
+}
+
+# IB pacing limits on historical data requests
+SMALL_BAR_SECONDS = 30  # The request limits apply to bars of this length or less
+MAX_REQUESTS = 60  # Requests per window
+REQUESTS_WINDOW = 10 * 60  # Seconds
+MAX_CONTRACT_REQUESTS = 5  # Requests for the same contract and data type per window
+CONTRACT_WINDOW = 2  # Seconds
+IDENTICAL_INTERVAL = 15  # Seconds between identical requests
+PACING_BACKOFF = 60  # Seconds to pause all requests after a pacing violation
+
+HMDS_ERROR = 162  # Historical data error, e.g. a pacing violation or no data
+
+CONCURRENCY_DEFAULT = 8  # IB allows at most 50 open historical requests
+RETRIES_DEFAULT = 3
+
+
+class Chunk(NamedTuple):
+    """One historical data request: the bars of [start, end) of a symbol."""
+
+    symbol: str
+    bar_size: str
+    start: float  # Epoch seconds
+    end: float  # Epoch seconds
+
+    @property
+    def key(self) -> str:
+        return f"{self.symbol}|{self.bar_size}|{self.start:.0f}|{self.end:.0f}"
+
+
+def _epoch(value) -> float:
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    if isinstance(value, date):
+        return datetime(
+            value.year, value.month, value.day, tzinfo=timezone.utc
+        ).timestamp()
+    return float(value)
+
+
+def duration_string(seconds: float) -> str:
+    """IB duration covering at least `seconds`, e.g. 1800 -> "1800 S", 2 days -> "2 D"."""
+    seconds = int(-(-seconds // 1))
+    if seconds <= DAY:
+        return f"{seconds} S"
+    if seconds % WEEK == 0:
+        return f"{seconds // WEEK} W"
+    return f"{-(-seconds // DAY)} D"
+
+
+def split_range(symbol: str, bar_size: str, start, end) -> List[Chunk]:
+    """
+    Split a backfill request into chunks IB accepts.
+
+    Args:
+        symbol (str): Stock symbol.
+        bar_size (str): IB bar size setting, e.g. "1 min". See BAR_SIZES.
+        start: Start of the range (datetime, date or epoch seconds), inclusive.
+        end: End of the range (datetime, date or epoch seconds), exclusive.
+
+    Returns:
+        List[Chunk]: Consecutive chunks covering the range, oldest first.
+    """
+    if bar_size not in BAR_SIZES:
+        raise ValueError(
+            f"Unsupported bar size {bar_size!r}. Must be one of {list(BAR_SIZES)}."
+        )
+    _, max_duration = BAR_SIZES[bar_size]
+    start, end = _epoch(start), _epoch(end)
+
+    chunks = []
+    while start < end:
+        chunk_end = min(start + max_duration, end)
+        chunks.append(Chunk(symbol, bar_size, start, chunk_end))
+        start = chunk_end
+    return chunks
+
+
+class PacingLimiter:
+    """
+    Scheduler of historical data requests within IB's pacing limits.
+
+    For bars of 30 seconds or less IB allows at most 60 requests in any ten
+    minutes and 5 requests for the same contract and data type in any two
+    seconds. For every bar size, an identical request must not be repeated
+    within 15 seconds. acquire() waits until a request fits all three
+    limits; as the asyncio loop is single threaded, the check and the
+    recording of the request cannot interleave with another acquire.
+    """
+
+    def __init__(
+        self,
+        max_requests: int = MAX_REQUESTS,
+        window: float = REQUESTS_WINDOW,
+        max_contract_requests: int = MAX_CONTRACT_REQUESTS,
+        contract_window: float = CONTRACT_WINDOW,
+        identical_interval: float = IDENTICAL_INTERVAL,
+        clock=time.monotonic,
+    ):
+        """
+        Args:
+            max_requests (int): Small bar requests allowed per window.
+            window (float): Window of max_requests, in seconds.
+            max_contract_requests (int): Small bar requests allowed per contract and data type per contract_window.
+            contract_window (float): Window of max_contract_requests, in seconds.
+            identical_interval (float): Seconds between identical requests.
+            clock: Monotonic clock, in seconds.
+        """
+        self._max_requests = max_requests
+        self._window = window
+        self._max_contract_requests = max_contract_requests
+        self._contract_window = contract_window
+        self._identical_interval = identical_interval
+        self._clock = clock
+
+        self._sent: Deque[float] = deque()  # Times of the small bar requests
+        self._contract_sent: Dict[str, Deque[float]] = {}
+        self._identical_sent: Dict[str, float] = {}
+        self._paused_until = 0.0
+
+    def delay(self, request: str, contract: str, small_bars: bool) -> float:
+        """Seconds until a request is allowed, 0 if it is allowed now."""
+        now = self._clock()
+        wait = self._paused_until - now
+
+        sent_at = self._identical_sent.get(request)
+        if sent_at is not None:
+            wait = max(wait, sent_at + self._identical_interval - now)
+
+        if small_bars:
+            sent = self._sent
+            while sent and sent[0] <= now - self._window:
+                sent.popleft()
+            if len(sent) >= self._max_requests:
+                wait = max(wait, sent[0] + self._window - now)
+
+            contract_sent = self._contract_sent.get(contract, ())
+            while contract_sent and contract_sent[0] <= now - self._contract_window:
+                contract_sent.popleft()
+            if len(contract_sent) >= self._max_contract_requests:
+                wait = max(wait, contract_sent[0] + self._contract_window - now)
+
+        return max(wait, 0.0)
+
+    def record(self, request: str, contract: str, small_bars: bool):
+        """Count a request that is being sent."""
+        now = self._clock()
+        self._identical_sent[request] = now
+        if small_bars:
+            self._sent.append(now)
+            self._contract_sent.setdefault(contract, deque()).append(now)
+
+        if len(self._identical_sent) > 4 * self._max_requests:
+            cutoff = now - self._identical_interval
+            self._identical_sent = {
+                key: sent_at
+                for key, sent_at in self._identical_sent.items()
+                if sent_at > cutoff
+            }
+
+    async def acquire(self, request: str, contract: str, small_bars: bool):
+        """
+        Wait until a request is allowed and count it.
+
+        Args:
+            request (str): Identity of the request; equal for identical requests.
+            contract (str): Identity of the contract and data type of the request.
+            small_bars (bool): Whether the bars are 30 seconds or less.
+        """
+        while True:
+            wait = self.delay(request, contract, small_bars)
+            if wait <= 0:
+                self.record(request, contract, small_bars)
+                return
+            await asyncio.sleep(wait)
+
+    def backoff(self, seconds: float = PACING_BACKOFF):
+        """Pause all requests, e.g. after IB reported a pacing violation."""
+        self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+
+class BackfillCheckpoint:
+    """Keys of the completed chunks, in a JSON file rewritten atomically after every chunk."""
+
+    def __init__(self, path: str):
+        self._path = path
+        self._done: Set[str] = set()
+        try:
+            with open(path, "r") as f:
+                self._done = set(json.load(f)["done"])
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, chunk: Chunk) -> bool:
+        return chunk.key in self._done
+
+    def add(self, chunk: Chunk):
+        self._done.add(chunk.key)
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"done": sorted(self._done)}, f)
+        os.replace(tmp_path, self._path)
+
+    def __len__(self) -> int:
+        return len(self._done)
+
+
+def bar_records(symbol: str, bars, start: float, end: float) -> List[BarData]:
+    """Convert ib_insync bars into BarData records, keeping those within [start, end)."""
+    records = []
+    for bar in bars:
+        timestamp = _epoch(bar.date)
+        if not start <= timestamp < end:
+            continue
+        records.append(
+            BarData(
+                close=bar.close,
+                high=bar.high,
+                low=bar.low,
+                open=bar.open,
+                symbol=symbol,
+                timestamp=timestamp,
+                trade_count=max(bar.barCount, 0),
+                volume=max(bar.volume, 0),
+                vwap=bar.average,
+            )
+        )
+    return records
+
+
+class IBKRHistoricalBackfill:
+    """
+    Concurrent, pacing aware backfill of IBKR historical bars.
+
+    Usage:
+        backfill = IBKRHistoricalBackfill(ib, [ParquetPersistence(...)], checkpoint_path="backfill.json")
+        backfill.run([("SPY", "1 min", datetime(2025, 1, 2), datetime(2025, 2, 1))])
+    """
+
+    def __init__(
+        self,
+        ib,
+        persistences: List[PersistenceLayer],
+        what_to_show: str = "TRADES",
+        use_rth: bool = False,
+        concurrency: int = CONCURRENCY_DEFAULT,
+        retries: int = RETRIES_DEFAULT,
+        checkpoint_path: Optional[str] = None,
+        limiter: Optional[PacingLimiter] = None,
+        contract_cache: Optional[ContractCache] = None,
+        timeout: float = 60,
+    ):
+        """
+        Args:
+            ib: A connected ib_insync.IB client (or a stand-in such as FakeIB).
+            persistences (List[PersistenceLayer]): Persistence layers the bars are saved to.
+            what_to_show (str): IB data type, e.g. "TRADES", "MIDPOINT" or "BID_ASK".
+            use_rth (bool): Only bars within regular trading hours.
+            concurrency (int): Requests in flight at once.
+            retries (int): Attempts per chunk after a failed request.
+            checkpoint_path (Optional[str]): JSON file of the completed chunks. No checkpointing if not given.
+            limiter (Optional[PacingLimiter]): Pacing limiter, shared if several backfills use the same connection.
+            contract_cache (Optional[ContractCache]): Cache of qualified contracts.
+            timeout (float): Seconds to wait for a request.
+        """
+        self._ib = ib
+        self._persistences = persistences
+        self._what_to_show = what_to_show
+        self._use_rth = use_rth
+        self._concurrency = concurrency
+        self._retries = retries
+        self._checkpoint = (
+            BackfillCheckpoint(checkpoint_path) if checkpoint_path else None
+        )
+        self._limiter = limiter if limiter is not None else PacingLimiter()
+        self._contract_cache = contract_cache
+        self._timeout = timeout
+        self._pacing_violations = 0
+        self._errors: Dict[int, List[Tuple[int, str]]] = {}  # Reported errors by reqId
+
+    def _on_error(self, req_id, error_code, error_string, contract):
+        self._errors.setdefault(req_id, []).append((error_code, error_string))
+        if error_code == HMDS_ERROR and "pacing" in error_string.lower():
+            self._pacing_violations += 1
+            self._limiter.backoff()
+
+    async def _qualify(self, symbols: Iterable[str]) -> Dict[str, Contract]:
+        contracts = [Stock(symbol, "SMART", "USD") for symbol in symbols]
+        if self._contract_cache is not None:
+            qualified = await self._contract_cache.qualify_async(self._ib, contracts)
+        else:
+            qualified = await self._ib.qualifyContractsAsync(*contracts)
+        return {contract.symbol: contract for contract in qualified}
+
+    async def _fetch(self, contract: Contract, chunk: Chunk) -> Optional[list]:
+        """
+        Request the bars of a chunk. None if it has to be requested again.
+
+        reqHistoricalDataAsync returns no bars, rather than raising, when the
+        request times out or IB reports an error, so an empty answer only
+        completes the chunk when IB reported that it has no data.
+        """
+        bar_seconds, _ = BAR_SIZES[chunk.bar_size]
+        duration = duration_string(chunk.end - chunk.start)
+        request = f"{chunk.key}|{self._what_to_show}|{self._use_rth}"
+        await self._limiter.acquire(
+            request,
+            f"{contract.conId}|{self._what_to_show}",
+            bar_seconds <= SMALL_BAR_SECONDS,
+        )
+
+        try:
+            bars = await self._ib.reqHistoricalDataAsync(
+                contract,
+                endDateTime=datetime.fromtimestamp(chunk.end, tz=timezone.utc),
+                durationStr=duration,
+                barSizeSetting=chunk.bar_size,
+                whatToShow=self._what_to_show,
+                useRTH=self._use_rth,
+                formatDate=2,
+                timeout=self._timeout,
+            )
+        except (ConnectionError, RequestError) as e:
+            print(f"Request for {chunk.key} failed: {e}")
+            return None
+        errors = self._errors.pop(getattr(bars, "reqId", None), [])
+        if bars:
+            return bars
+        if any(
+            code == HMDS_ERROR and "no data" in message.lower()
+            for code, message in errors
+        ):
+            return bars
+        reason = "; ".join(f"{code} {message}" for code, message in errors)
+        print(f"Request for {chunk.key} returned no bars: {reason or 'timed out'}")
+        return None
+
+    async def _worker(
+        self, queue: asyncio.Queue, contracts: Dict[str, Contract], totals: dict
+    ):
+        while True:
+            try:
+                chunk, attempt = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            bars = await self._fetch(contracts[chunk.symbol], chunk)
+            if bars is None:
+                if attempt < self._retries:
+                    queue.put_nowait((chunk, attempt + 1))
+                else:
+                    print(f"Giving up on {chunk.key}")
+                    totals["failed"] += 1
+                continue
+
+            records = bar_records(chunk.symbol, bars, chunk.start, chunk.end)
+            if records:
+                batch = RecordBatch.from_records(records, BarData)
+                for persistence in self._persistences:
+                    persistence.save_data(batch)
+            if self._checkpoint is not None:
+                self._checkpoint.add(chunk)
+            totals["chunks"] += 1
+            totals["bars"] += len(records)
+
+    async def run_async(
+        self, requests: Iterable[Tuple[str, str, object, object]]
+    ) -> dict:
+        """
+        Backfill (symbol, bar size, start, end) requests. See split_range.
+
+        Returns:
+            dict: Number of chunks completed, skipped (checkpointed before) and failed, and of bars saved.
+        """
+        chunks = [chunk for request in requests for chunk in split_range(*request)]
+        totals = {"chunks": 0, "skipped": 0, "failed": 0, "bars": 0}
+
+        contracts = await self._qualify({chunk.symbol for chunk in chunks})
+        queue: asyncio.Queue = asyncio.Queue()
+        for chunk in chunks:
+            if chunk.symbol not in contracts:
+                totals["failed"] += 1
+            elif self._checkpoint is not None and chunk in self._checkpoint:
+                totals["skipped"] += 1
+            else:
+                queue.put_nowait((chunk, 0))
+        print(f"Backfilling {queue.qsize()} chunks ({totals['skipped']} already done)")
+
+        error_event = getattr(self._ib, "errorEvent", None)
+        if error_event is not None:
+            error_event += self._on_error
+        try:
+            workers = [
+                asyncio.ensure_future(self._worker(queue, contracts, totals))
+                for _ in range(max(1, self._concurrency))
+            ]
+            await asyncio.gather(*workers)
+        finally:
+            if error_event is not None:
+                error_event -= self._on_error
+            self._errors.clear()
+
+        print(
+            f"Backfilled {totals['bars']} bars in {totals['chunks']} chunks, {totals['failed']} failed"
+        )
+        return totals
+
+    def run(self, requests: Iterable[Tuple[str, str, object, object]]) -> dict:
+        """Blocking version of run_async, on the event loop of the IB client."""
+        return self._ib.run(self.run_async(requests))
@@ -1,5 +1,24 @@
+from datetime import datetime, timedelta, timezone
+
 import ib_insync
 
-ib = ib_insync.IB()
+from brokerage_systems.ibkr.contract_cache import ContractCache
+from brokerage_systems.ibkr.historical_backfill import IBKRHistoricalBackfill
+
+if __name__ == "__main__":
+    from persistence.parquet import ParquetPersistence
+
+    ib = ib_insync.IB()
+    ib.connect("127.0.0.1", 4001, clientId=2)
 
-print(dir(ib))
+    end = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    backfill = IBKRHistoricalBackfill(
+        ib,
+        [ParquetPersistence("ibkr_bars.parquet")],
+        checkpoint_path="ibkr_backfill_checkpoint.json",
+        contract_cache=ContractCache("ibkr_contracts.json"),
+    )
+    backfill.run(
+        [(symbol, "1 min", end - timedelta(days=30), end) for symbol in ["SPY", "VOO"]]
+    )
+    ib.disconnect()
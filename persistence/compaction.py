@@ -0,0 +1,339 @@
+import argparse
+import json
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytz
+
+from persistence.file_sources import (
+    FileSource,
+    GCSFileSource,
+    LocalFileSource,
+    RecordedFile,
+)
+from persistence.parquet import parquet_manifest_entry
+from persistence.reader import RecordedDataReader
+from persistence.schema import SYMBOL_COLUMN, epoch_series, timestamp_column
+
+ROW_GROUP_SIZE_DEFAULT = 64 * 1024
+
+
+class CompactionResult(NamedTuple):
+    output: str  # Name of the compacted file, e.g. "snapshots_logs_2025-02-24.parquet"
+    fragments: List[str]  # Files merged into it (and deleted, unless a dry run)
+    rows_read: int
+    rows_written: int  # rows_read minus the duplicates
+
+
+def _hashable(value):
+    # Lists come from JSON files, arrays from Parquet files
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return value
+
+
+def _dedupe_key(df: pd.DataFrame) -> pd.DataFrame:
+    """The rows of df with unhashable values (lists such as trade conditions) as JSON text."""
+    converted = {
+        column: df[column].map(_hashable) for column in df.columns[df.dtypes == object]
+    }
+    return df.assign(**converted) if converted else df
+
+
+class Compactor:
+    """
+    Merges the rotated fragments of a recording into one Parquet file per day.
+
+    Every day's fragments (e.g. "snapshots_logs_2025-02-24.json",
+    "..._2025-02-24.json_0", "..._2025-02-24.json_1") are read, deduplicated,
+    sorted by symbol and time and written as "<base>_<date>.parquet". The row
+    count of the file, read back from the source, is verified before the
+    manifest is updated and the fragments are deleted. A crash between writing and deleting leaves
+    both the compacted file and the fragments; the next run merges them again
+    and the duplicates are dropped, so compaction can always be re-run.
+
+    Fragments without a date in their name (CSVPersistence rotations, e.g.
+    "intraday_prices.csv_3") are split into days by their timestamps. A
+    fragment with rows of `before` or later is left for a later run.
+
+    Days are compacted in parallel. Only days before `before` (by default
+    today, in the exchange time zone) are compacted, so files that are still
+    being written are never touched.
+    """
+
+    def __init__(
+        self,
+        source: FileSource,
+        base: str,
+        max_workers: int = 4,
+        row_group_size: int = ROW_GROUP_SIZE_DEFAULT,
+        compression: str = "zstd",
+        tzinfo=pytz.timezone("US/Eastern"),
+        dry_run: bool = False,
+    ):
+        """
+        Args:
+            source (FileSource): Local directory or GCS prefix with the recorded files.
+            base (str): Base name of the recording, e.g. "snapshots_logs".
+            max_workers (int): Number of days compacted in parallel.
+            row_group_size (int): Rows per row group of the compacted files.
+            compression (str): Parquet compression codec.
+            tzinfo: Timezone of the file dates.
+            dry_run (bool): Only report what would be compacted.
+        """
+        self._source = source
+        self._base = base
+        self._reader = RecordedDataReader(source, base)
+        self._max_workers = max_workers
+        self._row_group_size = row_group_size
+        self._compression = compression
+        self._tzinfo = tzinfo
+        self._dry_run = dry_run
+        self._manifest_lock = threading.Lock()
+
+    def _output_name(self, day: str) -> str:
+        return f"{self._base}_{day}.parquet"
+
+    @staticmethod
+    def _is_compacted(files: List[RecordedFile]) -> bool:
+        return (
+            len(files) == 1 and files[0].format == "parquet" and files[0].part is None
+        )
+
+    def _cutoff(self, before: Optional[date]) -> date:
+        """The first day not to compact: `before`, or today."""
+        if before is None:
+            return datetime.now(tz=self._tzinfo).date()
+        return before
+
+    def plan(
+        self, before: Optional[date] = None
+    ) -> Dict[Optional[str], List[RecordedFile]]:
+        """
+        Find the files to compact.
+
+        Returns:
+            Dict[Optional[str], List[RecordedFile]]: {ISO date: files of that day}, with
+            the undated rotated fragments under None.
+        """
+        before = self._cutoff(before)
+
+        groups = defaultdict(list)
+        for recorded in self._source.recorded_files(self._base):
+            if recorded.date is None:
+                # The unnumbered undated file is the one still being appended to
+                if recorded.part is not None:
+                    groups[None].append(recorded)
+            elif recorded.date < before.isoformat():
+                groups[recorded.date].append(recorded)
+
+        return {
+            day: files
+            for day, files in groups.items()
+            if day is None or not self._is_compacted(files)
+        }
+
+    def _read(self, files: List[RecordedFile]) -> pd.DataFrame:
+        frames = [self._reader.read_file(recorded) for recorded in files]
+        frames = [frame for frame in frames if len(frame)]
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    def _merge(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Drop duplicate rows and sort by symbol and time."""
+        df = df[~_dedupe_key(df).duplicated()]
+        ts_column = timestamp_column(list(df.columns))
+        order = [c for c in (SYMBOL_COLUMN, ts_column) if c is not None and c in df]
+        if order:
+            df = df.sort_values(order, kind="stable")
+        return df.reset_index(drop=True)
+
+    def _write(self, name: str, df: pd.DataFrame) -> dict:
+        """Write df as a Parquet file and verify it. Returns the manifest entry of the file."""
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        buffer = pa.BufferOutputStream()
+        pq.write_table(
+            table,
+            buffer,
+            row_group_size=self._row_group_size,
+            compression=self._compression,
+        )
+        data = buffer.getvalue()
+
+        if not self._dry_run:
+            self._source.write_bytes(
+                name, data.to_pybytes(), content_type="application/vnd.apache.parquet"
+            )
+            # Verify the object as stored, before the fragments are deleted
+            written_rows = pq.read_metadata(self._source.open(name)).num_rows
+            if written_rows != len(df):
+                raise ValueError(
+                    f"Compacted file {name} has {written_rows} rows, expected {len(df)}"
+                )
+        return parquet_manifest_entry(pa.BufferReader(data))
+
+    def _swap(self, outputs: Dict[str, dict], fragments: List[str]):
+        """Point the manifest at the compacted files and delete the fragments."""
+        if self._dry_run:
+            return
+        fragments = [name for name in fragments if name not in outputs]
+        with self._manifest_lock:
+            entries = {name: None for name in fragments}
+            entries.update(outputs)
+            self._source.update_manifest(entries)
+        for name in fragments:
+            self._source.delete(name)
+
+    def compact_day(self, day: str, files: List[RecordedFile]) -> CompactionResult:
+        """Merge the files of one day into "<base>_<day>.parquet"."""
+        df = self._read(files)
+        merged = self._merge(df)
+        output = self._output_name(day)
+        entry = self._write(output, merged)
+
+        fragments = [recorded.name for recorded in files]
+        self._swap({output: entry}, fragments)
+        return CompactionResult(output, fragments, len(df), len(merged))
+
+    def _days(self, df: pd.DataFrame) -> pd.Series:
+        """ISO date of every row, in the exchange time zone."""
+        ts_column = timestamp_column(list(df.columns))
+        if ts_column is None:
+            raise ValueError(
+                f"Cannot split undated files of {self._base} into days: no timestamp column"
+            )
+        return (
+            pd.to_datetime(epoch_series(df[ts_column]), unit="s", utc=True)
+            .dt.tz_convert(self._tzinfo)
+            .dt.strftime("%Y-%m-%d")
+        )
+
+    def compact_undated(
+        self, files: List[RecordedFile], before: Optional[date] = None
+    ) -> List[CompactionResult]:
+        """
+        Split undated fragments into days and merge each day into "<base>_<day>.parquet".
+
+        An existing compacted file of a day is merged with the new rows of that
+        day. Fragments with rows of `before` (default: today) or later are
+        left untouched, whole, so that none of their rows is compacted (and
+        read back twice) before they can be deleted.
+        """
+        cutoff = self._cutoff(before).isoformat()
+        frames, compacted = [], []
+        for recorded in files:
+            frame = self._reader.read_file(recorded)
+            if len(frame):
+                if self._days(frame).max() >= cutoff:
+                    print(f"Skipping {recorded.name}: it has rows of {cutoff} or later")
+                    continue
+                frames.append(frame)
+            compacted.append(recorded)
+        if not compacted:
+            return []
+
+        if not frames:
+            self._swap({}, [recorded.name for recorded in compacted])
+            return []
+        df = pd.concat(frames, ignore_index=True)
+        days = self._days(df)
+
+        existing = {
+            recorded.name for recorded in self._source.recorded_files(self._base)
+        }
+        results, outputs = [], {}
+        for day, rows in df.groupby(days, sort=True):
+            output = self._output_name(day)
+            day_df = rows
+            if output in existing:
+                day_df = pd.concat(
+                    [self._read([self._recorded(output)]), rows], ignore_index=True
+                )
+            merged = self._merge(day_df)
+            outputs[output] = self._write(output, merged)
+            results.append(CompactionResult(output, [], len(day_df), len(merged)))
+
+        # The fragments are only deleted once every day has been written
+        fragments = [recorded.name for recorded in compacted]
+        self._swap(outputs, fragments)
+        return [result._replace(fragments=fragments) for result in results]
+
+    def _recorded(self, name: str) -> RecordedFile:
+        for recorded in self._source.recorded_files(self._base):
+            if recorded.name == name:
+                return recorded
+        raise FileNotFoundError(name)
+
+    def run(self, before: Optional[date] = None) -> List[CompactionResult]:
+        """
+        Compact all days before `before` (default: today).
+
+        Returns:
+            List[CompactionResult]: One result per compacted file.
+        """
+        results = []
+
+        plan = self.plan(before)
+        if None in plan:
+            # Undated fragments may add rows to any day, so they go first
+            results.extend(self.compact_undated(plan[None], before))
+            plan = self.plan(before)
+            plan.pop(None, None)
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            results.extend(
+                executor.map(lambda item: self.compact_day(*item), sorted(plan.items()))
+            )
+
+        for result in results:
+            print(
+                f"{datetime.now().isoformat()}\tCompacted {len(result.fragments)} files into {result.output}: "
+                f"{result.rows_read} rows read, {result.rows_written} written"
+                + (" (dry run)" if self._dry_run else "")
+            )
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Merge rotated fragments of a recording into one Parquet file per day."
+    )
+    parser.add_argument(
+        "base", help='Base name of the recording, e.g. "snapshots_logs"'
+    )
+    location = parser.add_mutually_exclusive_group(required=True)
+    location.add_argument("--directory", help="Local directory of the recording")
+    location.add_argument("--bucket", help="GCS bucket of the recording")
+    parser.add_argument("--prefix", default="price_logs", help="GCS prefix")
+    parser.add_argument(
+        "--before",
+        type=date.fromisoformat,
+        default=None,
+        help="Compact days before this ISO date (default: today)",
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if args.directory is not None:
+        source = LocalFileSource(args.directory)
+    else:
+        source = GCSFileSource(args.bucket, args.prefix)
+
+    Compactor(source, args.base, max_workers=args.workers, dry_run=args.dry_run).run(
+        args.before
+    )
+
+
+if __name__ == "__main__":
+    main()
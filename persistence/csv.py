@@ -1,110 +1,227 @@
 import csv
-import datetime
+import gzip
+import io
+import json
 import os
-import shutil
 
-from typing import List
+from typing import List, Optional, Union
+
+import pandas as pd
 
-from definitions import TickerRecord
 from persistence.persistence import MAX_FILE_SIZE_DEFAULT, PersistenceLayer
+from persistence.record_batch import RecordBatch, flat_rows, record_type_of
+from persistence.schema import (
+    normalize_frame,
+    record_columns,
+    record_fields,
+)
+
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+FSYNC_POLICIES = ("batch", "rotate", "never")
+BUFFER_SIZE_DEFAULT = 1024 * 1024  # 1 MB
+
+
+def _encode_list(value):
+    """Lists (e.g. trade conditions) are stored as JSON arrays."""
+    return json.dumps(value) if isinstance(value, list) else value
+
+
+def _is_list_column(series: pd.Series) -> bool:
+    values = series.dropna()
+    return len(values) > 0 and isinstance(values.iloc[0], list)
 
 
 class CSVPersistence(PersistenceLayer):
-    """Implements CSV logging."""
+    """
+    Implements CSV logging.
+
+    The columns are taken from the record type (nested records such as the
+    bars of an AlpacaSnapshot are flattened) or from the DataFrame columns.
+    The file is kept open with a buffered handle between batches and can be
+    compressed on the fly. Full files are rotated by renaming them to
+    "<filename>_<n>"; the next batch then starts a fresh file with a header.
+    """
 
     def __init__(
         self,
         filename: str = "intraday_prices.csv",
         max_file_size: float = MAX_FILE_SIZE_DEFAULT,
+        record_type: Optional[type] = None,
+        fsync: str = "rotate",
+        compression: Optional[str] = None,
+        buffer_size: int = BUFFER_SIZE_DEFAULT,
     ):
+        """
+        Initializes CSV persistence layer.
+
+        Args:
+            filename (str): Path of the CSV file. Must end with ".csv".
+            max_file_size (float): Size in bytes (on disk) after which the file is rotated.
+            record_type (Optional[type]): Record NamedTuple defining the columns. Inferred from the first batch if not given.
+            fsync (str): "batch" to flush and fsync after every batch, "rotate" to flush after every batch and fsync on rotation and close, "never" to leave it to the buffer and OS.
+            compression (Optional[str]): None, "gzip" or "zstd". Adds ".gz" / ".zst" to the filename.
+            buffer_size (int): Size in bytes of the file buffer.
+        """
         super().__init__(max_file_size)
         # Check if the filename ends with ".csv"
         if not filename.endswith(".csv"):
             raise ValueError("Invalid filename. Must end with '.csv'.")
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Invalid fsync policy. Must be one of {FSYNC_POLICIES}.")
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError("Invalid compression. Must be None, 'gzip' or 'zstd'.")
+
+        self.filename = filename + COMPRESSION_SUFFIXES[compression]
+        self._fsync = fsync
+        self._compression = compression
+        self._buffer_size = buffer_size
+
+        self._columns: Optional[List[str]] = (
+            record_columns(record_type) if record_type is not None else None
+        )
+        self._raw = None  # Underlying (binary) file handle
+        self._stream = None  # Compressor stream, if compressed
+        self._text = None
+        self._writer = None
+
+    def _read_header(self) -> Optional[List[str]]:
+        """Read the header of an existing file, or None if there is no data yet."""
+        if not os.path.exists(self.filename) or os.path.getsize(self.filename) == 0:
+            return None
+
+        if self._compression == "gzip":
+            f = gzip.open(self.filename, "rt", newline="")
+        elif self._compression == "zstd":
+            import zstandard
+
+            f = io.TextIOWrapper(
+                zstandard.ZstdDecompressor().stream_reader(open(self.filename, "rb")),
+                newline="",
+            )
+        else:
+            f = open(self.filename, "r", newline="")
+        with f:
+            return next(csv.reader(f), None)
+
+    def _open(self, columns: List[str]):
+        """Open the file for appending, writing the header if the file is new."""
+        header = self._read_header()
+        if header is not None and header != columns:
+            raise ValueError(
+                f"Columns of {self.filename} do not match the data: {header} != {columns}"
+            )
 
-        self.filename = filename
-        # Check if the file exists. If yes, skip writing the header.
-        try:
-            with open(self.filename, "r") as csvfile:
-                pass
-        except FileNotFoundError:
-            with open(self.filename, "w", newline="") as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(
-                    [
-                        "timestamp",
-                        "symbol",
-                        "bid",
-                        "bid_size",
-                        "ask",
-                        "ask_size",
-                        "last",
-                        "last_size",
-                        "volume",
-                        "open",
-                        "high",
-                        "low",
-                        "close",
-                    ]
-                )
-
-    def save_ticker_records(self, data: List[TickerRecord]):
+        self._raw = open(self.filename, "ab", buffering=self._buffer_size)
+        if self._compression == "gzip":
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode="ab")
+        elif self._compression == "zstd":
+            import zstandard
+
+            self._stream = zstandard.ZstdCompressor().stream_writer(
+                self._raw, closefd=False
+            )
+        else:
+            self._stream = self._raw
+
+        self._text = io.TextIOWrapper(self._stream, encoding="utf-8", newline="")
+        self._writer = csv.writer(self._text)
+        self._columns = columns
+
+        if header is None:
+            self._writer.writerow(columns)
+
+    def _flush(self, fsync: bool):
+        self._text.flush()
+        if self._stream is not self._raw:
+            self._stream.flush()
+        self._raw.flush()
+        if fsync:
+            os.fsync(self._raw.fileno())
+
+    def _close_file(self):
+        if self._writer is None:
+            return
+        self._flush(fsync=self._fsync != "never")
+        # Closing the text wrapper finishes the compressed stream (gzip trailer,
+        # zstd frame end) and closes the file.
+        self._text.close()
+        if not self._raw.closed:
+            self._raw.close()
+        self._raw = self._stream = self._text = self._writer = None
+
+    def save_data(self, data: Union[List[tuple], RecordBatch, pd.DataFrame]):
+        """
+        Append records (or a DataFrame) to the CSV file.
+
+        Args:
+            data (Union[List[tuple], RecordBatch, pd.DataFrame]): Records of a single NamedTuple type, a RecordBatch or a DataFrame.
+        """
+        if len(data) == 0:
+            return
+
+        if isinstance(data, pd.DataFrame):
+            df = normalize_frame(data)
+            columns = self._columns or [str(column) for column in df.columns]
+            if self._writer is None:
+                self._open(columns)
+            list_columns = {
+                column: df[column].map(_encode_list)
+                for column in df.columns[df.dtypes == object]
+                if _is_list_column(df[column])
+            }
+            if list_columns:
+                df = df.assign(**list_columns)
+            df.to_csv(self._text, header=False, index=False, columns=columns)
+        else:
+            record_type = record_type_of(data)
+            if self._writer is None:
+                self._open(self._columns or record_columns(record_type))
+            rows = flat_rows(data)
+            list_columns = [
+                i
+                for i, field in enumerate(record_fields(record_type))
+                if field.type is list
+            ]
+            if list_columns:
+                rows = [list(row) for row in rows]
+                for row in rows:
+                    for i in list_columns:
+                        row[i] = _encode_list(row[i])
+            self._writer.writerows(rows)
+
+        if self._fsync != "never":
+            self._flush(fsync=self._fsync == "batch")
+
+    def save_ticker_records(self, data: list):
         """Append price data to a CSV file."""
-        with open(self.filename, "a", newline="") as csvfile:
-            writer = csv.writer(csvfile)
-            for price in data:
-                writer.writerow(
-                    [
-                        price.timestamp,
-                        price.symbol,
-                        price.bid,
-                        price.bid_size,
-                        price.ask,
-                        price.ask_size,
-                        price.last,
-                        price.last_size,
-                        price.volume,
-                        price.open,
-                        price.high,
-                        price.low,
-                        price.close,
-                    ]
-                )
+        self.save_data(data)
         print(f"Saved to CSV: {self.filename}")
 
     def _rotate_files(self):
-        """Rotate files if they exceed the maximum file size."""
-        if os.path.getsize(self.filename) >= self.max_file_size:
-            # check if the current filename ends with ".csv_<number>"
-            if ".csv_" in self.filename:
-                # The new filename should be with <number> incremented by 1
-                parts = self.filename.split(".csv_")
-                new_filename = f"{parts[0]}.csv_{int(parts[1]) + 1}"
-            else:
-                # The new filename should be with "_0" appended
-                shutil.move(self.filename, f"{self.filename}_0")
-                new_filename = f"{self.filename}_1"
-
-            with open(new_filename, "w", newline="") as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(
-                    [
-                        "timestamp",
-                        "symbol",
-                        "bid",
-                        "bid_size",
-                        "ask",
-                        "ask_size",
-                        "last",
-                        "last_size",
-                        "volume",
-                        "open",
-                        "high",
-                        "low",
-                        "close",
-                    ]
-                )
-            print(f"Rotated CSV file: {self.filename} -> {new_filename}")
-
-            # Update the current filename
-            self.filename = new_filename
+        """Rotate the file by renaming it to "<filename>_<n>" if it exceeds the maximum file size."""
+        if self._raw is not None:
+            size = self._raw.tell()
+        elif os.path.exists(self.filename):
+            size = os.path.getsize(self.filename)
+        else:
+            return
+
+        if size < self.max_file_size:
+            return
+
+        self._close_file()
+
+        directory, basename = os.path.split(self.filename)
+        prefix = basename + "_"
+        parts = [
+            int(name[len(prefix) :])
+            for name in os.listdir(directory or ".")
+            if name.startswith(prefix) and name[len(prefix) :].isdigit()
+        ]
+        new_filename = f"{self.filename}_{max(parts) + 1 if parts else 0}"
+        os.replace(self.filename, new_filename)
+        print(f"Rotated CSV file: {self.filename} -> {new_filename}")
+
+    def close(self):
+        """Flush and close the file."""
+        self._close_file()
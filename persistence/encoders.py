@@ -0,0 +1,123 @@
+import csv
+import io
+import json
+import math
+from typing import List, Union
+
+from persistence.record_batch import RecordBatch, record_type_of
+from persistence.schema import record_columns, record_fields, record_getter
+
+
+def _csv_list(value):
+    """Lists (e.g. trade conditions) are stored as JSON arrays, as in CSVPersistence."""
+    return json.dumps(value) if isinstance(value, list) else value
+
+
+def _to_dict(value):
+    """Nested dictionary of a record, like recursive_asdict."""
+    if isinstance(value, tuple) and hasattr(value, "_fields"):
+        return {name: _to_dict(item) for name, item in zip(value._fields, value)}
+    if isinstance(value, list):
+        return [_to_dict(item) for item in value]
+    return value
+
+
+def _finite(value):
+    """The value with NaN and infinite floats replaced by None."""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _finite(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_finite(item) for item in value]
+    return value
+
+
+def _json_dumps(value) -> str:
+    """json.dumps, with missing (NaN) and infinite values written as null, as JSON has neither."""
+    try:
+        return json.dumps(value, allow_nan=False)
+    except ValueError:
+        return json.dumps(_finite(value))
+
+
+def _records(records: Union[List[tuple], RecordBatch]) -> List[tuple]:
+    if isinstance(records, RecordBatch):
+        return records.to_records()
+    return records
+
+
+def encode_json_items(records: Union[List[tuple], RecordBatch]) -> bytes:
+    """
+    Encode records as the items of a JSON array, without the brackets.
+
+    The result can be spliced into an existing JSON array file.
+    """
+    if not records:
+        return b""
+    return _json_dumps([_to_dict(record) for record in _records(records)])[
+        1:-1
+    ].encode()
+
+
+def encode_json(records: Union[List[tuple], RecordBatch]) -> bytes:
+    """
+    Encode records as a JSON array.
+
+    The output is that of `json.dumps([recursive_asdict(r) for r in records])`,
+    except that NaN and infinite values are written as null.
+    """
+    return b"[" + encode_json_items(records) + b"]"
+
+
+def encode_ndjson(records: Union[List[tuple], RecordBatch]) -> bytes:
+    """Encode records as newline-delimited JSON, one object (as in encode_json) per line."""
+    if not records:
+        return b""
+    return "".join(
+        [_json_dumps(_to_dict(record)) + "\n" for record in _records(records)]
+    ).encode()
+
+
+def encode_csv(records: Union[List[tuple], RecordBatch], header: bool = True) -> bytes:
+    """
+    Encode records as CSV rows with flattened columns.
+
+    Args:
+        records (Union[List[tuple], RecordBatch]): Records of a single NamedTuple type or a RecordBatch.
+        header (bool): Write the header row first.
+    """
+    if not records:
+        return b""
+    record_type = record_type_of(records)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(record_columns(record_type))
+
+    if isinstance(records, RecordBatch):
+        rows = records.rows()
+    else:
+        getter = record_getter(record_type)
+        rows = [getter(record) for record in records]
+    list_columns = [
+        i for i, field in enumerate(record_fields(record_type)) if field.type is list
+    ]
+    if list_columns:
+        rows = [list(row) for row in rows]
+        for row in rows:
+            for i in list_columns:
+                row[i] = _csv_list(row[i])
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def encode_msgpack(records: Union[List[tuple], RecordBatch]) -> bytes:
+    """Encode records as a msgpack array of (nested) maps."""
+    import msgpack
+
+    if not records:
+        return msgpack.packb([])
+    return msgpack.packb(
+        [_to_dict(record) for record in _records(records)], use_bin_type=True
+    )
@@ -0,0 +1,193 @@
+import io
+import json
+import os
+import re
+from abc import ABC, abstractmethod
+from typing import Dict, List, NamedTuple, Optional
+
+# Recorded file names look like "<base>[_<date>].<format>[.<compression>][_<part>]", e.g.
+#   snapshots_logs_2025-02-24.json_1, intraday_prices.csv_3,
+#   trades_2025-02-24.csv, snapshots_logs_2025-02-24.parquet_0, ticks.csv.gz_2
+_FILENAME_PATTERN = re.compile(
+    r"^(?P<base>.+?)(?:_(?P<date>\d{4}-\d{2}-\d{2}))?"
+    r"\.(?P<format>json|csv|parquet)"
+    r"(?:\.(?P<compression>gz|zst))?"
+    r"(?:_(?P<part>\d+))?$"
+)
+
+MANIFEST_FILENAME = "_manifest.json"
+
+
+class RecordedFile(NamedTuple):
+    name: str  # Name relative to the source, e.g. "snapshots_logs_2025-02-24.json_1"
+    base: str
+    date: Optional[str]  # ISO date, if the file is per day
+    format: str  # "json", "csv" or "parquet"
+    compression: Optional[str]  # "gz", "zst" or None
+    part: Optional[int]  # Rotation part, None for the active/unrotated file
+    size: int
+
+
+def parse_filename(name: str, size: int = 0) -> Optional[RecordedFile]:
+    """Parse a recorded file name, or return None if it is not one."""
+    match = _FILENAME_PATTERN.match(name)
+    if match is None:
+        return None
+    return RecordedFile(
+        name=name,
+        base=match["base"],
+        date=match["date"],
+        format=match["format"],
+        compression=match["compression"],
+        part=int(match["part"]) if match["part"] is not None else None,
+        size=size,
+    )
+
+
+class FileSource(ABC):
+    """A flat directory of recorded files, local or in GCS."""
+
+    @abstractmethod
+    def list_files(self) -> Dict[str, int]:
+        """Return {file name: size in bytes}."""
+        pass
+
+    @abstractmethod
+    def read_bytes(self, name: str) -> bytes:
+        """Read a whole file. Raises FileNotFoundError if it does not exist."""
+        pass
+
+    @abstractmethod
+    def write_bytes(self, name: str, data: bytes, content_type: str = None):
+        """Write (or replace) a whole file."""
+        pass
+
+    @abstractmethod
+    def delete(self, name: str):
+        """Delete a file. Missing files are ignored."""
+        pass
+
+    def open(self, name: str):
+        """Open a file for binary reading (a path for local files)."""
+        return io.BytesIO(self.read_bytes(name))
+
+    def recorded_files(self, base: Optional[str] = None) -> List[RecordedFile]:
+        """List the recorded files, optionally only those with the given base name."""
+        files = []
+        for name, size in self.list_files().items():
+            recorded = parse_filename(name, size)
+            if recorded is not None and (base is None or recorded.base == base):
+                files.append(recorded)
+        return sorted(files, key=lambda f: (f.base, f.date or "", f.part or 0))
+
+    def read_manifest(self) -> dict:
+        """
+        Read the manifest of the source.
+
+        The manifest maps file names to metadata written by the sinks when a
+        file is finalized: {"rows", "symbols", "min_timestamp", "max_timestamp"}.
+        """
+        try:
+            return json.loads(self.read_bytes(MANIFEST_FILENAME))
+        except FileNotFoundError:
+            return {}
+
+    def update_manifest(self, entries: Dict[str, Optional[dict]]):
+        """Add, replace or (with a None entry) remove manifest entries."""
+        manifest = self.read_manifest()
+        for name, entry in entries.items():
+            if entry is None:
+                manifest.pop(name, None)
+            else:
+                manifest[name] = entry
+        self.write_bytes(
+            MANIFEST_FILENAME,
+            json.dumps(manifest, indent=1).encode(),
+            content_type="application/json",
+        )
+
+
+class LocalFileSource(FileSource):
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def list_files(self) -> Dict[str, int]:
+        if not os.path.isdir(self.directory):
+            return {}
+        return {
+            entry.name: entry.stat().st_size
+            for entry in os.scandir(self.directory)
+            if entry.is_file()
+        }
+
+    def read_bytes(self, name: str) -> bytes:
+        with open(self._path(name), "rb") as f:
+            return f.read()
+
+    def write_bytes(self, name: str, data: bytes, content_type: str = None):
+        # Write to a temporary file and rename, so readers never see partial files
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self._path(name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(name))
+
+    def delete(self, name: str):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    def open(self, name: str):
+        return self._path(name)
+
+
+class GCSFileSource(FileSource):
+    def __init__(self, bucket_name: str, prefix: str, client=None):
+        """
+        Args:
+            bucket_name (str): Name of the GCS bucket.
+            prefix (str): Prefix path in GCS (folder-like structure), e.g. "stocks/intraday_data".
+            client: A google.cloud.storage.Client. Created if not given.
+        """
+        if client is None:
+            from google.cloud import storage
+
+            client = storage.Client()
+        self.bucket = client.bucket(bucket_name)
+        self.prefix = prefix.rstrip("/")
+
+    def _blob_name(self, name: str) -> str:
+        return f"{self.prefix}/{name}"
+
+    def list_files(self) -> Dict[str, int]:
+        files = {}
+        for blob in self.bucket.list_blobs(prefix=self.prefix + "/"):
+            name = blob.name[len(self.prefix) + 1 :]
+            if "/" not in name:
+                files[name] = blob.size
+        return files
+
+    def read_bytes(self, name: str) -> bytes:
+        from google.api_core.exceptions import NotFound
+
+        try:
+            return self.bucket.blob(self._blob_name(name)).download_as_bytes()
+        except NotFound:
+            raise FileNotFoundError(name)
+
+    def write_bytes(self, name: str, data: bytes, content_type: str = None):
+        self.bucket.blob(self._blob_name(name)).upload_from_string(
+            data, content_type=content_type
+        )
+
+    def delete(self, name: str):
+        from google.api_core.exceptions import NotFound
+
+        try:
+            self.bucket.blob(self._blob_name(name)).delete()
+        except NotFound:
+            pass
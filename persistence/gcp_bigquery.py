@@ -1,9 +1,19 @@
+import io
+import os
+import time
+from datetime import datetime
 from typing import List, Optional, Union
+from google.api_core.exceptions import Conflict, NotFound
 from google.cloud import bigquery
 import pandas as pd
 import pandas_gbq
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
+from persistence.parquet import schema_for, to_arrow_table
 from persistence.persistence import PersistenceLayer
+from persistence.record_batch import RecordBatch
 
 
 # Define the BigQuery client
@@ -13,15 +23,20 @@ class BigQueryPersistence(PersistenceLayer):
         project_id: Optional[str] = None,
         dataset_id: Optional[str] = None,
         table_id: Optional[str] = None,
+        raise_errors: bool = False,
     ):
+        """
+        :param raise_errors: Re-raise failed inserts instead of logging them. Set by SpooledPersistence, whose replayer retries them.
+        """
         self._client = bigquery.Client(project=project_id)
         self._project_id = project_id
         self._dataset_id = dataset_id
         self._table_id = table_id
+        self.raise_errors = raise_errors
 
     def insert_rows(
         self,
-        rows: Union[dict, list, pd.DataFrame],
+        rows: Union[dict, list, RecordBatch, pd.DataFrame],
         project_id: Optional[str] = None,
         dataset_id: Optional[str] = None,
         table_id: Optional[str] = None,
@@ -29,12 +44,13 @@ class BigQueryPersistence(PersistenceLayer):
         """
         Inserts rows into a BigQuery table.
 
-        :param rows: The rows to insert. Can be a dictionary, list of dictionaries, or a DataFrame. When using a dictionary or list of dictionaries, the keys must match the column names.
+        :param rows: The rows to insert. Can be a dictionary, list of dictionaries, a RecordBatch (flattened columns), or a DataFrame. When using a dictionary or list of dictionaries, the keys must match the column names.
         :param project_id: The project ID.
         :param dataset_id: The dataset ID.
         :param table_id: The table ID.
 
         :return: None
+        :raises Exception: If the rows could not be inserted and raise_errors is set, so that a spool replayer can retry.
         """
         project_id = project_id or self._project_id
         dataset_id = dataset_id or self._dataset_id
@@ -46,6 +62,10 @@ class BigQueryPersistence(PersistenceLayer):
         destination_table_id = f"{dataset_id}.{table_id}"
         full_table_id = f"{project_id}.{destination_table_id}.{table_id}"
 
+        if isinstance(rows, RecordBatch):
+            columns = rows.column_names
+            rows = [dict(zip(columns, row)) for row in rows.rows()]
+
         try:
             if isinstance(rows, pd.DataFrame):
                 print("Inserting rows using pandas_gbq:")
@@ -69,11 +89,370 @@ class BigQueryPersistence(PersistenceLayer):
                     raise Exception(f"Errors: {errors}")
         except Exception as e:
             print(f"Failed to insert rows: {e}")
+            if self.raise_errors:
+                raise
 
-    def save_data(self, data: Union[List[dict], pd.DataFrame]):
+    def save_data(self, data: Union[List[dict], RecordBatch, pd.DataFrame]):
         """
         Save data to the BigQuery table.
 
-        :param data: The data to save. Can be a list of dictionaries or DataFrames.
+        :param data: The data to save. Can be a list of dictionaries, a RecordBatch or DataFrames.
         """
         self.insert_rows(data)
+
+
+_BIGQUERY_TYPES = [
+    (pa.types.is_floating, "FLOAT64"),
+    (pa.types.is_integer, "INT64"),
+    (pa.types.is_boolean, "BOOL"),
+    (pa.types.is_timestamp, "TIMESTAMP"),
+    (pa.types.is_date, "DATE"),
+    (pa.types.is_decimal, "NUMERIC"),
+    (pa.types.is_binary, "BYTES"),
+]
+
+
+def bigquery_schema(schema: pa.Schema) -> List[bigquery.SchemaField]:
+    """Map an Arrow schema onto BigQuery schema fields."""
+    fields = []
+    for field in schema:
+        field_type, mode = field.type, "NULLABLE"
+        if pa.types.is_list(field_type):
+            field_type, mode = field_type.value_type, "REPEATED"
+        if pa.types.is_dictionary(field_type):
+            field_type = field_type.value_type
+        bigquery_type = next(
+            (name for check, name in _BIGQUERY_TYPES if check(field_type)), "STRING"
+        )
+        fields.append(bigquery.SchemaField(field.name, bigquery_type, mode=mode))
+    return fields
+
+
+def _avro_type(field_type: pa.DataType):
+    if pa.types.is_list(field_type):
+        return {"type": "array", "items": ["null", _avro_type(field_type.value_type)]}
+    if pa.types.is_floating(field_type):
+        return "double"
+    if pa.types.is_integer(field_type):
+        return "long"
+    if pa.types.is_boolean(field_type):
+        return "boolean"
+    if pa.types.is_timestamp(field_type):
+        return {"type": "long", "logicalType": "timestamp-micros"}
+    if pa.types.is_date(field_type):
+        return {"type": "int", "logicalType": "date"}
+    return "string"
+
+
+def _write_avro(table: pa.Table, buffer: io.BytesIO):
+    import fastavro
+
+    schema = {
+        "type": "record",
+        "name": "Row",
+        "fields": [
+            {"name": field.name, "type": ["null", _avro_type(field.type)]}
+            for field in table.schema
+        ],
+    }
+    fastavro.writer(buffer, fastavro.parse_schema(schema), table.to_pylist())
+
+
+class _LocalLoadJob:
+    def __init__(self, output_rows: int):
+        self.output_rows = output_rows
+
+    def result(self, timeout: Optional[float] = None) -> "_LocalLoadJob":
+        return self
+
+
+class LocalBigQueryClient:
+    """
+    Local stand-in for the parts of bigquery.Client used by BigQueryLoadPersistence.
+
+    Tables are kept in memory and every load job is stored as a file under
+    `directory`, so that tests and local runs can inspect what would have been
+    loaded without a GCP project.
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.tables = {}
+        self.load_jobs = []
+
+    def get_table(self, table_id: str) -> bigquery.Table:
+        if table_id not in self.tables:
+            raise NotFound(f"Table {table_id} not found")
+        return self.tables[table_id]
+
+    def create_table(self, table: bigquery.Table, exists_ok: bool = False):
+        table_id = f"{table.project}.{table.dataset_id}.{table.table_id}"
+        if table_id in self.tables and not exists_ok:
+            raise Conflict(f"Table {table_id} already exists")
+        self.tables.setdefault(table_id, table)
+        return self.tables[table_id]
+
+    def load_table_from_file(
+        self, file_obj, destination: str, job_config: bigquery.LoadJobConfig, **kwargs
+    ) -> _LocalLoadJob:
+        self.get_table(destination)
+        extension = job_config.source_format.lower()
+        path = os.path.join(
+            self.directory, f"{destination}.{len(self.load_jobs)}.{extension}"
+        )
+        with open(path, "wb") as f:
+            f.write(file_obj.read())
+
+        if job_config.source_format == bigquery.SourceFormat.PARQUET:
+            output_rows = pq.ParquetFile(path).metadata.num_rows
+        else:
+            import fastavro
+
+            with open(path, "rb") as f:
+                output_rows = sum(1 for _ in fastavro.reader(f))
+
+        self.load_jobs.append((destination, path, output_rows))
+        return _LocalLoadJob(output_rows)
+
+    def read_table(self, table_id: str) -> pd.DataFrame:
+        """Read back everything loaded into a table (Parquet loads only)."""
+        return pd.concat(
+            [
+                pd.read_parquet(path)
+                for destination, path, _ in self.load_jobs
+                if destination == table_id and path.endswith(".parquet")
+            ],
+            ignore_index=True,
+        )
+
+
+class BigQueryLoadPersistence(PersistenceLayer):
+    """
+    Loads rows into BigQuery with batched load jobs.
+
+    Rows are collected in a local columnar (Arrow) buffer and sent as a single
+    Parquet or Avro load job once `max_rows` rows or `max_bytes` bytes are
+    buffered, or the oldest buffered row is `max_latency` seconds old. Load jobs
+    are free and not subject to the streaming insert quotas. The destination
+    table is looked up once (and created, optionally partitioned and clustered,
+    if it does not exist yet) and its schema cached.
+    """
+
+    def __init__(
+        self,
+        project_id: str,
+        dataset_id: str,
+        table_id: str,
+        client=None,
+        source_format: str = "PARQUET",
+        max_rows: int = 500_000,
+        max_bytes: float = 100 * 1e6,
+        max_latency: float = 5 * 60,
+        partition_field: Optional[str] = None,
+        partition_type: str = "DAY",
+        clustering_fields: Optional[List[str]] = None,
+        epoch_to_timestamp: bool = True,
+        allow_field_addition: bool = True,
+    ):
+        """
+        Initializes the BigQuery load job persistence layer.
+
+        Args:
+            project_id (str): The project ID.
+            dataset_id (str): The dataset ID.
+            table_id (str): The table ID.
+            client: A bigquery.Client or a LocalBigQueryClient. Created if not given.
+            source_format (str): "PARQUET" or "AVRO" (requires fastavro).
+            max_rows (int): Number of buffered rows that triggers a load job.
+            max_bytes (float): Buffered bytes that trigger a load job.
+            max_latency (float): Seconds after which buffered rows are loaded.
+            partition_field (Optional[str]): Column to partition a newly created table by. None for ingestion time partitioning if partition_type is set.
+            partition_type (str): Time partitioning granularity ("HOUR", "DAY", "MONTH", "YEAR"), or None for no partitioning.
+            clustering_fields (Optional[List[str]]): Columns to cluster a newly created table by, e.g. ["symbol"].
+            epoch_to_timestamp (bool): Store float epoch "*timestamp" columns of records as TIMESTAMP.
+            allow_field_addition (bool): Add new columns to the table when the data has them.
+        """
+        super().__init__()
+
+        source_format = source_format.upper()
+        if source_format not in (
+            bigquery.SourceFormat.PARQUET,
+            bigquery.SourceFormat.AVRO,
+        ):
+            raise ValueError("Invalid source format. Must be 'PARQUET' or 'AVRO'.")
+
+        self._client = client if client is not None else bigquery.Client(project_id)
+        self._table_ref = f"{project_id}.{dataset_id}.{table_id}"
+        self._source_format = source_format
+        self._max_rows = max_rows
+        self._max_bytes = max_bytes
+        self._max_latency = max_latency
+        self._partition_field = partition_field
+        self._partition_type = partition_type
+        self._clustering_fields = clustering_fields
+        self._epoch_to_timestamp = epoch_to_timestamp
+        self._allow_field_addition = allow_field_addition
+
+        self._table: Optional[bigquery.Table] = None  # Cached destination table
+        self._source_schema: Optional[pa.Schema] = None  # Schema of the incoming data
+        self._schema: Optional[pa.Schema] = None  # Schema of the loaded data
+        self._buffer: List[pa.Table] = []
+        self._buffered_rows = 0
+        self._buffered_bytes = 0
+        self._oldest = None
+
+    def _to_table(
+        self, data: Union[List[tuple], RecordBatch, pd.DataFrame]
+    ) -> pa.Table:
+        if self._schema is None:
+            schema = schema_for(data)
+            table = to_arrow_table(data, schema)
+        else:
+            table = to_arrow_table(data, self._source_schema)
+
+        if self._epoch_to_timestamp and not isinstance(data, pd.DataFrame):
+            for i, field in enumerate(table.schema):
+                if field.name.endswith("timestamp") and pa.types.is_floating(
+                    field.type
+                ):
+                    micros = pc.cast(
+                        pc.multiply(table.column(i), 1e6), pa.int64(), safe=False
+                    )
+                    table = table.set_column(
+                        i,
+                        field.name,
+                        micros.cast(pa.timestamp("us", tz="UTC")),
+                    )
+
+        if self._schema is None:
+            self._source_schema = schema
+            self._schema = table.schema
+        return table
+
+    def save_data(self, data: Union[List[tuple], RecordBatch, pd.DataFrame]):
+        """
+        Buffer rows and start a load job if a threshold is reached.
+
+        Args:
+            data (Union[List[tuple], RecordBatch, pd.DataFrame]): Records of a single NamedTuple type, a RecordBatch or a DataFrame.
+        """
+        if len(data) == 0:
+            return
+
+        table = self._to_table(data)
+        self._buffer.append(table)
+        self._buffered_rows += table.num_rows
+        self._buffered_bytes += table.nbytes
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+
+        if (
+            self._buffered_rows >= self._max_rows
+            or self._buffered_bytes >= self._max_bytes
+        ):
+            try:
+                self.flush()
+            except Exception:
+                # Leave the failed batch to the caller (e.g. a spool replayer)
+                # and keep the rows buffered before it.
+                self._buffer.pop()
+                self._buffered_rows -= table.num_rows
+                self._buffered_bytes -= table.nbytes
+                raise
+
+    def _get_table(self) -> bigquery.Table:
+        """Get (or create) the destination table, cached after the first call."""
+        if self._table is not None:
+            return self._table
+
+        try:
+            self._table = self._client.get_table(self._table_ref)
+        except NotFound:
+            table = bigquery.Table(
+                self._table_ref, schema=bigquery_schema(self._schema)
+            )
+            if self._partition_type is not None:
+                table.time_partitioning = bigquery.TimePartitioning(
+                    type_=self._partition_type, field=self._partition_field
+                )
+            if self._clustering_fields:
+                table.clustering_fields = self._clustering_fields
+            self._table = self._client.create_table(table, exists_ok=True)
+            print(f"Created BigQuery table {self._table_ref}")
+        return self._table
+
+    def _align(self, table: pa.Table) -> pa.Table:
+        """Drop columns the destination table does not have, unless they may be added."""
+        columns = {field.name for field in self._get_table().schema}
+        missing = [name for name in table.column_names if name not in columns]
+        if not missing or self._allow_field_addition:
+            return table
+        print(f"Dropping columns not in {self._table_ref}: {missing}")
+        return table.drop_columns(missing)
+
+    def flush(self):
+        """Load all buffered rows with a single load job and wait for it to finish."""
+        if not self._buffer:
+            return
+
+        table = self._align(pa.concat_tables(self._buffer))
+
+        job_config = bigquery.LoadJobConfig(
+            source_format=self._source_format,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        )
+        if self._allow_field_addition:
+            job_config.schema_update_options = [
+                bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION
+            ]
+
+        buffer = io.BytesIO()
+        if self._source_format == bigquery.SourceFormat.PARQUET:
+            parquet_options = bigquery.ParquetOptions()
+            parquet_options.enable_list_inference = True
+            job_config.parquet_options = parquet_options
+            # BigQuery TIMESTAMP has microsecond precision
+            pq.write_table(
+                table,
+                buffer,
+                compression="snappy",
+                coerce_timestamps="us",
+                allow_truncated_timestamps=True,
+            )
+        else:
+            job_config.use_avro_logical_types = True
+            _write_avro(table, buffer)
+        buffer.seek(0)
+
+        tic = time.monotonic()
+        job = self._client.load_table_from_file(
+            buffer, self._table_ref, job_config=job_config
+        )
+        job.result()
+        print(
+            f"{datetime.now().isoformat()}\tLoaded {job.output_rows} rows into {self._table_ref} in {time.monotonic() - tic:.2f}s"
+        )
+
+        if set(table.column_names) - {field.name for field in self._table.schema}:
+            self._table = None  # Columns were added, refresh the cached schema
+
+        self._buffer = []
+        self._buffered_rows = 0
+        self._buffered_bytes = 0
+        self._oldest = None
+
+    def has_buffered_data(self) -> bool:
+        return bool(self._buffer)
+
+    def _rotate_files(self):
+        """Load buffered rows once the oldest of them reaches max_latency."""
+        if (
+            self._oldest is not None
+            and time.monotonic() - self._oldest >= self._max_latency
+        ):
+            self.flush()
+
+    def close(self):
+        """Load all buffered rows."""
+        self.flush()
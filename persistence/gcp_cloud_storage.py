@@ -1,14 +1,13 @@
-import csv
 from datetime import datetime, time
-from io import StringIO
 import json
-from typing import List, NamedTuple
-from google.cloud import storage
-from google.api_core.exceptions import GoogleAPIError
+from typing import List, NamedTuple, Optional, Union
 import pytz
 
 from definitions import TickerRecord
+from persistence.encoders import encode_csv, encode_json_items
 from persistence.persistence import MAX_FILE_SIZE_DEFAULT, PersistenceLayer
+from persistence.record_batch import RecordBatch
+from persistence.storage_ledger import StorageLedger, format_size
 
 
 def get_bucket_size(bucket_name):
@@ -21,6 +20,9 @@ def get_bucket_size(bucket_name):
     Returns:
         tuple: (size_bytes, size_human_readable)
     """
+    from google.api_core.exceptions import GoogleAPIError
+    from google.cloud import storage
+
     try:
         # Initialize the GCS client
         storage_client = storage.Client()
@@ -36,18 +38,7 @@ def get_bucket_size(bucket_name):
         for blob in blobs:
             total_size_bytes += blob.size
 
-        # Convert to human-readable format
-        units = ["B", "KB", "MB", "GB", "TB", "PB"]
-        size = float(total_size_bytes)
-        unit_index = 0
-
-        while size >= 1024 and unit_index < len(units) - 1:
-            size /= 1024
-            unit_index += 1
-
-        size_human_readable = f"{size:.2f} {units[unit_index]}"
-
-        return total_size_bytes, size_human_readable
+        return total_size_bytes, format_size(total_size_bytes)
 
     except GoogleAPIError as e:
         print(f"Error accessing bucket {bucket_name}: {e}")
@@ -55,7 +46,11 @@ def get_bucket_size(bucket_name):
 
 
 def recursive_asdict(obj):
-    """Recursively converts NamedTuple instances into dictionaries."""
+    """
+    Recursively converts NamedTuple instances into dictionaries.
+
+    Generic fallback; the sinks encode records with persistence.encoders.
+    """
     if hasattr(obj, "_asdict"):  # If obj is a NamedTuple
         return {key: recursive_asdict(value) for key, value in obj._asdict().items()}
     elif isinstance(obj, list):  # If obj is a list, process each item
@@ -79,6 +74,7 @@ class GCSPersistence(PersistenceLayer):
         new_date_hour: time = time(
             0, 0, tzinfo=pytz.timezone("US/Eastern")
         ),  # (24-hour format) - Not implemented yet!
+        ledger: Optional[StorageLedger] = None,
     ):
         """
         Initializes GCS persistence layer.
@@ -87,9 +83,13 @@ class GCSPersistence(PersistenceLayer):
             bucket_name (str): Name of the GCS bucket.
             gcs_prefix (str): Prefix path in GCS (folder-like structure).
             format (str): Storage format - "json" or "csv".
+            ledger (Optional[StorageLedger]): Storage ledger of the bucket, updated with every upload and rotation.
         """
         super().__init__(max_file_size)
 
+        # Imported here: google.cloud.storage is slow to import and only needed by this sink
+        from google.cloud import storage
+
         self.gcs_client = storage.Client()
         self.bucket = self.gcs_client.bucket(bucket_name)
         self.gcs_prefix = gcs_prefix
@@ -103,6 +103,7 @@ class GCSPersistence(PersistenceLayer):
         self._tzinfo = tzinfo
 
         self._base_filename = filename
+        self._ledger = ledger
 
         self.filename = (
             gcs_prefix
@@ -129,90 +130,68 @@ class GCSPersistence(PersistenceLayer):
         elif self.format == "csv":
             self._append_csv(data)
 
+    def save_data(self, data: Union[List[NamedTuple], RecordBatch]):
+        """Append records (or a RecordBatch) to GCS in the configured format."""
+        self.save_ticker_records(data)
+
     def _append_json(self, data: List[NamedTuple]):
         """Append new data to an existing JSON file or create a new one."""
+        from google.api_core.exceptions import NotFound
+
         blob = self.bucket.blob(self.filename)
 
-        # Try to download existing JSON data
+        # Try to download existing JSON data. Any error other than a missing
+        # file is raised, so that the existing data is never overwritten.
         try:
-            existing_data = json.loads(blob.download_as_text())
-        except Exception:
-            existing_data = []  # File does not exist or is empty
-
-        # print(json.dumps(recursive_asdict(data[0])))
-
-        # Append new records as dictionaries
-        new_data = existing_data + [recursive_asdict(record) for record in data]
-
-        # print(new_data)
+            existing_data = blob.download_as_bytes().rstrip()
+        except NotFound:
+            existing_data = b""  # File does not exist
+
+        # Splice the new records into the existing array instead of parsing
+        # and re-encoding it
+        new_items = encode_json_items(data)
+        if existing_data in (b"", b"[]"):
+            new_data = b"[" + new_items + b"]"
+        elif not new_items:
+            new_data = existing_data
+        else:
+            if not existing_data.endswith(b"]"):
+                raise ValueError(f"{self.filename} does not contain a JSON array")
+            new_data = existing_data[:-1] + b", " + new_items + b"]"
 
         # Upload back to GCS
-        blob.upload_from_string(json.dumps(new_data), content_type="application/json")
+        blob.upload_from_string(new_data, content_type="application/json")
+        self._record_upload(blob)
         print(
             f"{datetime.now().isoformat()}\tAppended JSON data to GCS: gs://{self.bucket.name}/{self.filename}"
         )
 
-    def _append_csv(self, data: List[TickerRecord]):
+    def _append_csv(self, data: List[NamedTuple]):
         """Append new data to an existing CSV file or create a new one."""
+        from google.api_core.exceptions import NotFound
+
         blob = self.bucket.blob(self.filename)
-        existing_data = ""
+        existing_data = b""
 
         # Try to download existing CSV data
         try:
-            existing_data = blob.download_as_text()
-        except Exception:
+            existing_data = blob.download_as_bytes()
+        except NotFound:
             print(f"File {self.filename} does not exist or is empty.")
 
-        # Prepare CSV buffer
-        csv_buffer = StringIO()
-        csv_writer = csv.writer(csv_buffer)
-
         # Write header only if it's a new file
-        if not existing_data:
-            csv_writer.writerow(
-                [
-                    "timestamp",
-                    "symbol",
-                    "bid",
-                    "bid_size",
-                    "ask",
-                    "ask_size",
-                    "last",
-                    "last_size",
-                    "volume",
-                    "open",
-                    "high",
-                    "low",
-                    "close",
-                ]
-            )
-
-        # Append new records
-        for price in data:
-            csv_writer.writerow(
-                [
-                    price.timestamp,
-                    price.symbol,
-                    price.bid,
-                    price.bid_size,
-                    price.ask,
-                    price.ask_size,
-                    price.last,
-                    price.last_size,
-                    price.volume,
-                    price.open,
-                    price.high,
-                    price.low,
-                    price.close,
-                ]
-            )
+        new_data = encode_csv(data, header=not existing_data)
 
         # Upload back to GCS
-        blob.upload_from_string(
-            existing_data + csv_buffer.getvalue(), content_type="text/csv"
-        )
+        blob.upload_from_string(existing_data + new_data, content_type="text/csv")
+        self._record_upload(blob)
         print(f"Appended CSV data to GCS: gs://{self.bucket.name}/{self.filename}")
 
+    def _record_upload(self, blob):
+        """Report an uploaded object to the storage ledger."""
+        if self._ledger is not None:
+            self._ledger.record_upload(blob.name, blob.size)
+
     def _rotate_files(self):
         """Rotate files if they exceed the maximum file size."""
 
@@ -253,9 +232,12 @@ class GCSPersistence(PersistenceLayer):
                 # Copy the current file to the new filename
                 new_blob = self.bucket.blob(self.filename + "_0")
                 new_blob.upload_from_string(blob.download_as_string())
+                self._record_upload(new_blob)
 
                 # Remove the current file
                 blob.delete()
+                if self._ledger is not None:
+                    self._ledger.record_delete(blob.name)
 
             print(
                 f"Rotated GCS file: gs://{self.bucket.name}/{self.filename} -> gs://{self.bucket.name}/{new_filename}"
@@ -267,11 +249,22 @@ class GCSPersistence(PersistenceLayer):
         """
         Calculate the total size of all objects in the GCS bucket.
 
+        Answered from the storage ledger if one is configured, else by listing
+        the bucket.
+
         Returns:
             tuple: (size_bytes, size_human_readable)
         """
+        if self._ledger is not None:
+            self._ledger.maybe_reconcile()
+            return self._ledger.total_size()
         return get_bucket_size(self.bucket.name)
 
+    def close(self):
+        """Write pending storage ledger changes."""
+        if self._ledger is not None:
+            self._ledger.close()
+
     def _get_all_buckets_size():
         """
         Calculate the total size of all objects in all GCS buckets.
@@ -279,6 +272,9 @@ class GCSPersistence(PersistenceLayer):
         Returns:
             dict: {bucket_name: (size_bytes, size_human_readable)}
         """
+        from google.api_core.exceptions import GoogleAPIError
+        from google.cloud import storage
+
         try:
             # Initialize the GCS client
             storage_client = storage.Client()
@@ -0,0 +1,291 @@
+import math
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+    get_type_hints,
+)
+
+from definitions import BarData, QuoteData, TradeData
+from persistence.persistence import PersistenceLayer
+from persistence.record_batch import RecordBatch
+from persistence.schema import (
+    SYMBOL_COLUMN,
+    is_frame,
+    is_record_type,
+    normalize_frame,
+    record_columns,
+)
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Section that records of a flat type update. Snapshots update one section per
+# nested record ("latest_quote", "latest_trade", "minute_bar", ...).
+SECTION_NAMES = {
+    QuoteData: "latest_quote",
+    TradeData: "latest_trade",
+    BarData: "bar",
+}
+
+
+class _Section(NamedTuple):
+    name: str
+    keys: Tuple[str, ...]  # Field names within the section
+    indexes: Tuple[int, ...]  # Positions of the fields in the flat row
+
+
+def _section_name(record_type: type) -> str:
+    """Flat record type to section name, e.g. TickerRecord -> ticker_record."""
+    if record_type in SECTION_NAMES:
+        return SECTION_NAMES[record_type]
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", record_type.__name__).lower()
+
+
+@lru_cache(maxsize=None)
+def _sections(record_type: type) -> Tuple[int, Tuple[_Section, ...]]:
+    """
+    Split the flat columns of a record type into sections.
+
+    Returns:
+        Tuple[int, Tuple[_Section, ...]]: Position of the symbol column and the sections.
+    """
+    columns = record_columns(record_type)
+    nested = [
+        name
+        for name, annotation in get_type_hints(record_type).items()
+        if is_record_type(annotation)
+    ]
+    if not nested:
+        names = {_section_name(record_type): ""}
+    else:
+        names = {name: f"{name}_" for name in nested}
+
+    sections = []
+    for name, prefix in names.items():
+        fields = [
+            (column[len(prefix) :], i)
+            for i, column in enumerate(columns)
+            if column.startswith(prefix)
+        ]
+        sections.append(
+            _Section(
+                name=name,
+                keys=tuple(key for key, _ in fields),
+                indexes=tuple(i for _, i in fields),
+            )
+        )
+    return columns.index(SYMBOL_COLUMN), tuple(sections)
+
+
+def _json_value(value):
+    """NaN as None, so that states serialize to valid JSON."""
+    if value.__class__ is float and math.isnan(value):
+        return None
+    return value
+
+
+class LatestStateCache(PersistenceLayer):
+    """
+    In-memory latest state of every symbol, updated as batches arrive.
+
+    The state of a symbol is a dict of sections, each the latest record of
+    one kind as a flat dict: {"latest_quote": {...}, "latest_trade": {...},
+    "minute_bar": {...}}. Snapshots update all their sections, trades,
+    quotes and bars (records or DataFrames) the matching one, and option
+    chain rows the "latest_quote" of their contract. A section is only
+    replaced by a record with the same or a newer timestamp, and never by a
+    missing one (e.g. the minute bar of a snapshot before the open).
+
+    Lookups are plain dict reads. Writers replace the state of a symbol with
+    a new dict instead of changing it, so readers (e.g. the Flask endpoint
+    thread) never take the lock and never see a half updated state.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._states: Dict[str, Dict[str, dict]] = {}
+        self._updated_at: Dict[str, float] = {}  # Wall clock time of the last update
+        self._lock = threading.Lock()
+
+    def save_data(self, data: Union[List[tuple], RecordBatch, "pd.DataFrame"]):
+        """
+        Update the state of the symbols in a batch.
+
+        Args:
+            data (Union[List[tuple], RecordBatch, pd.DataFrame]): Records of a single NamedTuple type, a RecordBatch or a DataFrame.
+        """
+        if len(data) == 0:
+            return
+        if is_frame(data):
+            updates = self._frame_updates(data)
+        else:
+            if not isinstance(data, RecordBatch):
+                # Normalizes datetimes to epoch seconds and enums to their values
+                data = RecordBatch.from_records(data)
+            updates = self._batch_updates(data)
+
+        now = time.time()
+        with self._lock:
+            for symbol, sections in updates.items():
+                if not sections:
+                    continue
+                state = self._states.get(symbol)
+                if state is not None:
+                    sections = {
+                        name: row
+                        for name, row in sections.items()
+                        if not _is_older(row, state.get(name))
+                    }
+                    if not sections:
+                        continue
+                    sections = {**state, **sections}
+                self._states[symbol] = sections
+                self._updated_at[symbol] = now
+
+    @staticmethod
+    def _batch_updates(batch: RecordBatch) -> Dict[str, Dict[str, dict]]:
+        symbol_index, sections = _sections(batch.record_type)
+        updates: Dict[str, Dict[str, dict]] = {}
+        for row in batch.rows():
+            symbol_sections = updates.setdefault(row[symbol_index], {})
+            for section in sections:
+                record = {
+                    key: _json_value(row[i])
+                    for key, i in zip(section.keys, section.indexes)
+                }
+                if _is_missing(record):
+                    # E.g. no minute bar before the open
+                    continue
+                # Within a batch, the newest record of a symbol wins as well
+                if not _is_older(record, symbol_sections.get(section.name)):
+                    symbol_sections[section.name] = record
+        return updates
+
+    @staticmethod
+    def _frame_updates(df: "pd.DataFrame") -> Dict[str, Dict[str, dict]]:
+        """Trades, quotes, bars or option chain rows with a symbol column."""
+        import pandas as pd
+
+        df = normalize_frame(df)
+        if "price" in df.columns:
+            section = "latest_trade"
+        elif "bid_price" in df.columns:
+            section = "latest_quote"
+        elif "close" in df.columns:
+            section = "bar"
+        else:
+            raise ValueError("DataFrame has neither trade, quote nor bar columns")
+
+        converted = {}
+        for column in df.columns:
+            dtype = df[column].dtype
+            if pd.api.types.is_datetime64_any_dtype(dtype) and not hasattr(
+                dtype, "pyarrow_dtype"
+            ):
+                epoch = pd.Timestamp(0, tz=getattr(dtype, "tz", None))
+                converted[column] = (df[column] - epoch) / pd.Timedelta(seconds=1)
+            elif not pd.api.types.is_numeric_dtype(dtype) and not (
+                pd.api.types.is_bool_dtype(dtype)
+            ):
+                # Categories, dates (option expiries) and enums as plain values
+                converted[column] = df[column].astype(object).map(_plain_value)
+        if converted:
+            df = df.assign(**converted)
+
+        updates: Dict[str, Dict[str, dict]] = {}
+        for row in df.to_dict("records"):
+            record = {key: _json_value(value) for key, value in row.items()}
+            if _is_missing(record):
+                continue
+            sections = updates.setdefault(record[SYMBOL_COLUMN], {})
+            if not _is_older(record, sections.get(section)):
+                sections[section] = record
+        return updates
+
+    def get(self, symbol: str, section: Optional[str] = None) -> Optional[dict]:
+        """
+        Latest state of a symbol.
+
+        Args:
+            symbol (str): The symbol, e.g. "SPY" or an OCC option symbol.
+            section (Optional[str]): Only this section, e.g. "latest_quote".
+
+        Returns:
+            Optional[dict]: {section: record} (or the record of the section), None if unknown.
+        """
+        state = self._states.get(symbol)
+        if state is None or section is None:
+            return state
+        return state.get(section)
+
+    def get_many(
+        self,
+        symbols: Optional[Iterable[str]] = None,
+        sections: Optional[Iterable[str]] = None,
+    ) -> Dict[str, Dict[str, dict]]:
+        """
+        Latest state of several symbols.
+
+        Args:
+            symbols (Optional[Iterable[str]]): Symbols to return. All symbols if not given; unknown symbols are left out.
+            sections (Optional[Iterable[str]]): Sections to return. All sections if not given.
+
+        Returns:
+            Dict[str, Dict[str, dict]]: {symbol: {section: record}}.
+        """
+        states = self._states
+        if symbols is None:
+            symbols = list(states)
+        result = {}
+        for symbol in symbols:
+            state = states.get(symbol)
+            if state is None:
+                continue
+            if sections is not None:
+                state = {name: state[name] for name in sections if name in state}
+            result[symbol] = state
+        return result
+
+    def updated_at(self, symbol: str) -> Optional[float]:
+        """Wall clock time (epoch seconds) the state of a symbol last changed."""
+        return self._updated_at.get(symbol)
+
+    def symbols(self) -> List[str]:
+        return list(self._states)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._states
+
+
+def _plain_value(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return getattr(value, "value", value)
+
+
+def _is_missing(record: dict) -> bool:
+    """Whether all values of a record but its symbol are missing, so that it must not replace a section."""
+    return all(value is None for key, value in record.items() if key != SYMBOL_COLUMN)
+
+
+def _is_older(record: dict, current: Optional[dict]) -> bool:
+    """Whether record is older than the current record of its section."""
+    if current is None:
+        return False
+    timestamp, current_timestamp = record.get("timestamp"), current.get("timestamp")
+    if timestamp is None or current_timestamp is None:
+        return False
+    return timestamp < current_timestamp
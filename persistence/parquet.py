@@ -0,0 +1,387 @@
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import List, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute
+import pyarrow.parquet as pq
+import pytz
+
+from persistence.file_sources import GCSFileSource, LocalFileSource
+from persistence.persistence import MAX_FILE_SIZE_DEFAULT, PersistenceLayer
+from persistence.record_batch import RecordBatch
+from persistence.storage_ledger import StorageLedger
+from persistence.schema import (
+    SYMBOL_COLUMN,
+    is_record_type,
+    normalize_frame,
+    record_fields,
+    records_to_columns,
+    timestamp_column,
+)
+
+_ARROW_TYPES = {
+    float: pa.float64(),
+    int: pa.int64(),
+    str: pa.string(),
+    bool: pa.bool_(),
+    list: pa.list_(pa.string()),
+}
+
+
+def record_arrow_schema(record_type: type) -> pa.Schema:
+    """
+    Derive an Arrow schema from a record NamedTuple.
+
+    Nested records (bars and quotes of an AlpacaSnapshot) are flattened into
+    "<field>_<nested field>" columns.
+    """
+    return pa.schema(
+        [
+            pa.field(field.name, _ARROW_TYPES[field.type])
+            for field in record_fields(record_type)
+        ]
+    )
+
+
+def frame_arrow_schema(df: pd.DataFrame) -> pa.Schema:
+    """Derive an Arrow schema from a DataFrame's dtypes."""
+    return pa.Schema.from_pandas(normalize_frame(df), preserve_index=False)
+
+
+def to_arrow_table(
+    data: Union[List[tuple], RecordBatch, pd.DataFrame],
+    schema: Optional[pa.Schema] = None,
+) -> pa.Table:
+    """
+    Convert a batch of records or a DataFrame into an Arrow table.
+
+    Args:
+        data (Union[List[tuple], RecordBatch, pd.DataFrame]): Records of a single NamedTuple type, a RecordBatch or a DataFrame.
+        schema (Optional[pa.Schema]): Target schema. Derived from the data if not given.
+
+    Returns:
+        pa.Table: The flattened batch.
+    """
+    if isinstance(data, pd.DataFrame):
+        df = normalize_frame(data)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if schema is not None and not table.schema.equals(schema):
+            table = table.select(schema.names).cast(schema)
+        return table
+
+    if isinstance(data, RecordBatch):
+        return data.to_arrow(schema or record_arrow_schema(data.record_type))
+
+    record_type = type(data[0])
+    if schema is None:
+        schema = record_arrow_schema(record_type)
+    return pa.Table.from_pydict(records_to_columns(data, record_type), schema=schema)
+
+
+def schema_for(data: Union[List[tuple], RecordBatch, pd.DataFrame]) -> pa.Schema:
+    """Derive the Arrow schema of a batch of records or a DataFrame."""
+    if isinstance(data, pd.DataFrame):
+        return frame_arrow_schema(data)
+    if isinstance(data, RecordBatch):
+        return record_arrow_schema(data.record_type)
+    if is_record_type(data):
+        return record_arrow_schema(data)
+    return record_arrow_schema(type(data[0]))
+
+
+def dictionary_columns(schema: pa.Schema) -> List[str]:
+    """String columns (symbols, exchanges, tapes) that benefit from dictionary encoding."""
+    return [
+        field.name
+        for field in schema
+        if pa.types.is_string(field.type) or pa.types.is_large_string(field.type)
+    ]
+
+
+def _epoch(value) -> float:
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return float(value)
+
+
+def parquet_manifest_entry(path) -> dict:
+    """
+    Summarize a Parquet file for the manifest: row count, symbols and time range.
+
+    Only the symbol column is read; the time range comes from the row group
+    statistics.
+    """
+    parquet_file = pq.ParquetFile(path)
+    metadata = parquet_file.metadata
+    names = parquet_file.schema_arrow.names
+    entry = {"rows": metadata.num_rows}
+
+    if SYMBOL_COLUMN in names:
+        symbols = parquet_file.read(columns=[SYMBOL_COLUMN]).column(0)
+        entry["symbols"] = sorted(
+            s for s in pa.compute.unique(symbols).to_pylist() if s
+        )
+
+    ts_column = timestamp_column(names)
+    if ts_column is not None:
+        index = names.index(ts_column)
+        minimums, maximums = [], []
+        for i in range(metadata.num_row_groups):
+            statistics = metadata.row_group(i).column(index).statistics
+            if statistics is not None and statistics.has_min_max:
+                minimums.append(_epoch(statistics.min))
+                maximums.append(_epoch(statistics.max))
+        if minimums:
+            entry["min_timestamp"] = min(minimums)
+            entry["max_timestamp"] = max(maximums)
+    return entry
+
+
+class ParquetPersistence(PersistenceLayer):
+    """
+    Implements Parquet logging, locally or to Google Cloud Storage (GCS).
+
+    Rows are buffered in memory and written as row groups of `row_group_size`
+    rows, or as a smaller row group once the oldest buffered row is
+    `max_latency` seconds old. A Parquet file is only readable once its
+    footer is written, so files are finalized on rotation (size or day
+    change) and on close(). Rows go to the file of the day they were saved
+    on. When a bucket is given, files are staged locally and uploaded once
+    finalized.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        directory: Optional[str] = None,
+        bucket_name: Optional[str] = None,
+        gcs_prefix: str = "price_logs",
+        row_group_size: int = 64 * 1024,
+        max_latency: float = 5 * 60,
+        compression: str = "zstd",
+        compression_level: Optional[int] = None,
+        max_file_size: float = MAX_FILE_SIZE_DEFAULT,
+        file_per_day: bool = True,
+        tzinfo=pytz.timezone("US/Eastern"),
+        ledger: Optional[StorageLedger] = None,
+    ):
+        """
+        Initializes Parquet persistence layer.
+
+        Args:
+            filename (str): Base filename, e.g. "snapshots_logs".
+            directory (Optional[str]): Local directory for the files. Defaults to a temporary directory when a bucket is given, else the current directory.
+            bucket_name (Optional[str]): Name of the GCS bucket. Files are kept locally if not given.
+            gcs_prefix (str): Prefix path in GCS (folder-like structure).
+            row_group_size (int): Number of rows per Parquet row group.
+            max_latency (float): Seconds after which buffered rows are written to the file, even as a smaller row group.
+            compression (str): Parquet compression codec.
+            compression_level (Optional[int]): Codec compression level.
+            max_file_size (float): Size in bytes after which a new file is started.
+            file_per_day (bool): Start a new file every day.
+            tzinfo: Timezone used to determine the file date.
+            ledger (Optional[StorageLedger]): Storage ledger of the bucket, updated with every upload.
+        """
+        super().__init__(max_file_size)
+
+        if row_group_size <= 0:
+            raise ValueError("row_group_size must be positive")
+
+        self._base_filename = filename
+        self._row_group_size = row_group_size
+        self._max_latency = max_latency
+        self._compression = compression
+        self._compression_level = compression_level
+        self._file_per_day = file_per_day
+        self._tzinfo = tzinfo
+        self._ledger = ledger
+
+        self.gcs_prefix = gcs_prefix
+        self.bucket = None
+        if bucket_name is not None:
+            from google.cloud import storage
+
+            client = storage.Client()
+            self.bucket = client.bucket(bucket_name)
+
+        if directory is None:
+            directory = tempfile.mkdtemp() if self.bucket is not None else "."
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+        # Finalized files are listed in the manifest of the directory / prefix
+        self._files = (
+            GCSFileSource(bucket_name, gcs_prefix, client)
+            if self.bucket is not None
+            else LocalFileSource(directory)
+        )
+
+        self._schema: Optional[pa.Schema] = None
+        self._writer: Optional[pq.ParquetWriter] = None
+        self._pending: List[pa.Table] = []
+        self._pending_rows = 0
+        self._oldest = None  # Monotonic time the oldest buffered row was saved
+        self._file_date = None  # Date of the rows of the open file and the buffer
+        self.filename = None
+
+    def save_data(self, data: Union[List[tuple], RecordBatch, pd.DataFrame]):
+        """
+        Buffer a batch of records (or a DataFrame) and write full row groups.
+
+        Args:
+            data (Union[List[tuple], RecordBatch, pd.DataFrame]): Records of a single NamedTuple type, a RecordBatch or a DataFrame.
+        """
+        if len(data) == 0:
+            return
+
+        if self._schema is None:
+            self._schema = schema_for(data)
+
+        # Rows of the previous day go to its file, even before its first row group
+        today = self._current_date()
+        if self._file_per_day and self._file_date not in (None, today):
+            self._finalize()
+        if self._file_date is None:
+            self._file_date = today
+
+        table = to_arrow_table(data, self._schema)
+        self._pending.append(table)
+        self._pending_rows += table.num_rows
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+
+        if self._pending_rows >= self._row_group_size:
+            self._flush(full_row_groups_only=True)
+        elif time.monotonic() - self._oldest >= self._max_latency:
+            self._flush()
+
+    def _flush(self, full_row_groups_only: bool = False):
+        """Write buffered rows to the current file."""
+        if not self._pending:
+            return
+
+        table = pa.concat_tables(self._pending)
+        oldest = self._oldest
+        self._pending = []
+        self._pending_rows = 0
+        self._oldest = None
+
+        if full_row_groups_only:
+            full_rows = table.num_rows - table.num_rows % self._row_group_size
+            if full_rows < table.num_rows:
+                remainder = table.slice(full_rows)
+                self._pending = [remainder]
+                self._pending_rows = remainder.num_rows
+                self._oldest = oldest
+            table = table.slice(0, full_rows)
+            if table.num_rows == 0:
+                return
+
+        if self._writer is None:
+            self._open()
+        self._writer.write_table(table, row_group_size=self._row_group_size)
+
+    def _current_date(self):
+        return datetime.now(tz=self._tzinfo).date()
+
+    def _file_stem(self, date) -> str:
+        return self._base_filename + (
+            f"_{date.isoformat()}" if self._file_per_day else ""
+        )
+
+    def _next_part(self, stem: str) -> int:
+        """Find the next free part number for the given file stem."""
+        prefix = f"{stem}.parquet_"
+        if self.bucket is not None:
+            names = [
+                blob.name.rsplit("/", 1)[-1]
+                for blob in self.bucket.list_blobs(prefix=f"{self.gcs_prefix}/{prefix}")
+            ]
+        else:
+            names = os.listdir(self.directory)
+        parts = [
+            int(name[len(prefix) :])
+            for name in names
+            if name.startswith(prefix) and name[len(prefix) :].isdigit()
+        ]
+        return max(parts) + 1 if parts else 0
+
+    def _open(self):
+        """Open a new Parquet file for the date of the buffered rows."""
+        if self._file_date is None:
+            self._file_date = self._current_date()
+        stem = self._file_stem(self._file_date)
+        self.filename = f"{stem}.parquet_{self._next_part(stem)}"
+
+        self._writer = pq.ParquetWriter(
+            os.path.join(self.directory, self.filename),
+            self._schema,
+            compression=self._compression,
+            compression_level=self._compression_level,
+            use_dictionary=dictionary_columns(self._schema),
+        )
+
+    def _finalize(self):
+        """Flush buffered rows, write the file footer and upload the file to GCS."""
+        self._flush()
+        self._file_date = None
+        if self._writer is None:
+            return
+
+        self._writer.close()
+        self._writer = None
+
+        local_path = os.path.join(self.directory, self.filename)
+        manifest_entry = parquet_manifest_entry(local_path)
+        if self.bucket is not None:
+            blob = self.bucket.blob(f"{self.gcs_prefix}/{self.filename}")
+            blob.upload_from_filename(
+                local_path, content_type="application/vnd.apache.parquet"
+            )
+            os.remove(local_path)
+            if self._ledger is not None:
+                self._ledger.record_upload(blob.name, blob.size)
+            print(
+                f"{datetime.now().isoformat()}\tUploaded Parquet file to GCS: gs://{self.bucket.name}/{blob.name}"
+            )
+        else:
+            print(f"Saved Parquet file: {local_path}")
+
+        self._files.update_manifest({self.filename: manifest_entry})
+
+    def has_buffered_data(self) -> bool:
+        # Rows are only durable once their file is finalized (and uploaded)
+        return self._writer is not None or bool(self._pending)
+
+    def _rotate_files(self):
+        """
+        Finalize the current file if it exceeds the maximum file size or the day changed.
+
+        Also writes the buffered rows once the oldest of them reaches max_latency.
+        """
+        if self._file_per_day and self._file_date not in (None, self._current_date()):
+            self._finalize()
+            return
+
+        if (
+            self._oldest is not None
+            and time.monotonic() - self._oldest >= self._max_latency
+        ):
+            self._flush()
+
+        if self._writer is None:
+            return
+        if os.path.getsize(os.path.join(self.directory, self.filename)) >= (
+            self.max_file_size
+        ):
+            self._finalize()
+
+    def close(self):
+        """Write all buffered rows and finalize the current file."""
+        self._finalize()
+        if self._ledger is not None:
+            self._ledger.close()
@@ -1,10 +1,11 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Union
-
-import pandas as pd
+from typing import TYPE_CHECKING, List, Dict, Union
 
 from definitions import LoggerRecord
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 MAX_FILE_SIZE_DEFAULT = 25 * 1e6  # 25 * 1 MB
 
 
@@ -24,7 +25,15 @@ class PersistenceLayer(ABC):
         """Rotate files if they exceed the maximum file size."""
         pass
 
+    def close(self):
+        """Flush any buffered data and release resources."""
+        pass
+
+    def has_buffered_data(self) -> bool:
+        """Whether saved data is only buffered so far, and lost if the process stops."""
+        return False
+
     @abstractmethod
-    def save_data(self, data: Union[List[any], pd.DataFrame]):
+    def save_data(self, data: Union[List[any], "pd.DataFrame"]):
         """Save price data to a storage backend (CSV, AWS S3, GCP, etc.)."""
         pass
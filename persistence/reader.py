@@ -0,0 +1,254 @@
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterator, List, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from persistence.file_sources import FileSource, RecordedFile
+from persistence.schema import (
+    SYMBOL_COLUMN,
+    epoch_series,
+    normalize_frame,
+    timestamp_column,
+)
+
+_CSV_COMPRESSION = {None: None, "gz": "gzip", "zst": "zstd"}
+
+
+def _to_epoch(value: Union[datetime, date, float, None]) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return pd.Timestamp(value).timestamp()
+
+
+class RecordedDataReader:
+    """
+    Reads recorded data back across rotated and per-day files.
+
+    Files of one recording (e.g. all "snapshots_logs_<date>.json_<n>" objects)
+    are found by name in a FileSource. Files are pruned by the date in their
+    name and, where the sinks wrote one, by the manifest (symbols and time
+    range per file). Parquet files are read with column projection and row
+    group filters; JSON and CSV files are read whole and filtered. Nested JSON
+    snapshots are flattened into the same "<field>_<nested field>" columns the
+    other sinks write. Files are read in parallel.
+    """
+
+    def __init__(self, source: FileSource, base: str, max_workers: int = 8):
+        """
+        Args:
+            source (FileSource): Local directory or GCS prefix with the recorded files.
+            base (str): Base name of the recording, e.g. "snapshots_logs" or "trades".
+            max_workers (int): Number of files read in parallel.
+        """
+        self._source = source
+        self._base = base
+        self._max_workers = max_workers
+
+    def files(
+        self,
+        symbols: Optional[List[str]] = None,
+        start: Union[datetime, float, None] = None,
+        end: Union[datetime, float, None] = None,
+    ) -> List[RecordedFile]:
+        """Find the files that may contain rows for the symbols and time range."""
+        start, end = _to_epoch(start), _to_epoch(end)
+        manifest = self._source.read_manifest()
+
+        # File dates are local (exchange) dates; allow a day of slack for the time zone
+        first_date = (
+            (datetime.fromtimestamp(start, tz=timezone.utc) - timedelta(days=1))
+            .date()
+            .isoformat()
+            if start is not None
+            else None
+        )
+        last_date = (
+            (datetime.fromtimestamp(end, tz=timezone.utc) + timedelta(days=1))
+            .date()
+            .isoformat()
+            if end is not None
+            else None
+        )
+
+        selected = []
+        for recorded in self._source.recorded_files(self._base):
+            if recorded.date is not None:
+                if first_date is not None and recorded.date < first_date:
+                    continue
+                if last_date is not None and recorded.date > last_date:
+                    continue
+
+            entry = manifest.get(recorded.name)
+            if entry is not None:
+                if symbols is not None and "symbols" in entry:
+                    if not set(symbols) & set(entry["symbols"]):
+                        continue
+                if start is not None and entry.get("max_timestamp", start) < start:
+                    continue
+                if end is not None and entry.get("min_timestamp", end - 1) >= end:
+                    continue
+
+            selected.append(recorded)
+        return selected
+
+    def _read_parquet(self, recorded, symbols, start, end, columns) -> pd.DataFrame:
+        source = self._source.open(recorded.name)
+        if not isinstance(source, str):
+            # Downloaded once, read twice (schema and data)
+            buffer = pa.py_buffer(source.getvalue())
+            source = lambda: pa.BufferReader(buffer)
+        else:
+            source = lambda path=source: path
+        schema = pq.read_schema(source())
+        ts_column = timestamp_column(schema.names)
+
+        filters = []
+        if symbols is not None and SYMBOL_COLUMN in schema.names:
+            filters.append((SYMBOL_COLUMN, "in", list(symbols)))
+        if ts_column is not None:
+            ts_type = schema.field(ts_column).type
+            for op, value in ((">=", start), ("<", end)):
+                if value is None:
+                    continue
+                if pa.types.is_timestamp(ts_type):
+                    value = pd.Timestamp(value, unit="s", tz="UTC")
+                filters.append((ts_column, op, value))
+
+        read_columns = None
+        if columns is not None:
+            read_columns = [c for c in columns if c in schema.names]
+
+        table = pq.read_table(
+            source(),
+            columns=read_columns,
+            filters=filters or None,
+        )
+        return table.to_pandas()
+
+    def _read_text(self, recorded) -> pd.DataFrame:
+        if recorded.format == "json":
+            return pd.json_normalize(
+                json.loads(self._source.read_bytes(recorded.name)), sep="_"
+            )
+        return normalize_frame(
+            pd.read_csv(
+                self._source.open(recorded.name),
+                compression=_CSV_COMPRESSION[recorded.compression],
+            )
+        )
+
+    def read_file(
+        self,
+        recorded: RecordedFile,
+        symbols: Optional[List[str]] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        columns: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        """Read the matching rows of a single file (see iter_chunks for the arguments)."""
+        if recorded.format == "parquet":
+            return self._read_parquet(recorded, symbols, start, end, columns)
+
+        df = self._read_text(recorded)
+        mask = pd.Series(True, index=df.index)
+        if symbols is not None and SYMBOL_COLUMN in df.columns:
+            mask &= df[SYMBOL_COLUMN].isin(symbols)
+        ts_column = timestamp_column(list(df.columns))
+        if ts_column is not None and (start is not None or end is not None):
+            epoch = epoch_series(df[ts_column])
+            if start is not None:
+                mask &= epoch >= start
+            if end is not None:
+                mask &= epoch < end
+        df = df[mask]
+
+        if columns is not None:
+            df = df[[c for c in columns if c in df.columns]]
+        return df.reset_index(drop=True)
+
+    def iter_chunks(
+        self,
+        symbols: Optional[List[str]] = None,
+        start: Union[datetime, float, None] = None,
+        end: Union[datetime, float, None] = None,
+        columns: Optional[List[str]] = None,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Read the matching rows file by file.
+
+        Files are read in parallel and yielded in file order (by date and part).
+        At most max_workers files are read ahead of the consumer, so memory
+        stays bounded however long the range is.
+
+        Args:
+            symbols (Optional[List[str]]): Symbols to read. All symbols if not given.
+            start (Union[datetime, float, None]): Inclusive start time (datetime or epoch seconds).
+            end (Union[datetime, float, None]): Exclusive end time (datetime or epoch seconds).
+            columns (Optional[List[str]]): Columns to read. All columns if not given.
+
+        Yields:
+            pd.DataFrame: The matching rows of one file.
+        """
+        start, end = _to_epoch(start), _to_epoch(end)
+        files = self.files(symbols, start, end)
+        if not files:
+            return
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            pending = deque()
+            try:
+                for recorded in files:
+                    pending.append(
+                        executor.submit(
+                            self.read_file, recorded, symbols, start, end, columns
+                        )
+                    )
+                    if len(pending) < self._max_workers:
+                        continue
+                    df = pending.popleft().result()
+                    if len(df):
+                        yield df
+                while pending:
+                    df = pending.popleft().result()
+                    if len(df):
+                        yield df
+            finally:
+                # The consumer stopped early (or a read failed): drop the read-ahead
+                for future in pending:
+                    future.cancel()
+
+    def read(
+        self,
+        symbols: Optional[List[str]] = None,
+        start: Union[datetime, float, None] = None,
+        end: Union[datetime, float, None] = None,
+        columns: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        """
+        Read the matching rows of all files into a single DataFrame, ordered by time.
+
+        Args:
+            symbols (Optional[List[str]]): Symbols to read. All symbols if not given.
+            start (Union[datetime, float, None]): Inclusive start time (datetime or epoch seconds).
+            end (Union[datetime, float, None]): Exclusive end time (datetime or epoch seconds).
+            columns (Optional[List[str]]): Columns to read. All columns if not given.
+
+        Returns:
+            pd.DataFrame: The matching rows.
+        """
+        chunks = list(self.iter_chunks(symbols, start, end, columns))
+        if not chunks:
+            return pd.DataFrame(columns=columns)
+
+        df = pd.concat(chunks, ignore_index=True)
+        ts_column = timestamp_column(list(df.columns))
+        if ts_column is not None:
+            df = df.sort_values(ts_column, kind="stable", ignore_index=True)
+        return df
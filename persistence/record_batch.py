@@ -0,0 +1,387 @@
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Union, get_type_hints
+
+import numpy as np
+
+from persistence.schema import (
+    flatten_records,
+    is_record_type,
+    record_columns,
+    record_fields,
+)
+
+_NUMPY_TYPES = {
+    float: np.float64,
+    int: np.int64,
+    bool: np.bool_,
+}
+
+
+def _float_column(values: list) -> np.ndarray:
+    """Float column; None is stored as NaN and datetimes as epoch seconds."""
+    try:
+        return np.array(values, dtype=np.float64)
+    except TypeError:
+        return np.array(
+            [
+                (
+                    np.nan
+                    if value is None
+                    else value.timestamp() if isinstance(value, datetime) else value
+                )
+                for value in values
+            ],
+            dtype=np.float64,
+        )
+
+
+def _int_mask(values: list) -> Optional[np.ndarray]:
+    """Where a float field was given ints (e.g. sizes of raw JSON), None if nowhere."""
+    mask = np.fromiter(
+        (value.__class__ is int for value in values), dtype=np.bool_, count=len(values)
+    )
+    return mask if mask.any() else None
+
+
+def _exact_column(values: list, dtype) -> np.ndarray:
+    """Integer or boolean column; falls back to an object column if values are missing."""
+    try:
+        return np.array(values, dtype=dtype)
+    except (TypeError, ValueError):
+        return np.array(values, dtype=object)
+
+
+def _object_column(values: list) -> np.ndarray:
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def _intern(values: list):
+    """
+    Dictionary-encode a string column.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: int32 codes (-1 for None) and the distinct values.
+    """
+    table: Dict[str, int] = {}
+    codes = np.fromiter(
+        (
+            (
+                -1
+                if value is None
+                else table.setdefault(
+                    # String enums (e.g. Alpaca exchanges) are stored by value
+                    value if value.__class__ is str else getattr(value, "value", value),
+                    len(table),
+                )
+            )
+            for value in values
+        ),
+        dtype=np.int32,
+        count=len(values),
+    )
+    return codes, _object_column(list(table))
+
+
+class RecordBatch:
+    """
+    Struct-of-arrays batch of records of one NamedTuple type.
+
+    Every flattened field (e.g. "daily_bar_close") is a single NumPy column
+    instead of one Python object per record. String fields (symbols,
+    exchanges, tapes) are dictionary-encoded as int32 codes into a small
+    array of distinct values, and list fields (trade conditions) are kept as
+    object columns. Numeric columns are handed to pandas and Arrow without
+    copying.
+
+    Missing values are NaN in float columns, code -1 in string columns and
+    None in object columns; rows and records hold None for all of them, and a
+    nested record whose fields are all missing (e.g. no minute bar before the
+    open) is rebuilt as None. Float fields given as ints (sizes and volumes
+    of raw JSON) are stored as floats and given back as ints.
+
+    Sinks accept a RecordBatch wherever they accept a list of records.
+    """
+
+    def __init__(
+        self,
+        record_type: type,
+        columns: Dict[str, np.ndarray],
+        categories: Optional[Dict[str, np.ndarray]] = None,
+        int_values: Optional[Dict[str, np.ndarray]] = None,
+    ):
+        """
+        Args:
+            record_type (type): The record NamedTuple type, e.g. AlpacaSnapshot.
+            columns (Dict[str, np.ndarray]): Flattened column name to values (codes for string columns).
+            categories (Optional[Dict[str, np.ndarray]]): Distinct values of the string columns.
+            int_values (Optional[Dict[str, np.ndarray]]): Masks of the values of float columns that were given as ints.
+        """
+        self.record_type = record_type
+        self.columns = columns
+        self.categories = categories or {}
+        self.int_values = int_values or {}
+
+    @classmethod
+    def from_columns(
+        cls, record_type: type, values: Dict[str, Union[list, np.ndarray]]
+    ) -> "RecordBatch":
+        """
+        Build a batch from {flattened column name: values}.
+
+        Float fields may be given as datetimes, which are stored as epoch seconds.
+        """
+        columns, categories, int_values = {}, {}, {}
+        for field in record_fields(record_type):
+            field_values = values[field.name]
+            if isinstance(field_values, np.ndarray) and field.type is not str:
+                columns[field.name] = field_values
+            elif field.type is float:
+                columns[field.name] = _float_column(field_values)
+                mask = _int_mask(field_values)
+                if mask is not None:
+                    int_values[field.name] = mask
+            elif field.type in _NUMPY_TYPES:
+                columns[field.name] = _exact_column(
+                    field_values, _NUMPY_TYPES[field.type]
+                )
+            elif field.type is str:
+                columns[field.name], categories[field.name] = _intern(
+                    list(field_values)
+                )
+            else:
+                columns[field.name] = _object_column(list(field_values))
+        return cls(record_type, columns, categories, int_values)
+
+    @classmethod
+    def from_rows(cls, record_type: type, rows: Iterable[tuple]) -> "RecordBatch":
+        """
+        Build a batch from flat rows, in the flattened column order of the record type.
+
+        Float fields may be given as datetimes, which are stored as epoch seconds.
+        """
+        rows = list(rows)
+        names = record_columns(record_type)
+        values = list(zip(*rows)) if rows else [() for _ in names]
+        return cls.from_columns(
+            record_type,
+            {name: list(column) for name, column in zip(names, values)},
+        )
+
+    @classmethod
+    def from_records(
+        cls, records: List[tuple], record_type: Optional[type] = None
+    ) -> "RecordBatch":
+        """Build a batch from a list of records."""
+        if record_type is None:
+            record_type = type(records[0])
+        return cls.from_rows(record_type, flatten_records(records, record_type))
+
+    @classmethod
+    def concat(cls, batches: List["RecordBatch"]) -> "RecordBatch":
+        """Concatenate batches of the same record type, merging the string dictionaries."""
+        if len(batches) == 1:
+            return batches[0]
+
+        first = batches[0]
+        columns, categories, int_values = {}, {}, {}
+        for name in first.columns:
+            if name not in first.categories:
+                columns[name] = np.concatenate(
+                    [batch.columns[name] for batch in batches]
+                )
+                if any(name in batch.int_values for batch in batches):
+                    int_values[name] = np.concatenate(
+                        [
+                            batch.int_values.get(name, np.zeros(len(batch), np.bool_))
+                            for batch in batches
+                        ]
+                    )
+                continue
+
+            table: Dict[str, int] = {}
+            codes = []
+            for batch in batches:
+                # Map the codes of each batch into the merged dictionary
+                mapping = np.array(
+                    [
+                        table.setdefault(value, len(table))
+                        for value in batch.categories[name]
+                    ]
+                    + [-1],
+                    dtype=np.int32,
+                )
+                codes.append(mapping[batch.columns[name]])
+            columns[name] = np.concatenate(codes)
+            categories[name] = _object_column(list(table))
+        return cls(first.record_type, columns, categories, int_values)
+
+    def __len__(self) -> int:
+        if not self.columns:
+            return 0
+        return len(next(iter(self.columns.values())))
+
+    def __iter__(self) -> Iterator[tuple]:
+        return iter(self.to_records())
+
+    def __getitem__(self, index: int) -> tuple:
+        """One record, built from its row of every column."""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("RecordBatch index out of range")
+        row = slice(index, index + 1)
+        return self._build(
+            [tuple(self._values(name, row)[0] for name in self.column_names)]
+        )[0]
+
+    @property
+    def column_names(self) -> List[str]:
+        return record_columns(self.record_type)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the columns, not counting the Python objects of object columns."""
+        return sum(column.nbytes for column in self.columns.values()) + sum(
+            categories.nbytes for categories in self.categories.values()
+        )
+
+    def column(self, name: str) -> np.ndarray:
+        """Values of a column, decoding string columns."""
+        column = self.columns[name]
+        categories = self.categories.get(name)
+        if categories is None:
+            return column
+        # The appended None is what code -1 selects
+        return np.append(categories, None)[column]
+
+    def _values(self, name: str, rows: slice = slice(None)) -> list:
+        """Python values of (some rows of) a column, None where missing."""
+        column = self.columns[name][rows]
+        categories = self.categories.get(name)
+        if categories is not None:
+            # The appended None is what code -1 selects
+            return np.append(categories, None)[column].tolist()
+
+        values = column.tolist()
+        if column.dtype != np.float64:
+            return values
+        ints = self.int_values.get(name)
+        if ints is not None:
+            return [
+                None if value != value else int(value) if is_int else value
+                for value, is_int in zip(values, ints[rows].tolist())
+            ]
+        if np.isnan(column).any():
+            return [None if value != value else value for value in values]
+        return values
+
+    def rows(self) -> List[tuple]:
+        """Flat rows of Python values, in column order."""
+        names = self.column_names
+        return list(zip(*(self._values(name) for name in names)))
+
+    def _build(self, rows: List[tuple]) -> List[tuple]:
+        """(Nested) record NamedTuples of flat rows; nested records without any value are None."""
+        fields = record_fields(self.record_type)
+        values = dict(zip([field.name for field in fields], zip(*rows)))
+
+        def build(record_type: type, prefix: str) -> list:
+            arguments = []
+            for name, annotation in get_type_hints(record_type).items():
+                if not is_record_type(annotation):
+                    arguments.append(values[prefix + name])
+                    continue
+                nested_prefix = f"{prefix}{name}_"
+                nested = build(annotation, nested_prefix)
+                leaves = [
+                    values[nested_prefix + field.name]
+                    for field in record_fields(annotation)
+                ]
+                arguments.append(
+                    [
+                        (
+                            record
+                            if any(value is not None for value in leaf_values)
+                            else None
+                        )
+                        for record, leaf_values in zip(nested, zip(*leaves))
+                    ]
+                )
+            return [record_type(*record) for record in zip(*arguments)]
+
+        if not rows:
+            return []
+        return build(self.record_type, "")
+
+    def to_records(self) -> List[tuple]:
+        """Rebuild the (nested) record NamedTuples."""
+        return self._build(self.rows())
+
+    def to_pandas(self):
+        """
+        Flattened DataFrame of the batch.
+
+        Numeric columns are wrapped without copying and string columns become
+        categoricals sharing the codes of the batch.
+        """
+        import pandas as pd
+
+        data = {}
+        for name in self.column_names:
+            if name in self.categories:
+                data[name] = pd.Categorical.from_codes(
+                    self.columns[name], categories=pd.Index(self.categories[name])
+                )
+            else:
+                data[name] = self.columns[name]
+        return pd.DataFrame(data, copy=False)
+
+    def to_arrow(self, schema=None):
+        """
+        Flattened Arrow table of the batch.
+
+        Numeric columns are wrapped without copying. String columns are
+        dictionary arrays, or plain strings where the given schema asks for
+        them.
+        """
+        import pyarrow as pa
+
+        arrays = []
+        for name in self.column_names:
+            column = self.columns[name]
+            if name in self.categories:
+                array = pa.DictionaryArray.from_arrays(
+                    pa.array(column, mask=column < 0),
+                    pa.array(self.categories[name], type=pa.string()),
+                )
+            elif column.dtype == object:
+                array = pa.array(column.tolist())
+            elif column.dtype == np.float64:
+                # NaN marks missing values, as in the row-based path
+                array = pa.array(column, from_pandas=True)
+            else:
+                array = pa.array(column)
+
+            if schema is not None and not array.type.equals(schema.field(name).type):
+                array = array.cast(schema.field(name).type)
+            arrays.append(array)
+
+        if schema is not None:
+            return pa.Table.from_arrays(arrays, schema=schema)
+        return pa.Table.from_arrays(arrays, names=self.column_names)
+
+
+def record_type_of(data: Union[List[tuple], RecordBatch]) -> type:
+    """Record type of a batch or of a non-empty list of records."""
+    if isinstance(data, RecordBatch):
+        return data.record_type
+    return type(data[0])
+
+
+def flat_rows(data: Union[List[tuple], RecordBatch]) -> List[tuple]:
+    """Flat row tuples of a batch or of a list of records."""
+    if isinstance(data, RecordBatch):
+        return data.rows()
+    return flatten_records(data)
@@ -0,0 +1,200 @@
+import sys
+from functools import lru_cache
+from operator import attrgetter
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    List,
+    NamedTuple,
+    Tuple,
+    get_args,
+    get_origin,
+    get_type_hints,
+)
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Candidate columns that order records in time, in order of preference.
+# Flat records carry "timestamp", snapshots only carry nested timestamps and
+# option chain rows carry the quote "timestamp" and "insert_timestamp".
+TIMESTAMP_COLUMNS = (
+    "timestamp",
+    "latest_quote_timestamp",
+    "latest_trade_timestamp",
+    "insert_timestamp",
+)
+
+SYMBOL_COLUMN = "symbol"
+
+
+class RecordField(NamedTuple):
+    """A flattened (leaf) field of a record NamedTuple."""
+
+    name: str  # Flattened column name, e.g. "daily_bar_close"
+    path: Tuple[str, ...]  # Attribute path, e.g. ("daily_bar", "close")
+    type: type  # One of float, int, str, list
+
+
+def is_record_type(obj: Any) -> bool:
+    """Check whether obj is a NamedTuple class."""
+    return isinstance(obj, type) and issubclass(obj, tuple) and hasattr(obj, "_fields")
+
+
+def _leaf_type(annotation) -> type:
+    """Reduce a field annotation to one of float, int, str or list."""
+    origin = get_origin(annotation)
+    if origin in (list, List):
+        return list
+    if origin is not None:
+        # Optional[X] / Union[X, None]
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        if args:
+            return _leaf_type(args[0])
+    if annotation in (float, int, str, bool):
+        return annotation
+    return str
+
+
+@lru_cache(maxsize=None)
+def record_fields(record_type: type) -> Tuple[RecordField, ...]:
+    """
+    Flatten a record NamedTuple into its leaf fields.
+
+    Nested NamedTuples (e.g. the bars and quotes of an AlpacaSnapshot) are
+    expanded into "<field>_<nested field>" columns.
+
+    Args:
+        record_type (type): NamedTuple class, e.g. TickerRecord or AlpacaSnapshot.
+
+    Returns:
+        Tuple[RecordField, ...]: The flattened fields, in declaration order.
+    """
+    fields = []
+    for name, annotation in get_type_hints(record_type).items():
+        if is_record_type(annotation):
+            for nested in record_fields(annotation):
+                fields.append(
+                    RecordField(
+                        name=f"{name}_{nested.name}",
+                        path=(name,) + nested.path,
+                        type=nested.type,
+                    )
+                )
+        else:
+            fields.append(
+                RecordField(name=name, path=(name,), type=_leaf_type(annotation))
+            )
+    return tuple(fields)
+
+
+def record_columns(record_type: type) -> List[str]:
+    """Flattened column names of a record NamedTuple."""
+    return [field.name for field in record_fields(record_type)]
+
+
+@lru_cache(maxsize=None)
+def record_getter(record_type: type) -> Callable[[tuple], tuple]:
+    """
+    Build a function that returns the flattened values of a record as a tuple.
+
+    The getter is a single attrgetter over all dotted attribute paths, so a
+    record is flattened in one C-level call. Records with a missing (None)
+    nested record take a slower path that gives None for its fields.
+    """
+    fields = record_fields(record_type)
+    paths = [".".join(field.path) for field in fields]
+    if len(paths) == 1:
+        getter = attrgetter(paths[0])
+        fast = lambda record: (getter(record),)
+    else:
+        fast = attrgetter(*paths)
+
+    def value(record: tuple, path: Tuple[str, ...]):
+        for name in path:
+            if record is None:
+                return None
+            record = getattr(record, name)
+        return record
+
+    def get(record: tuple) -> tuple:
+        try:
+            return fast(record)
+        except AttributeError:
+            return tuple(value(record, field.path) for field in fields)
+
+    return get
+
+
+def flatten_records(records: List[tuple], record_type: type = None) -> List[tuple]:
+    """Flatten a list of records into a list of flat row tuples."""
+    if not records:
+        return []
+    getter = record_getter(record_type or type(records[0]))
+    return [getter(record) for record in records]
+
+
+def records_to_columns(records: List[tuple], record_type: type = None) -> dict:
+    """
+    Convert a list of records into a {column: list of values} mapping.
+
+    Args:
+        records (List[tuple]): Records of a single NamedTuple type.
+        record_type (type): The record type. Inferred from the first record if not given.
+
+    Returns:
+        dict: Flattened column name to list of values.
+    """
+    if record_type is None:
+        if not records:
+            return {}
+        record_type = type(records[0])
+    columns = record_columns(record_type)
+    if not records:
+        return {column: [] for column in columns}
+    values = zip(*flatten_records(records, record_type))
+    return {
+        column: list(column_values) for column, column_values in zip(columns, values)
+    }
+
+
+def is_frame(data: Any) -> bool:
+    """
+    Whether data is a DataFrame, without importing pandas.
+
+    Sinks use it to accept DataFrames without pulling pandas into entry
+    points that never produce one (e.g. the snapshot recorder).
+    """
+    pd = sys.modules.get("pandas")
+    return pd is not None and isinstance(data, pd.DataFrame)
+
+
+def normalize_frame(df: "pd.DataFrame") -> "pd.DataFrame":
+    """
+    Move named index levels into columns.
+
+    The Alpaca SDK returns trades and quotes indexed by (symbol, timestamp);
+    sinks store them as plain columns.
+    """
+    if any(name is not None for name in df.index.names):
+        return df.reset_index()
+    return df
+
+
+def epoch_series(series: "pd.Series") -> "pd.Series":
+    """Epoch seconds of a timestamp column stored as numbers, datetimes or ISO strings."""
+    import pandas as pd
+
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        return series.astype(float)
+    timestamps = pd.to_datetime(series, utc=True, format="mixed")
+    return (timestamps - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)
+
+
+def timestamp_column(columns: List[str]) -> str:
+    """Return the column that orders records in time, or None."""
+    for column in TIMESTAMP_COLUMNS:
+        if column in columns:
+            return column
+    return None
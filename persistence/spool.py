@@ -0,0 +1,476 @@
+import json
+import os
+import pickle
+import struct
+import threading
+import zlib
+from datetime import datetime
+from typing import List, Optional, Tuple, Union
+
+import pandas as pd
+
+from persistence.persistence import PersistenceLayer
+from persistence.record_batch import RecordBatch
+
+SEGMENT_SIZE_DEFAULT = 64 * 1e6  # 64 MB
+MAX_BATCH_RECORDS_DEFAULT = 50_000
+
+# Every spooled batch is framed as <payload length><crc32 of payload><payload>
+_FRAME_HEADER = struct.Struct("<II")
+_SEGMENT_SUFFIX = ".seg"
+_CORRUPT_SUFFIX = ".corrupt"
+_CURSOR_FILENAME = "cursor.json"
+
+
+def _segment_name(segment_id: int) -> str:
+    return f"{segment_id:020d}{_SEGMENT_SUFFIX}"
+
+
+def _batch_kind(batch):
+    """Batches are only merged with batches of the same kind."""
+    if isinstance(batch, pd.DataFrame):
+        return pd.DataFrame
+    if isinstance(batch, RecordBatch):
+        return batch.record_type
+    return list
+
+
+def _merge_batches(batches: list) -> Union[list, pd.DataFrame, RecordBatch]:
+    """Merge several spooled batches of the same kind into one."""
+    if isinstance(batches[0], pd.DataFrame):
+        return pd.concat(batches, ignore_index=True)
+    if isinstance(batches[0], RecordBatch):
+        return RecordBatch.concat(batches)
+    merged = []
+    for batch in batches:
+        merged.extend(batch)
+    return merged
+
+
+class WriteAheadSpool:
+    """
+    Durable, append-only local spool of record batches.
+
+    Batches are pickled into checksummed frames and appended to numbered
+    segment files. A cursor file records the position up to which batches
+    have been confirmed by the consumer; fully consumed segments are deleted.
+    A new segment is started on every open, so a torn write left by a crash
+    can only ever be at the tail of a segment that is no longer appended to.
+
+    Frames that fail their checksum, and the torn tails of older segments,
+    are skipped and copied to a `<segment>.corrupt` file next to the
+    segments, so that the lost data can be inspected; `corrupt_frames` and
+    `corrupt_bytes` count them.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_size: float = SEGMENT_SIZE_DEFAULT,
+        fsync: bool = True,
+    ):
+        """
+        Opens (or creates) a spool.
+
+        Args:
+            directory (str): Directory holding the segment files.
+            segment_size (float): Size in bytes after which a new segment is started.
+            fsync (bool): Whether to fsync every appended batch.
+        """
+        os.makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self._segment_size = segment_size
+        self._fsync = fsync
+        self._lock = threading.Lock()
+
+        segments = self._segments()
+        self._active_id = segments[-1] + 1 if segments else 0
+        self._active = open(self._path(_segment_name(self._active_id)), "ab")
+        self._cursor = self._load_cursor()
+
+        self.corrupt_frames = 0
+        self.corrupt_bytes = 0
+        # (segment, offset) of the data already quarantined, as batches are
+        # read again until they are committed
+        self._quarantined = set()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _segments(self) -> List[int]:
+        return sorted(
+            int(name[: -len(_SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(_SEGMENT_SUFFIX)
+        )
+
+    def _load_cursor(self) -> Tuple[int, int]:
+        try:
+            with open(self._path(_CURSOR_FILENAME), "r") as f:
+                cursor = json.load(f)
+            return cursor["segment"], cursor["offset"]
+        except FileNotFoundError:
+            segments = self._segments()
+            return (segments[0] if segments else 0), 0
+
+    def _quarantine(self, segment_id: int, offset: int, data: bytes, reason: str):
+        """Copy unreadable spool data to the segment's .corrupt file, once."""
+        if (segment_id, offset) in self._quarantined:
+            return
+        self._quarantined.add((segment_id, offset))
+        path = self._path(_segment_name(segment_id) + _CORRUPT_SUFFIX)
+        with open(path, "ab") as f:
+            f.write(data)
+        self.corrupt_frames += 1
+        self.corrupt_bytes += len(data)
+        print(
+            f"{reason} in spool segment {_segment_name(segment_id)} at offset {offset}: "
+            f"skipped {len(data)} bytes, copied to {path}"
+        )
+
+    @property
+    def cursor(self) -> Tuple[int, int]:
+        """Position up to which batches have been confirmed."""
+        return self._cursor
+
+    def append(self, batch: Union[list, pd.DataFrame]):
+        """
+        Durably append a batch to the spool.
+
+        Args:
+            batch (Union[list, pd.DataFrame]): A list of records or a DataFrame.
+        """
+        payload = pickle.dumps(batch, protocol=pickle.HIGHEST_PROTOCOL)
+        frame = _FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        with self._lock:
+            self._active.write(frame)
+            self._active.flush()
+            if self._fsync:
+                os.fsync(self._active.fileno())
+
+            if self._active.tell() >= self._segment_size:
+                self._active.close()
+                self._active_id += 1
+                self._active = open(self._path(_segment_name(self._active_id)), "ab")
+
+    def read_batches(
+        self,
+        max_records: int = MAX_BATCH_RECORDS_DEFAULT,
+        start: Optional[Tuple[int, int]] = None,
+    ) -> Tuple[list, Tuple[int, int]]:
+        """
+        Read unconfirmed batches, starting at the cursor.
+
+        Reading stops after max_records records, at the end of the written data,
+        or when the kind of batch changes (records vs. DataFrames) so that the
+        returned batches can be merged.
+
+        Args:
+            max_records (int): Soft limit on the number of records returned.
+            start (Optional[Tuple[int, int]]): Position to read from, at or after the cursor. The cursor if None.
+
+        Returns:
+            Tuple[list, Tuple[int, int]]: The batches and the cursor to commit once they are confirmed.
+        """
+        batches = []
+        records = 0
+        start_id, offset = start if start is not None else self._cursor
+
+        with self._lock:
+            active_id = self._active_id
+        segments = [s for s in self._segments() if s >= start_id]
+
+        for segment_id in segments:
+            if segment_id != start_id:
+                offset = 0
+            with open(self._path(_segment_name(segment_id)), "rb") as f:
+                f.seek(offset)
+                while records < max_records:
+                    header = f.read(_FRAME_HEADER.size)
+                    if len(header) < _FRAME_HEADER.size:
+                        break
+                    length, checksum = _FRAME_HEADER.unpack(header)
+                    payload = f.read(length)
+                    if len(payload) < length:
+                        break
+                    if zlib.crc32(payload) != checksum:
+                        # The length was readable: skip the frame and carry on after it
+                        self._quarantine(
+                            segment_id, offset, header + payload, "Corrupt frame"
+                        )
+                        offset = f.tell()
+                        continue
+
+                    batch = pickle.loads(payload)
+                    if batches and _batch_kind(batch) != _batch_kind(batches[0]):
+                        return batches, (segment_id, offset)
+
+                    batches.append(batch)
+                    records += len(batch)
+                    offset = f.tell()
+
+                if records < max_records and segment_id != active_id:
+                    # Torn tail of a segment no longer appended to
+                    f.seek(offset)
+                    tail = f.read()
+                    if tail:
+                        self._quarantine(segment_id, offset, tail, "Torn tail")
+
+            if records >= max_records or segment_id == active_id:
+                return batches, (segment_id, offset)
+
+            # Segment fully read; continue with the next one
+            offset = 0
+            segment_id += 1
+
+        return batches, (segment_id, offset)
+
+    def commit(self, cursor: Tuple[int, int]):
+        """
+        Confirm all batches before the cursor and delete consumed segments.
+
+        Args:
+            cursor (Tuple[int, int]): The cursor returned by read_batches.
+        """
+        tmp_path = self._path(_CURSOR_FILENAME + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"segment": cursor[0], "offset": cursor[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path(_CURSOR_FILENAME))
+        self._cursor = cursor
+
+        for segment_id in self._segments():
+            if segment_id >= cursor[0]:
+                break
+            os.remove(self._path(_segment_name(segment_id)))
+
+    def pending_bytes(self) -> int:
+        """Approximate number of spooled bytes not yet confirmed."""
+        total = 0
+        for segment_id in self._segments():
+            if segment_id >= self._cursor[0]:
+                total += os.path.getsize(self._path(_segment_name(segment_id)))
+        return total - self._cursor[1]
+
+    def close(self):
+        with self._lock:
+            self._active.close()
+
+
+class SpoolReplayer(threading.Thread):
+    """
+    Background thread draining a spool into a persistence layer.
+
+    Batches are only committed once the sink holds none of them in a buffer
+    (see PersistenceLayer.has_buffered_data), e.g. once a buffering sink
+    loaded or uploaded them. Until then the replayer reads on from the
+    position it replayed up to, and a restart replays them again.
+    """
+
+    def __init__(
+        self,
+        spool: WriteAheadSpool,
+        sink: PersistenceLayer,
+        max_batch_records: int = MAX_BATCH_RECORDS_DEFAULT,
+        poll_interval: float = 1.0,
+        max_backoff: float = 60.0,
+    ):
+        """
+        Args:
+            spool (WriteAheadSpool): The spool to drain.
+            sink (PersistenceLayer): The (remote) persistence layer to write to.
+            max_batch_records (int): Maximum number of records merged into one sink write.
+            poll_interval (float): Seconds to wait when the spool is empty.
+            max_backoff (float): Maximum seconds to wait between retries of a failed write.
+        """
+        super().__init__(daemon=True)
+
+        self._spool = spool
+        self._sink = sink
+        self._max_batch_records = max_batch_records
+        self._poll_interval = poll_interval
+        self._max_backoff = max_backoff
+
+        self._replayed = (
+            spool.cursor
+        )  # Position up to which batches were saved to the sink
+        self._drained = False
+
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._abort = threading.Event()
+
+    def notify(self):
+        """Wake the replayer up after new batches were spooled."""
+        self._wakeup.set()
+
+    def confirm(self):
+        """Commit the replayed batches, unless the sink still buffers some of them."""
+        if self._replayed != self._spool.cursor and not self._sink.has_buffered_data():
+            self._spool.commit(self._replayed)
+
+    def _replay_once(self) -> bool:
+        """Write one merged batch to the sink. Returns False if the spool is empty."""
+        batches, cursor = self._spool.read_batches(
+            self._max_batch_records, start=self._replayed
+        )
+        if not batches:
+            # Skip over empty or torn segments
+            self._replayed = cursor
+            if self._sink.has_buffered_data():
+                # Lets buffering sinks write out rows that reached their maximum latency
+                self._sink._rotate_files()
+            self.confirm()
+            return False
+
+        merged = _merge_batches(batches)
+        self._sink.save_data(merged)
+        self._replayed = cursor
+        self._sink._rotate_files()
+        self.confirm()
+        print(
+            f"{datetime.now().isoformat()}\tReplayed {len(merged)} spooled records to {type(self._sink).__name__}"
+        )
+        return True
+
+    def run(self):
+        backoff = self._poll_interval
+        while not self._abort.is_set():
+            try:
+                if self._replay_once():
+                    backoff = self._poll_interval
+                    continue
+                if self._stopping.is_set():
+                    self._drained = True
+                    break
+                self._wakeup.wait(self._poll_interval)
+                self._wakeup.clear()
+            except Exception as e:
+                print(f"Failed to replay spooled records, retrying in {backoff}s: {e}")
+                self._abort.wait(backoff)
+                backoff = min(backoff * 2, self._max_backoff)
+
+    def stop(self, timeout: Optional[float] = None) -> bool:
+        """
+        Drain the spool into the sink and stop the thread.
+
+        Failed writes keep being retried until the timeout expires. Batches
+        the sink still buffers are committed by confirm() after closing it.
+
+        Args:
+            timeout (Optional[float]): Maximum seconds to wait for the spool to drain.
+
+        Returns:
+            bool: Whether every spooled batch was saved to the sink.
+        """
+        self._stopping.set()
+        self._wakeup.set()
+        self.join(timeout)
+        self._abort.set()
+        self.join()
+        return self._drained
+
+
+class SpooledPersistence(PersistenceLayer):
+    """
+    Writes through a local write-ahead spool to a remote persistence layer.
+
+    save_data only appends to the local spool, so recorders keep polling at
+    full rate while the remote sink is slow or unreachable. A background
+    replayer drains the spool to the sink in large merged batches and only
+    advances past a batch once the sink stored it durably, not merely
+    buffered it. Batches that are still spooled when the process stops are
+    replayed on the next start.
+
+    close() drains the spool and stops the replayer. Saving again reopens
+    them, so recorders that close their persistence layers after every
+    run_once keep their undelivered batches for the next tick.
+    """
+
+    def __init__(
+        self,
+        sink: PersistenceLayer,
+        spool_dir: str,
+        segment_size: float = SEGMENT_SIZE_DEFAULT,
+        fsync: bool = True,
+        max_batch_records: int = MAX_BATCH_RECORDS_DEFAULT,
+        poll_interval: float = 1.0,
+        drain_timeout: Optional[float] = 30.0,
+    ):
+        """
+        Initializes the spooled persistence layer and starts the replayer.
+
+        Args:
+            sink (PersistenceLayer): The remote persistence layer (GCS, BigQuery, ...).
+            spool_dir (str): Local directory of the spool.
+            segment_size (float): Size in bytes after which a new spool segment is started.
+            fsync (bool): Whether to fsync every spooled batch.
+            max_batch_records (int): Maximum number of records merged into one sink write.
+            poll_interval (float): Seconds between replay attempts when idle.
+            drain_timeout (Optional[float]): Seconds close() waits for the spool to drain.
+        """
+        super().__init__(sink.max_file_size)
+
+        self._sink = sink
+        if hasattr(sink, "raise_errors"):
+            # Sinks that log failed writes by default must report them for retries
+            sink.raise_errors = True
+        self._spool_dir = spool_dir
+        self._segment_size = segment_size
+        self._fsync = fsync
+        self._max_batch_records = max_batch_records
+        self._poll_interval = poll_interval
+        self._drain_timeout = drain_timeout
+
+        self._spool: Optional[WriteAheadSpool] = None
+        self._replayer: Optional[SpoolReplayer] = None
+        self._open()
+
+    def _open(self):
+        """Open the spool and start replaying it, including the batches left by a previous run."""
+        self._spool = WriteAheadSpool(
+            self._spool_dir, segment_size=self._segment_size, fsync=self._fsync
+        )
+        self._replayer = SpoolReplayer(
+            self._spool,
+            self._sink,
+            max_batch_records=self._max_batch_records,
+            poll_interval=self._poll_interval,
+        )
+        self._replayer.start()
+
+    def save_data(self, data: Union[List[tuple], RecordBatch, pd.DataFrame]):
+        """
+        Append the batch to the local spool.
+
+        Args:
+            data (Union[List[tuple], RecordBatch, pd.DataFrame]): The batch to persist.
+        """
+        if len(data) == 0:
+            return
+        if self._spool is None:
+            self._open()
+        self._spool.append(data)
+        self._replayer.notify()
+
+    def _rotate_files(self):
+        """The sink's files are rotated by the replayer after each confirmed batch."""
+        pass
+
+    def close(self):
+        """Drain the spool into the sink (up to drain_timeout), close the sink and commit what it stored."""
+        if self._spool is None:
+            return
+        drained = self._replayer.stop(self._drain_timeout)
+        self._sink.close()
+        self._replayer.confirm()
+        if not drained or self._spool.pending_bytes() > 0:
+            print(
+                f"Spool {self._spool.directory} not fully drained, remaining batches will be replayed on the next start"
+            )
+        self._spool.close()
+        self._spool = None
+        self._replayer = None
@@ -0,0 +1,225 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from persistence.file_sources import parse_filename
+
+SAVE_INTERVAL_DEFAULT = 60  # Seconds
+RECONCILE_INTERVAL_DEFAULT = 24 * 60 * 60  # Seconds
+
+
+def format_size(size_bytes: float) -> str:
+    """Convert a size in bytes to a human-readable string, e.g. "1.50 GB"."""
+    units = ["B", "KB", "MB", "GB", "TB", "PB"]
+    size = float(size_bytes)
+    unit_index = 0
+
+    while size >= 1024 and unit_index < len(units) - 1:
+        size /= 1024
+        unit_index += 1
+
+    return f"{size:.2f} {units[unit_index]}"
+
+
+def _object_day(name: str, default: str) -> str:
+    """The day an object belongs to: the date in its file name, else the given default."""
+    recorded = parse_filename(name.rsplit("/", 1)[-1])
+    if recorded is not None and recorded.date is not None:
+        return recorded.date
+    return default
+
+
+class StorageLedger:
+    """
+    Incrementally maintained sizes of the objects in a GCS bucket.
+
+    The sinks report their own uploads, rotations and deletions, so size
+    queries are answered from the ledger without listing the bucket. The
+    ledger is kept in a small JSON document (a local file, or an object in the
+    bucket itself) and is reconciled with a full listing of the bucket every
+    `reconcile_interval` seconds to pick up changes made by anyone else.
+    """
+
+    def __init__(
+        self,
+        bucket_name: str,
+        path: Optional[str] = None,
+        blob_name: Optional[str] = "_storage_ledger.json",
+        client=None,
+        save_interval: float = SAVE_INTERVAL_DEFAULT,
+        reconcile_interval: Optional[float] = RECONCILE_INTERVAL_DEFAULT,
+    ):
+        """
+        Loads (or creates) the ledger of a bucket.
+
+        Args:
+            bucket_name (str): Name of the GCS bucket.
+            path (Optional[str]): Local file for the ledger. Takes precedence over blob_name.
+            blob_name (Optional[str]): Object in the bucket holding the ledger, if no path is given.
+            client: A google.cloud.storage.Client. Created if not given.
+            save_interval (float): Minimum seconds between ledger writes.
+            reconcile_interval (Optional[float]): Seconds between full listings. None to never reconcile automatically.
+        """
+        if client is None:
+            from google.cloud import storage
+
+            client = storage.Client()
+
+        self.bucket = client.bucket(bucket_name)
+        self._path = path
+        self._blob_name = None if path is not None else blob_name
+        self._save_interval = save_interval
+        self._reconcile_interval = reconcile_interval
+
+        self._lock = threading.Lock()
+        self._objects: Dict[str, dict] = {}
+        self._reconciled_at: Optional[float] = None
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._load()
+
+    def _load(self):
+        try:
+            if self._path is not None:
+                with open(self._path, "r") as f:
+                    state = json.load(f)
+            else:
+                from google.api_core.exceptions import NotFound
+
+                try:
+                    state = json.loads(
+                        self.bucket.blob(self._blob_name).download_as_text()
+                    )
+                except NotFound:
+                    raise FileNotFoundError(self._blob_name)
+        except FileNotFoundError:
+            return
+        self._objects = state["objects"]
+        self._reconciled_at = state.get("reconciled_at")
+
+    def save(self):
+        """Write the ledger."""
+        with self._lock:
+            state = json.dumps(
+                {"objects": self._objects, "reconciled_at": self._reconciled_at}
+            )
+            self._dirty = False
+            self._saved_at = time.monotonic()
+
+        if self._path is not None:
+            tmp_path = self._path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.write(state)
+            os.replace(tmp_path, self._path)
+        else:
+            self.bucket.blob(self._blob_name).upload_from_string(
+                state, content_type="application/json"
+            )
+
+    def _maybe_save(self):
+        if self._dirty and time.monotonic() - self._saved_at >= self._save_interval:
+            self.save()
+
+    def record_upload(self, name: str, size: int):
+        """Record that an object was created or overwritten with the given size."""
+        today = datetime.now(tz=timezone.utc).date().isoformat()
+        with self._lock:
+            previous = self._objects.get(name)
+            self._objects[name] = {
+                "size": int(size),
+                "day": previous["day"] if previous else _object_day(name, today),
+            }
+            self._dirty = True
+        self._maybe_save()
+
+    def record_delete(self, name: str):
+        """Record that an object was deleted."""
+        with self._lock:
+            if self._objects.pop(name, None) is not None:
+                self._dirty = True
+        self._maybe_save()
+
+    def reconcile(self):
+        """Replace the ledger with a full listing of the bucket."""
+        objects = {}
+        for blob in self.bucket.list_blobs():
+            if blob.name == self._blob_name:
+                continue
+            objects[blob.name] = {
+                "size": blob.size,
+                "day": _object_day(blob.name, blob.time_created.date().isoformat()),
+            }
+
+        with self._lock:
+            self._objects = objects
+            self._reconciled_at = time.time()
+            self._dirty = True
+        self.save()
+        print(
+            f"Reconciled storage ledger of gs://{self.bucket.name}: {len(objects)} objects, {format_size(self.total_size()[0])}"
+        )
+
+    def maybe_reconcile(self):
+        """Reconcile if the last full listing is older than reconcile_interval."""
+        if self._reconcile_interval is None:
+            return
+        if (
+            self._reconciled_at is None
+            or time.time() - self._reconciled_at >= self._reconcile_interval
+        ):
+            self.reconcile()
+
+    def total_size(self) -> Tuple[int, str]:
+        """
+        Total size of all objects in the bucket.
+
+        Returns:
+            tuple: (size_bytes, size_human_readable)
+        """
+        with self._lock:
+            total = sum(entry["size"] for entry in self._objects.values())
+        return total, format_size(total)
+
+    def size_by_prefix(self, depth: int = 1, prefix: str = "") -> Dict[str, int]:
+        """
+        Total size per prefix.
+
+        Args:
+            depth (int): Number of path components of the prefixes, e.g. 2 for "stocks/intraday_data".
+            prefix (str): Only count objects under this prefix.
+
+        Returns:
+            Dict[str, int]: {prefix: size_bytes}
+        """
+        sizes = defaultdict(int)
+        with self._lock:
+            for name, entry in self._objects.items():
+                if name.startswith(prefix):
+                    sizes["/".join(name.split("/")[:depth])] += entry["size"]
+        return dict(sizes)
+
+    def size_by_day(self, prefix: str = "") -> Dict[str, int]:
+        """
+        Total size per day (the date in the file name, else the upload date).
+
+        Args:
+            prefix (str): Only count objects under this prefix.
+
+        Returns:
+            Dict[str, int]: {ISO date: size_bytes}
+        """
+        sizes = defaultdict(int)
+        with self._lock:
+            for name, entry in self._objects.items():
+                if name.startswith(prefix):
+                    sizes[entry["day"]] += entry["size"]
+        return dict(sorted(sizes.items()))
+
+    def close(self):
+        """Write pending changes."""
+        if self._dirty:
+            self.save()
@@ -0,0 +1,317 @@
+import json
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Union
+
+import pandas as pd
+
+from persistence.persistence import PersistenceLayer
+from persistence.record_batch import RecordBatch, flat_rows, record_type_of
+from persistence.schema import (
+    SYMBOL_COLUMN,
+    normalize_frame,
+    record_fields,
+    timestamp_column,
+)
+
+_SQLITE_TYPES = {
+    float: "REAL",
+    int: "INTEGER",
+    str: "TEXT",
+    bool: "INTEGER",
+    list: "TEXT",
+}
+
+# Table of a DataFrame batch, by a column only that kind of frame has, in order
+_FRAME_TABLES = (
+    ("implied_volatility", "option_chain"),
+    ("price", "trades"),
+    ("bid_price", "quotes"),
+    ("close", "bars"),
+)
+
+
+def _frame_table_name(columns: List[str], default: str) -> str:
+    """Table of a DataFrame batch, e.g. "trades" for trades downloaded as a DataFrame."""
+    return next(
+        (table for column, table in _FRAME_TABLES if column in columns), default
+    )
+
+
+def _table_name(name: str) -> str:
+    """CamelCase record type name to snake_case table name, e.g. AlpacaSnapshot -> alpaca_snapshot."""
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", name).lower()
+
+
+def _to_epoch(value: Union[datetime, pd.Timestamp, float, None]) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return pd.Timestamp(value).timestamp()
+
+
+def _sqlite_value(value):
+    """A filter value as it is stored, e.g. dates as ISO strings."""
+    if isinstance(value, bool):
+        return int(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def _sqlite_column(series: pd.Series):
+    """
+    Convert a DataFrame column to SQLite values.
+
+    Returns:
+        Tuple[pd.Series, str]: The converted column and its SQLite type.
+    """
+    dtype = series.dtype
+    if hasattr(dtype, "pyarrow_dtype"):
+        import pyarrow as pa
+
+        if pa.types.is_date(dtype.pyarrow_dtype):
+            # Arrow dates (e.g. parsed option expiries) as ISO strings as well
+            return series.astype(object).map(_sqlite_value), "TEXT"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        epoch = pd.Timestamp(0, tz=getattr(dtype, "tz", None))
+        return (series - epoch) / pd.Timedelta(seconds=1), "REAL"
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return series, "INTEGER"
+    if pd.api.types.is_numeric_dtype(dtype):
+        return series, "REAL"
+
+    # Lists (e.g. trade conditions) as JSON, dates (e.g. option expiries) as ISO strings
+    def convert(value):
+        if isinstance(value, list):
+            return json.dumps(value)
+        if hasattr(value, "isoformat"):
+            return value.isoformat()
+        return value
+
+    return series.astype(object).map(convert), "TEXT"
+
+
+class SQLiteTickStore(PersistenceLayer):
+    """
+    Local, indexed tick store on SQLite.
+
+    Every record type gets its own table (e.g. AlpacaSnapshot -> alpaca_snapshot),
+    and so does every kind of DataFrame: option chains, trades, quotes and
+    bars go to the option_chain, trades, quotes and bars tables, any other
+    DataFrame to the table given at construction. Every table has an index on
+    (symbol, timestamp). Timestamps are stored as float epoch seconds, so time
+    range scans are index range scans. Each batch is inserted in a single
+    transaction; the connection is shared by the recorder and readers on
+    other threads, behind a lock.
+    """
+
+    def __init__(
+        self,
+        path: str = "ticks.sqlite",
+        frame_table: str = "frames",
+        extra_indexes: Optional[Dict[str, List[str]]] = None,
+    ):
+        """
+        Opens (or creates) the tick store.
+
+        Args:
+            path (str): Path of the SQLite database file.
+            frame_table (str): Table that DataFrame batches of no known kind are stored in.
+            extra_indexes (Optional[Dict[str, List[str]]]): Additional indexes per table, e.g. {"option_chain": ["underlying", "expiry", "strike_mills"]}.
+        """
+        super().__init__()
+
+        # Shared with reader threads (e.g. a Flask endpoint), every use holds the lock
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        # Write-ahead logging lets readers query while the recorder inserts
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+
+        self._frame_table = frame_table
+        self._extra_indexes = extra_indexes or {}
+        self._tables: Dict[str, List[str]] = self._existing_tables()
+
+    def _existing_tables(self) -> Dict[str, List[str]]:
+        tables = {}
+        for (name,) in self._connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        ):
+            tables[name] = [
+                row[1]
+                for row in self._connection.execute(f'PRAGMA table_info("{name}")')
+            ]
+        return tables
+
+    def _ensure_table(self, table: str, columns: Dict[str, str]):
+        """Create the table and its indexes, or add columns it is missing."""
+        with self._connection:
+            if table not in self._tables:
+                definition = ", ".join(
+                    f'"{column}" {column_type}'
+                    for column, column_type in columns.items()
+                )
+                self._connection.execute(f'CREATE TABLE "{table}" ({definition})')
+                self._tables[table] = list(columns)
+
+                ts_column = timestamp_column(list(columns))
+                index_columns = [
+                    column for column in (SYMBOL_COLUMN, ts_column) if column in columns
+                ]
+                if index_columns:
+                    self._create_index(table, index_columns)
+            else:
+                for column, column_type in columns.items():
+                    if column not in self._tables[table]:
+                        self._connection.execute(
+                            f'ALTER TABLE "{table}" ADD COLUMN "{column}" {column_type}'
+                        )
+                        self._tables[table].append(column)
+
+            index_columns = self._extra_indexes.get(table)
+            if index_columns and all(c in self._tables[table] for c in index_columns):
+                self._create_index(table, index_columns)
+
+    def _create_index(self, table: str, columns: List[str]):
+        name = f"{table}_{'_'.join(columns)}_idx"
+        quoted = ", ".join(f'"{column}"' for column in columns)
+        self._connection.execute(
+            f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({quoted})'
+        )
+
+    def _insert(self, table: str, columns: List[str], rows: list):
+        placeholders = ", ".join("?" for _ in columns)
+        quoted = ", ".join(f'"{column}"' for column in columns)
+        with self._connection:
+            self._connection.executemany(
+                f'INSERT INTO "{table}" ({quoted}) VALUES ({placeholders})', rows
+            )
+
+    def save_data(self, data: Union[List[tuple], RecordBatch, pd.DataFrame]):
+        """
+        Insert a batch of records (or a DataFrame) in a single transaction.
+
+        Args:
+            data (Union[List[tuple], RecordBatch, pd.DataFrame]): Records of a single NamedTuple type, a RecordBatch or a DataFrame.
+        """
+        if len(data) == 0:
+            return
+
+        with self._lock:
+            if isinstance(data, pd.DataFrame):
+                self._save_frame(data)
+            else:
+                self._save_records(data)
+
+    def _save_records(self, data: Union[List[tuple], RecordBatch]):
+        record_type = record_type_of(data)
+        fields = record_fields(record_type)
+        table = _table_name(record_type.__name__)
+        self._ensure_table(
+            table, {field.name: _SQLITE_TYPES[field.type] for field in fields}
+        )
+
+        rows = flat_rows(data)
+        list_columns = [i for i, field in enumerate(fields) if field.type is list]
+        if list_columns:
+            rows = [list(row) for row in rows]
+            for row in rows:
+                for i in list_columns:
+                    if row[i] is not None:
+                        row[i] = json.dumps(row[i])
+
+        self._insert(table, [field.name for field in fields], rows)
+
+    def _save_frame(self, df: pd.DataFrame):
+        df = normalize_frame(df)
+        columns = {}
+        converted = {}
+        for column in df.columns:
+            converted[str(column)], columns[str(column)] = _sqlite_column(df[column])
+
+        df = pd.DataFrame(converted).astype(object)
+        df = df.where(df.notna(), None)
+
+        table = _frame_table_name(list(columns), self._frame_table)
+        self._ensure_table(table, columns)
+        self._insert(
+            table,
+            list(columns),
+            list(df.itertuples(index=False, name=None)),
+        )
+
+    def query(
+        self,
+        table: Union[str, type],
+        symbols: Optional[List[str]] = None,
+        start: Union[datetime, float, None] = None,
+        end: Union[datetime, float, None] = None,
+        columns: Optional[List[str]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> pd.DataFrame:
+        """
+        Scan a table by symbol and time range.
+
+        Args:
+            table (Union[str, type]): Table name or record type, e.g. AlpacaSnapshot or "option_chain".
+            symbols (Optional[List[str]]): Symbols to return. All symbols if not given.
+            start (Union[datetime, float, None]): Inclusive start time (datetime or epoch seconds).
+            end (Union[datetime, float, None]): Exclusive end time (datetime or epoch seconds).
+            columns (Optional[List[str]]): Columns to return. All columns if not given.
+            filters (Optional[Dict[str, Any]]): Equality filters on other columns, a list of values matches any of them,
+                e.g. {"underlying": "SPY", "expiry": date(2025, 3, 3), "is_call": True}.
+
+        Returns:
+            pd.DataFrame: The matching rows ordered by symbol and timestamp.
+        """
+        if isinstance(table, type):
+            table = _table_name(table.__name__)
+        with self._lock:
+            return self._query(table, symbols, start, end, columns, filters)
+
+    def _query(
+        self,
+        table: str,
+        symbols: Optional[List[str]],
+        start: Union[datetime, float, None],
+        end: Union[datetime, float, None],
+        columns: Optional[List[str]],
+        filters: Optional[Dict[str, Any]],
+    ) -> pd.DataFrame:
+        if table not in self._tables:
+            return pd.DataFrame(columns=columns)
+
+        ts_column = timestamp_column(self._tables[table])
+        where, params = [], []
+        if symbols is not None:
+            where.append(f'"{SYMBOL_COLUMN}" IN ({", ".join("?" for _ in symbols)})')
+            params.extend(symbols)
+        if start is not None:
+            where.append(f'"{ts_column}" >= ?')
+            params.append(_to_epoch(start))
+        if end is not None:
+            where.append(f'"{ts_column}" < ?')
+            params.append(_to_epoch(end))
+        for column, value in (filters or {}).items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            where.append(f'"{column}" IN ({", ".join("?" for _ in values)})')
+            params.extend(_sqlite_value(v) for v in values)
+
+        select = ", ".join(f'"{column}"' for column in columns) if columns else "*"
+        order = [c for c in (SYMBOL_COLUMN, ts_column) if c in self._tables[table]]
+        sql = f'SELECT {select} FROM "{table}"'
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if order:
+            sql += " ORDER BY " + ", ".join(f'"{column}"' for column in order)
+
+        return pd.read_sql_query(sql, self._connection, params=params)
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._connection.close()
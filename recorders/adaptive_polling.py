@@ -0,0 +1,327 @@
+import math
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from persistence.record_batch import RecordBatch
+from persistence.schema import SYMBOL_COLUMN
+
+MIN_INTERVAL_DEFAULT = 1.0  # Seconds
+MAX_INTERVAL_DEFAULT = 60.0  # Seconds
+INITIAL_INTERVAL_DEFAULT = 5.0  # Seconds, until a group has been observed
+REQUESTS_PER_MINUTE_DEFAULT = 120  # For all groups together
+HALF_LIFE_DEFAULT = 300.0  # Seconds of history that weigh half of the estimates
+MOVE_THRESHOLD_DEFAULT = 0.5  # Expected move, in spreads, worth a new sample
+MIN_SPREAD = 1e-4  # Relative spread floor (1 bp), for symbols quoted without spread
+MAX_CHANGE_PROBABILITY = 0.95  # Caps the quote rate estimate of always changing quotes
+
+# Candidate columns of each input, in order of preference: snapshots, then
+# quotes and trades, then IBKR ticker records
+_PRICE_COLUMNS = ("latest_trade_price", "price", "last")
+_BID_COLUMNS = ("latest_quote_bid_price", "bid_price", "bid")
+_ASK_COLUMNS = ("latest_quote_ask_price", "ask_price", "ask")
+_QUOTE_TIME_COLUMNS = ("latest_quote_timestamp", "timestamp")
+
+
+def _first_column(data, names: Tuple[str, ...]) -> Optional[np.ndarray]:
+    """The first of the columns that the batch (RecordBatch or DataFrame) has."""
+    available = data.column_names if isinstance(data, RecordBatch) else data.columns
+    for name in names:
+        if name in available:
+            if isinstance(data, RecordBatch):
+                return data.column(name)
+            return data[name].to_numpy()
+    return None
+
+
+def _decay(elapsed: float, half_life: float) -> float:
+    """Weight of a new observation in an exponentially weighted average."""
+    return 1.0 - 0.5 ** (elapsed / half_life)
+
+
+class _SymbolActivity:
+    """Exponentially weighted activity estimates of one symbol."""
+
+    __slots__ = (
+        "price",
+        "quote_time",
+        "observed_at",
+        "variance",
+        "change_probability",
+        "poll_gap",
+        "spread",
+    )
+
+    def __init__(self, price: float, quote_time, spread: float, now: float):
+        self.price = price
+        self.quote_time = quote_time
+        self.observed_at = now
+        self.variance: Optional[float] = None  # Of the log return, per second
+        # Probability that the quote changed between polls
+        self.change_probability: Optional[float] = None
+        self.poll_gap: Optional[float] = None  # Seconds between polls
+        self.spread = spread  # Relative to the mid
+
+    def update(
+        self, price: float, quote_time, spread: float, now: float, half_life: float
+    ):
+        elapsed = now - self.observed_at
+        if elapsed <= 0:
+            return
+        weight = _decay(elapsed, half_life)
+
+        def average(current, value):
+            return value if current is None else current + weight * (value - current)
+
+        if price > 0 and self.price > 0:
+            self.variance = average(
+                self.variance, math.log(price / self.price) ** 2 / elapsed
+            )
+        changed = float(quote_time != self.quote_time)
+        self.change_probability = average(self.change_probability, changed)
+        self.poll_gap = average(self.poll_gap, elapsed)
+        if spread > 0:
+            self.spread = average(self.spread, spread)
+
+        if price > 0:
+            self.price = price
+        self.quote_time = quote_time
+        self.observed_at = now
+
+    def interval(self, move_threshold: float) -> Optional[float]:
+        """
+        Seconds between polls that this symbol's activity is worth.
+
+        That is the time the price takes to move by `move_threshold` spreads
+        (moves within the spread are noise), but no shorter than the average
+        time between quote changes. None until two polls were observed.
+        """
+        if self.change_probability is None:
+            return None
+
+        spread = max(self.spread, MIN_SPREAD)
+        if self.variance:
+            move_time = (move_threshold * spread) ** 2 / self.variance
+        else:
+            move_time = math.inf
+
+        probability = min(self.change_probability, MAX_CHANGE_PROBABILITY)
+        if probability > 0:
+            # Quote changes as a Poisson process: P(change within gap) = 1 - exp(-rate * gap)
+            quote_time = self.poll_gap / -math.log(1.0 - probability)
+        else:
+            quote_time = math.inf
+        return max(move_time, quote_time)
+
+
+class AdaptivePollingPolicy:
+    """
+    Polling intervals per symbol group that follow the activity of the symbols.
+
+    Every poll of a group is observed: per symbol the policy keeps
+    exponentially weighted estimates of the realised variance of the price,
+    of how often the quote changes between polls and of the relative
+    spread. A symbol is worth polling again once its expected price move
+    reaches `move_threshold` spreads, but not faster than its quotes change;
+    a group (fetched in one request) follows its most active symbol. The
+    intervals are kept within [min_interval, max_interval] and, together,
+    within `requests_per_minute`: when the groups want more requests than
+    the budget, all their intervals are stretched by the same factor, so
+    the budget goes where the information is.
+
+    Usage:
+        policy = AdaptivePollingPolicy({"index": ["SPY", "VOO"], "tech": ["AAPL", "MSFT"]})
+        group, wait = policy.next_due()
+        ...sleep(wait), fetch the group's symbols...
+        policy.observe(records)
+        policy.mark_polled(group)
+    """
+
+    def __init__(
+        self,
+        groups: Union[Dict[str, List[str]], List[str]],
+        min_interval: float = MIN_INTERVAL_DEFAULT,
+        max_interval: float = MAX_INTERVAL_DEFAULT,
+        requests_per_minute: float = REQUESTS_PER_MINUTE_DEFAULT,
+        initial_interval: float = INITIAL_INTERVAL_DEFAULT,
+        half_life: float = HALF_LIFE_DEFAULT,
+        move_threshold: float = MOVE_THRESHOLD_DEFAULT,
+        clock=time.monotonic,
+    ):
+        """
+        Args:
+            groups (Union[Dict[str, List[str]], List[str]]): Symbols polled together, by group name. A list of symbols polls each symbol on its own.
+            min_interval (float): Shortest interval between polls of a group, in seconds.
+            max_interval (float): Longest interval between polls of a group, in seconds.
+            requests_per_minute (float): Budget of polls of all groups together.
+            initial_interval (float): Interval of a group before its activity is known.
+            half_life (float): Half-life of the activity estimates, in seconds.
+            move_threshold (float): Expected price move, in spreads, that makes a new poll worth it.
+            clock: Monotonic clock, in seconds.
+        """
+        if not 0 < min_interval <= max_interval:
+            raise ValueError("Intervals must satisfy 0 < min_interval <= max_interval")
+        if requests_per_minute <= 0:
+            raise ValueError("requests_per_minute must be positive")
+
+        if not isinstance(groups, dict):
+            groups = {symbol: [symbol] for symbol in groups}
+        self._groups = {name: list(symbols) for name, symbols in groups.items()}
+        self._group_of = {
+            symbol: name for name, symbols in self._groups.items() for symbol in symbols
+        }
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._request_rate = requests_per_minute / 60.0
+        self._initial_interval = min(max(initial_interval, min_interval), max_interval)
+        self._half_life = half_life
+        self._move_threshold = move_threshold
+        self._clock = clock
+
+        self._activity: Dict[str, _SymbolActivity] = {}
+        # Intervals the activity of the groups is worth, before fitting the budget
+        self._wanted = {name: self._initial_interval for name in self._groups}
+        self._intervals: Dict[str, float] = {}
+        self._fit_budget()
+        now = clock()
+        self._next_poll = {name: now for name in self._groups}
+
+    @property
+    def groups(self) -> Dict[str, List[str]]:
+        return self._groups
+
+    def symbols(self, group: str) -> List[str]:
+        return self._groups[group]
+
+    def interval(self, group: str) -> float:
+        """Current interval between polls of a group, in seconds."""
+        return self._intervals[group]
+
+    def intervals(self) -> Dict[str, float]:
+        return dict(self._intervals)
+
+    def next_due(self) -> Tuple[str, float]:
+        """
+        The group to poll next.
+
+        Returns:
+            Tuple[str, float]: The group and the seconds until it is due (0 if overdue).
+        """
+        group = min(self._next_poll, key=self._next_poll.get)
+        return group, max(self._next_poll[group] - self._clock(), 0.0)
+
+    def mark_polled(self, group: str):
+        """Schedule the next poll of a group, one interval from now."""
+        self._next_poll[group] = self._clock() + self._intervals[group]
+
+    def observe(self, data):
+        """
+        Update the activity estimates with polled records and recompute the intervals.
+
+        Args:
+            data: Snapshots, quotes, trades or ticker records, as a RecordBatch or a DataFrame.
+        """
+        if not len(data):
+            return
+        symbols = _first_column(data, (SYMBOL_COLUMN,))
+        if symbols is None:
+            return
+        count = len(symbols)
+        nan = np.full(count, np.nan)
+
+        prices = _first_column(data, _PRICE_COLUMNS)
+        bid = _first_column(data, _BID_COLUMNS)
+        ask = _first_column(data, _ASK_COLUMNS)
+        prices = nan if prices is None else prices.astype(float)
+        bid = nan if bid is None else bid.astype(float)
+        ask = nan if ask is None else ask.astype(float)
+        quote_times = _first_column(data, _QUOTE_TIME_COLUMNS)
+        if quote_times is None:
+            quote_times = np.full(count, None)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mid = (bid + ask) / 2
+            spread = np.where((bid > 0) & (ask >= bid), (ask - bid) / mid, np.nan)
+            # The mid moves with every quote; trades may be stale
+            prices = np.where(mid > 0, mid, prices)
+
+        now = self._clock()
+        changed = set()
+        for symbol, price, quote_time, symbol_spread in zip(
+            symbols.tolist(), prices.tolist(), quote_times.tolist(), spread.tolist()
+        ):
+            if symbol not in self._group_of:
+                continue
+            price = price if price == price else 0.0
+            symbol_spread = symbol_spread if symbol_spread == symbol_spread else 0.0
+            activity = self._activity.get(symbol)
+            if activity is None:
+                self._activity[symbol] = _SymbolActivity(
+                    price, quote_time, symbol_spread, now
+                )
+            else:
+                activity.update(price, quote_time, symbol_spread, now, self._half_life)
+            changed.add(self._group_of[symbol])
+
+        for group in changed:
+            self._wanted[group] = self._group_interval(group)
+        if changed:
+            self._fit_budget()
+
+    def _group_interval(self, group: str) -> float:
+        """Interval of the most active symbol of a group, within the bounds."""
+        intervals = [
+            interval
+            for interval in (
+                self._activity[symbol].interval(self._move_threshold)
+                for symbol in self._groups[group]
+                if symbol in self._activity
+            )
+            if interval is not None
+        ]
+        if not intervals:
+            return self._initial_interval
+        return min(max(min(intervals), self._min_interval), self._max_interval)
+
+    def _fit_budget(self):
+        """
+        Stretch all wanted intervals by the same factor if they need more requests than the budget.
+
+        Intervals stretched past max_interval are capped, and the factor is
+        set so that the others use the rest of the budget. It is always
+        applied to the wanted intervals, so stretches do not compound.
+        """
+        rate = sum(1.0 / interval for interval in self._wanted.values())
+        if rate <= self._request_rate * (1 + 1e-9):
+            self._intervals = dict(self._wanted)
+            return
+
+        # The longest intervals reach max_interval first. Capping one leaves more
+        # of the budget to the others, so the factor only grows along the way.
+        wanted = sorted(self._wanted.values(), reverse=True)
+        free_rate = rate  # Of the groups that are not capped
+        scale = None
+        for capped, interval in enumerate(wanted):
+            remaining = self._request_rate - capped / self._max_interval
+            if remaining <= 0:
+                break
+            if interval * free_rate / remaining < self._max_interval:
+                scale = free_rate / remaining
+                break
+            free_rate -= 1.0 / interval
+        else:
+            if len(wanted) / self._max_interval <= self._request_rate:
+                scale = math.inf  # All of them at max_interval fit the budget
+
+        if scale is None:
+            # Even max_interval is over the budget: the budget wins
+            scale = rate / self._request_rate
+            self._intervals = {
+                group: interval * scale for group, interval in self._wanted.items()
+            }
+            return
+        self._intervals = {
+            group: min(interval * scale, self._max_interval)
+            for group, interval in self._wanted.items()
+        }
@@ -1,14 +1,16 @@
 import time
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
-import pandas as pd
+import numpy as np
 
-from brokerage_systems.alpaca_br.alpaca_defs import AlpacaSnapshot
+from brokerage_systems.alpaca_br.alpaca_defs import decode_snapshots
 from brokerage_systems.alpaca_br.alpaca_main import AlpacaClient
 from definitions import EST_TRADING_SESSION_LOGGER_TIMINGS, LoggerTiming
 from persistence.persistence import PersistenceLayer
+from persistence.record_batch import RecordBatch
+from recorders.adaptive_polling import AdaptivePollingPolicy
 from recorders.recorder import MarketRecordsLogger
 
 
@@ -26,6 +28,8 @@ class AlpacaSnapshotRecorder(MarketRecordsLogger):
             Union[int, List[LoggerTiming]]
         ] = EST_TRADING_SESSION_LOGGER_TIMINGS,
         default_timing: int = 1 * 60,  # Seconds
+        raw_data: bool = True,
+        polling_policy: Optional[AdaptivePollingPolicy] = None,
     ):
         """
         Initialize the Alpaca snapshot logger.
@@ -36,33 +40,40 @@ class AlpacaSnapshotRecorder(MarketRecordsLogger):
             persistences (List[PersistenceLayer]): List of persistence layers to store data.
             log_intervals (Optional[Union[int, List[LoggerTiming]]]): List of timings to log data.
             default_timing (int): Default logging interval in seconds.
+            raw_data (bool): Decode the raw JSON payload of the snapshots instead of the SDK models.
+            polling_policy (Optional[AdaptivePollingPolicy]): Poll symbol groups at intervals adapted to their activity.
         """
         super().__init__(
             stocks=stocks,
             persistences=persistences,
             log_intervals=log_intervals,
             default_timing=default_timing,
+            polling_policy=polling_policy,
         )
 
         self._alpaca = AlpacaClient(api_key=config["key"], secret_key=config["secret"])
+        self._raw_data = raw_data
 
     def connect(self):
         pass
 
-    def _get_records(self) -> List[AlpacaSnapshot]:
+    def _get_records(self) -> RecordBatch:
         """
         Fetch the latest snapshots for tracked stocks.
+
+        The response is decoded straight into the columns of a RecordBatch,
+        without building an AlpacaSnapshot per symbol.
         """
+        return self._get_records_for(self._stocks)
+
+    def _get_records_for(self, symbols: List[str]) -> RecordBatch:
+        """Fetch the latest snapshots of some of the tracked stocks."""
         snapshots = self._alpaca.get_snapshot(
-            symbols=self._stocks,
+            symbols=symbols,
             feed="iex",
+            raw_data=self._raw_data,
         )
-
-        snapshots_dict_list = [
-            AlpacaSnapshot.from_dict(snapshot) for snapshot in snapshots.values()
-        ]
-
-        return snapshots_dict_list
+        return decode_snapshots(snapshots)
 
     def disconnect(self):
         pass
@@ -157,6 +168,9 @@ class AlpacaOptionsChainRecorder(MarketRecordsLogger):
         ] = EST_TRADING_SESSION_LOGGER_TIMINGS,
         default_timing: int = 1 * 60,  # Seconds
         hours_in_day: Optional[List[datetime.time]] = None,
+        enrich_greeks: bool = False,
+        risk_free_rate: float = 0.04,
+        dividend_yields: Optional[Dict[str, float]] = None,
     ):
         """
         Initialize the Alpaca snapshot logger.
@@ -167,6 +181,9 @@ class AlpacaOptionsChainRecorder(MarketRecordsLogger):
             persistences (List[PersistenceLayer]): List of persistence layers to store data.
             log_intervals (Optional[Union[int, List[LoggerTiming]]]): List of timings to log data.
             default_timing (int): Default logging interval in seconds.
+            enrich_greeks (bool): Compute the implied volatility and greeks missing from the chain.
+            risk_free_rate (float): Continuously compounded rate used for the greeks.
+            dividend_yields (Optional[Dict[str, float]]): Continuous dividend yields by underlying symbol.
         """
         super().__init__(
             stocks=stocks,
@@ -177,6 +194,9 @@ class AlpacaOptionsChainRecorder(MarketRecordsLogger):
         )
 
         self._alpaca = AlpacaClient(api_key=config["key"], secret_key=config["secret"])
+        self._enrich_greeks = enrich_greeks
+        self._risk_free_rate = risk_free_rate
+        self._dividend_yields = dividend_yields or {}
 
     def connect(self):
         pass
@@ -186,6 +206,8 @@ class AlpacaOptionsChainRecorder(MarketRecordsLogger):
         Fetch the latest snapshots for tracked stocks.
         """
 
+        import pandas as pd
+
         results = []
 
         for symbol in self._stocks:
@@ -195,7 +217,34 @@ class AlpacaOptionsChainRecorder(MarketRecordsLogger):
                 )
             )
 
-        return pd.concat(results, ignore_index=True)
+        chain = pd.concat(results, ignore_index=True)
+        if "underlying" in chain.columns:
+            # Concatenating chains with different underlyings drops the categories
+            chain["underlying"] = chain["underlying"].astype("category")
+        if self._enrich_greeks:
+            from analytics.black_scholes import enrich_option_chain
+
+            chain = enrich_option_chain(
+                chain,
+                spot=self._underlying_prices(),
+                rate=self._risk_free_rate,
+                dividend_yield=self._dividend_yields,
+            )
+        return chain
+
+    def _underlying_prices(self) -> Dict[str, float]:
+        """Latest quote midpoint of every tracked stock, or its last trade price."""
+        snapshots = decode_snapshots(
+            self._alpaca.get_snapshot(symbols=self._stocks, raw_data=True)
+        )
+        bid = snapshots.column("latest_quote_bid_price")
+        ask = snapshots.column("latest_quote_ask_price")
+        prices = np.where(
+            (bid > 0) & (ask > 0),
+            (bid + ask) / 2,
+            snapshots.column("latest_trade_price"),
+        )
+        return dict(zip(snapshots.column("symbol").tolist(), prices.tolist()))
 
     def disconnect(self):
         pass
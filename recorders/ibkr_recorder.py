@@ -1,22 +1,71 @@
-from typing import List
+from typing import Dict, List, Optional
 from ib_insync import *
 import datetime
-import csv
-import time
 
+from brokerage_systems.ibkr.contract_cache import ContractCache
 from definitions import TickerRecord
 from persistence.persistence import PersistenceLayer
+from persistence.record_batch import RecordBatch
 from recorders.recorder import MarketRecordsLogger
 
+POLL = "poll"  # reqTickers at every tick
+SNAPSHOT = "snapshot"  # Subscribe once, record the latest state at every tick
+STREAM = "stream"  # Subscribe once, record every update as it arrives
+MODES = (POLL, SNAPSHOT, STREAM)
+
+
+def _number(value, default=0):
+    """IB reports missing values as NaN (or -1 for sizes); the records use 0."""
+    if value is None or value != value or value == -1:
+        return default
+    return value
+
+
+def ticker_record(ticker: Ticker) -> TickerRecord:
+    """Convert an ib_insync Ticker into a TickerRecord."""
+    return TickerRecord(
+        timestamp=(
+            ticker.time or datetime.datetime.now(datetime.timezone.utc)
+        ).timestamp(),
+        symbol=ticker.contract.symbol,
+        bid=_number(ticker.bid),
+        bid_size=_number(ticker.bidSize),
+        ask=_number(ticker.ask),
+        ask_size=_number(ticker.askSize),
+        last=_number(ticker.last),
+        last_size=_number(ticker.lastSize),
+        volume=int(_number(ticker.volume)),
+        open=_number(ticker.open),
+        high=_number(ticker.high),
+        low=_number(ticker.low),
+        close=_number(ticker.close),
+    )
+
 
 class IBKRTickerPriceLogger(MarketRecordsLogger):
-    """IBKR implementation of the TickerPriceLogger interface."""
+    """
+    IBKR implementation of the TickerPriceLogger interface.
+
+    In "poll" mode every tick requests a snapshot of all contracts. In
+    "snapshot" and "stream" mode the contracts are subscribed once with
+    reqMktData and ticker updates are captured into a per-symbol state table
+    as they arrive; "snapshot" records that table at every tick without
+    waiting for data, "stream" records every batch of updates (one
+    pendingTickersEvent) as a micro-batch. The IB event loop runs while the
+    recorder sleeps between ticks, so no update is missed.
+    """
 
     def __init__(
         self,
         stocks: List[str],
         log_interval: int = 60 * 5,
         persistences: List[PersistenceLayer] = [],
+        mode: str = POLL,
+        ib=None,
+        host: str = "127.0.0.1",
+        port: int = 4001,
+        client_id: int = 1,
+        contract_cache: Optional[ContractCache] = None,
     ):
         """
         Initialize the IBKR ticker logger.
@@ -24,53 +73,86 @@ class IBKRTickerPriceLogger(MarketRecordsLogger):
         Args:
             stocks (List[str]): List of stock symbols to track.
             log_interval (int): Interval in seconds to log prices.
-            csv_filename (str): File to store logged prices.
+            persistences (List[PersistenceLayer]): List of persistence layers to store data.
+            mode (str): "poll", "snapshot" or "stream".
+            ib: The ib_insync.IB client (or a stand-in such as FakeIB). Created if not given.
+            host (str): TWS / IB Gateway host.
+            port (int): TWS / IB Gateway port.
+            client_id (int): API client id.
+            contract_cache (Optional[ContractCache]): Cache of qualified contracts, so that only new or expired contracts are qualified at startup.
         """
-        super().__init__(stocks, log_interval, persistences)
+        if mode not in MODES:
+            raise ValueError(f"Invalid mode {mode!r}. Must be one of {MODES}.")
 
-        self._ib = IB()
+        super().__init__(
+            stocks=stocks, persistences=persistences, log_intervals=log_interval
+        )
+
+        self._ib = ib if ib is not None else IB()
+        self._mode = mode
+        self._host = host
+        self._port = port
+        self._client_id = client_id
+        self._contract_cache = contract_cache
         self._contracts = []
+        self._state: Dict[str, TickerRecord] = {}  # Latest record per symbol
 
     def connect(self):
-        """Connect to IBKR TWS or IB Gateway."""
+        """Connect to IBKR TWS or IB Gateway and subscribe in streaming modes."""
         print("Connecting to IBKR...")
-        self._ib.connect("127.0.0.1", 4001, clientId=1)
-        self._contracts = [
-            self._ib.qualifyContracts(Stock(symbol, "SMART", "USD"))[0]
-            for symbol in self._stocks
-        ]
+        self._ib.connect(self._host, self._port, clientId=self._client_id)
+        contracts = [Stock(symbol, "SMART", "USD") for symbol in self._stocks]
+        if self._contract_cache is not None:
+            self._contracts = self._contract_cache.qualify(self._ib, contracts)
+        else:
+            self._contracts = self._ib.qualifyContracts(*contracts)
+
+        if self._mode != POLL:
+            self._ib.pendingTickersEvent += self._on_pending_tickers
+            for contract in self._contracts:
+                self._ib.reqMktData(contract, "", False, False)
         print("Connected to IBKR.")
 
-    def _get_records(self) -> List[TickerRecord]:
+    def _on_pending_tickers(self, tickers):
+        """Capture a batch of ticker updates into the state table."""
+        records = [ticker_record(ticker) for ticker in tickers]
+        for record in records:
+            self._state[record.symbol] = record
+
+        if self._mode == STREAM and records:
+            batch = RecordBatch.from_records(records, TickerRecord)
+            for persistence in self._persistences:
+                persistence.save_data(batch)
+
+    def _sleep(self, seconds: float):
+        # Keep the IB event loop running, so ticker updates are captured
+        self._ib.sleep(seconds)
+
+    def _get_records(self) -> RecordBatch:
         """Fetch the latest prices for tracked stocks."""
-        tickers = []
-        for contract in self._contracts:
-            tickers.append(self._ib.reqTickers(contract)[0])
-        time.sleep(2)  # Allow time for data to populate
-
-        prices = []
-        for ticker in tickers:
-            prices.append(
-                TickerRecord(
-                    timestamp=ticker.time.timestamp(),
-                    symbol=ticker.contract.symbol,
-                    bid=ticker.bid if hasattr(ticker, "bid") else 0,
-                    bid_size=ticker.bidSize if hasattr(ticker, "bidSize") else 0,
-                    ask=ticker.ask if hasattr(ticker, "ask") else 0,
-                    ask_size=ticker.askSize if hasattr(ticker, "askSize") else 0,
-                    last=ticker.last if hasattr(ticker, "last") else 0,
-                    last_size=ticker.lastSize if hasattr(ticker, "lastSize") else 0,
-                    volume=ticker.volume if type(ticker.volume) == int else 0,
-                    open=ticker.open if hasattr(ticker, "open") else 0,
-                    high=ticker.high if hasattr(ticker, "high") else 0,
-                    low=ticker.low if hasattr(ticker, "low") else 0,
-                    close=ticker.close if hasattr(ticker, "close") else 0,
-                )
+        if self._mode == POLL:
+            tickers = self._ib.reqTickers(*self._contracts)
+            return RecordBatch.from_records(
+                [ticker_record(ticker) for ticker in tickers], TickerRecord
             )
-        return prices
+
+        # Deliver the updates that arrived since the event loop last ran
+        self._ib.sleep(0)
+        return RecordBatch.from_records(list(self._state.values()), TickerRecord)
+
+    def _log_records(self):
+        if self._mode == STREAM:
+            # Updates are recorded as they arrive
+            self._ib.sleep(0)
+            return
+        super()._log_records()
 
     def disconnect(self):
-        """Disconnect from IBKR."""
+        """Cancel the subscriptions and disconnect from IBKR."""
+        if self._mode != POLL:
+            self._ib.pendingTickersEvent -= self._on_pending_tickers
+            for contract in self._contracts:
+                self._ib.cancelMktData(contract)
         self._ib.disconnect()
         print("Disconnected from IBKR.")
 
@@ -82,7 +164,10 @@ if __name__ == "__main__":
     pl = GCSPersistence("ibkr_intraday_data")
 
     ibkr_logger = IBKRTickerPriceLogger(
-        stocks=["SPY", "VOO"], log_interval=30, persistences=[pl]
+        stocks=["SPY", "VOO"],
+        log_interval=30,
+        persistences=[pl],
+        contract_cache=ContractCache("ibkr_contracts.json"),
     )
 
     ibkr_logger.run()
@@ -1,7 +1,7 @@
 import time
 
 from abc import ABC, abstractmethod
-from typing import List, Dict, Optional, Union
+from typing import TYPE_CHECKING, List, Dict, Optional, Union
 import datetime
 
 from definitions import (
@@ -11,6 +11,11 @@ from definitions import (
     TickerRecord,
 )
 from persistence.persistence import PersistenceLayer
+from persistence.record_batch import RecordBatch
+from recorders.adaptive_polling import AdaptivePollingPolicy
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 class MarketRecordsLogger(ABC):
@@ -27,7 +32,16 @@ class MarketRecordsLogger(ABC):
         hours_in_day: Optional[
             List[datetime.time]
         ] = None,  # List of times to log data. By the minutes (seconds are ignored)
+        polling_policy: Optional[AdaptivePollingPolicy] = None,
     ):
+        if (
+            polling_policy is not None
+            and type(self)._get_records_for is MarketRecordsLogger._get_records_for
+        ):
+            raise ValueError(
+                f"{type(self).__name__} cannot poll with a polling_policy: "
+                "it does not implement _get_records_for"
+            )
         self._stocks = stocks
         self._log_intervals = log_intervals
         self._log_interval = default_timing
@@ -37,6 +51,8 @@ class MarketRecordsLogger(ABC):
             else None
         )
         self._persistences = persistences
+        # Polls symbol groups at adaptive intervals instead of log_intervals, within their time windows
+        self._polling_policy = polling_policy
 
     @abstractmethod
     def connect(self):
@@ -44,21 +60,70 @@ class MarketRecordsLogger(ABC):
         pass
 
     @abstractmethod
-    def _get_records(self) -> List[LoggerRecord]:
-        """Fetches the latest prices for the tracked stocks."""
+    def _get_records(self) -> Union[List[LoggerRecord], RecordBatch, "pd.DataFrame"]:
+        """
+        Fetches the latest prices for the tracked stocks.
+
+        Record recorders return a RecordBatch (one column per field), which
+        every persistence layer accepts alongside lists of records and DataFrames.
+        """
         pass
 
+    def _get_records_for(
+        self, symbols: List[str]
+    ) -> Union[List[LoggerRecord], RecordBatch, "pd.DataFrame"]:
+        """
+        Fetches the latest prices of some of the tracked stocks.
+
+        Recorders that can fetch a subset of their stocks implement it, so
+        that they can poll with an AdaptivePollingPolicy.
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} cannot fetch a subset of its stocks"
+        )
+
+    def _sleep(self, seconds: float):
+        """Wait between ticks. Recorders with an event loop keep it running meanwhile."""
+        time.sleep(seconds)
+
     def _log_records(self):
         """Fetch and log prices using all configured persistence layers."""
         prices = self._get_records()
         for persistence in self._persistences:
             persistence.save_data(prices)
 
+    def _log_adaptive(self):
+        """Poll the symbol group that is due next, and let the policy observe it."""
+        policy = self._polling_policy
+        if isinstance(self._log_intervals, list) and not any(
+            timing.is_logging_time() for timing in self._log_intervals
+        ):
+            self._sleep(self._log_interval)
+            return
+
+        group, wait = policy.next_due()
+        if wait > 0:
+            self._sleep(wait)
+        records = self._get_records_for(policy.symbols(group))
+        policy.mark_polled(group)
+        policy.observe(records)
+        for persistence in self._persistences:
+            persistence.save_data(records)
+        self._rotate_files()
+
     def _rotate_files(self):
         """Rotate files in all configured persistence layers."""
         for persistence in self._persistences:
             persistence._rotate_files()
 
+    def _close_persistences(self):
+        """Flush and close all configured persistence layers."""
+        for persistence in self._persistences:
+            try:
+                persistence.close()
+            except Exception as e:
+                print(f"Failed to close persistence layer: {e}")
+
     @abstractmethod
     def disconnect(self):
         """Close connection to the data source."""
@@ -74,21 +139,23 @@ class MarketRecordsLogger(ABC):
 
         try:
             while True:
-                if self._hours_in_day is None:
+                if self._polling_policy is not None:
+                    self._log_adaptive()
+                elif self._hours_in_day is None:
                     if self._log_intervals is not None:
                         if isinstance(self._log_intervals, int):
-                            time.sleep(self._log_intervals)
+                            self._sleep(self._log_intervals)
                         else:
                             slept = False
                             for timing in self._log_intervals:
                                 if timing.is_logging_time():
-                                    time.sleep(timing.get_log_interval())
+                                    self._sleep(timing.get_log_interval())
                                     slept = True
                                     break
                             if not slept:
-                                time.sleep(self._log_interval)
+                                self._sleep(self._log_interval)
                     else:
-                        time.sleep(self._log_interval)
+                        self._sleep(self._log_interval)
 
                     self._log_records()
                     self._rotate_files()
@@ -101,18 +168,24 @@ class MarketRecordsLogger(ABC):
                         self._log_records()
                         self._rotate_files()
 
-                        time.sleep(
+                        self._sleep(
                             60
                         )  # Sleep for a minute to avoid logging multiple times in the same minute
 
         except KeyboardInterrupt:
             print("Stopping logger...")
         finally:
+            self._close_persistences()
             self.disconnect()
             print("Logger stopped.")
 
-    def run_once(self):
-        """Log prices once and stop."""
+    def run_once(self) -> bool:
+        """
+        Log prices once and stop.
+
+        Returns:
+            bool: Whether the records were logged.
+        """
         try:
             self.connect()
         except Exception as e:
@@ -121,8 +194,11 @@ class MarketRecordsLogger(ABC):
         try:
             self._log_records()
             self._rotate_files()
+            return True
         except Exception as e:
             print(f"Failed to log records: {e}")
+            return False
         finally:
+            self._close_persistences()
             self.disconnect()
             print("Logger stopped.")
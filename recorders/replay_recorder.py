@@ -0,0 +1,292 @@
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from persistence.persistence import PersistenceLayer
+from persistence.reader import RecordedDataReader
+from persistence.schema import epoch_series, timestamp_column
+from recorders.recorder import MarketRecordsLogger
+
+BATCH_SIZE_DEFAULT = 50_000  # Records per emitted batch at maximum speed
+BATCH_WINDOW_DEFAULT = 1.0  # Seconds of recorded time per emitted batch when paced
+REPORT_INTERVAL_DEFAULT = 5.0  # Seconds between throughput reports
+
+Source = Union[RecordedDataReader, Iterable[pd.DataFrame]]
+
+
+class _Stream:
+    """A source of time ordered chunks, with the chunk being merged."""
+
+    def __init__(self, kind: str, chunks: Iterator[pd.DataFrame]):
+        self.kind = kind
+        self._chunks = chunks
+        self.frame: Optional[pd.DataFrame] = None
+        self.times = np.empty(0)
+        self.position = 0
+        self.done = False
+        self.load()
+
+    def load(self):
+        """Move to the next non-empty chunk, sorted by time."""
+        while self.position >= len(self.times):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self.done = True
+                self.frame, self.times, self.position = None, np.empty(0), 0
+                return
+            if not len(chunk):
+                continue
+            column = timestamp_column(list(chunk.columns))
+            if column is None:
+                raise ValueError(f"{self.kind} records have no timestamp column")
+            times = epoch_series(chunk[column]).to_numpy(dtype=float)
+            order = np.argsort(times, kind="stable")
+            self.frame = chunk.iloc[order].reset_index(drop=True)
+            self.times = times[order]
+            self.position = 0
+
+    def take(self, until: float) -> Tuple[pd.DataFrame, np.ndarray]:
+        """Rows up to and including time `until`."""
+        end = int(np.searchsorted(self.times, until, side="right"))
+        rows = self.frame.iloc[self.position : end]
+        times = self.times[self.position : end]
+        self.position = end
+        if self.position >= len(self.times):
+            self.load()
+        return rows, times
+
+
+def merge_streams(
+    streams: List[_Stream],
+) -> Iterator[List[Tuple[str, pd.DataFrame, np.ndarray]]]:
+    """
+    K-way merge of time ordered streams, a block of rows at a time.
+
+    Every step takes, from every stream, the rows up to the earliest last
+    time of the chunks being merged: no row still to be read can be older.
+    The rows of each kind are then merged with one stable sort, so ties keep
+    the order of the streams. Per-row heap operations are never needed.
+
+    Yields:
+        List[Tuple[str, pd.DataFrame, np.ndarray]]: Per kind, the rows of a step and their epoch times.
+    """
+    while True:
+        active = [stream for stream in streams if not stream.done]
+        if not active:
+            return
+        horizon = min(stream.times[-1] for stream in active)
+
+        parts: Dict[str, List[Tuple[pd.DataFrame, np.ndarray]]] = {}
+        for stream in active:
+            rows, times = stream.take(horizon)
+            if len(rows):
+                parts.setdefault(stream.kind, []).append((rows, times))
+
+        step = []
+        for kind, kind_parts in parts.items():
+            if len(kind_parts) == 1:
+                rows, times = kind_parts[0]
+            else:
+                times = np.concatenate([times for _, times in kind_parts])
+                order = np.argsort(times, kind="stable")
+                rows = pd.concat(
+                    [rows for rows, _ in kind_parts], ignore_index=True
+                ).iloc[order]
+                times = times[order]
+            step.append((kind, rows.reset_index(drop=True), times))
+        yield step
+
+
+class ReplayRecorder(MarketRecordsLogger):
+    """
+    Replays recorded data into persistence layers, in timestamp order.
+
+    Sources are named by kind ("snapshots", "trades", "option_chain", ...),
+    each a RecordedDataReader or any iterable of time ordered DataFrame
+    chunks, or a list of them (e.g. one reader per symbol). All sources are
+    merged by time with merge_streams; batches only ever hold rows of one
+    kind, so every sink receives records of a single type.
+
+    With speed=None batches of up to batch_size records are emitted as fast
+    as the sinks take them. Otherwise the recorded time is replayed `speed`
+    times faster than real time (1.0 for real time), one batch_window of
+    recorded time per kind at a time.
+    """
+
+    def __init__(
+        self,
+        sources: Dict[str, Union[Source, List[Source]]],
+        persistences: List[PersistenceLayer],
+        symbols: Optional[List[str]] = None,
+        start: Union[datetime, float, None] = None,
+        end: Union[datetime, float, None] = None,
+        speed: Optional[float] = None,
+        batch_size: int = BATCH_SIZE_DEFAULT,
+        batch_window: float = BATCH_WINDOW_DEFAULT,
+        report_interval: Optional[float] = REPORT_INTERVAL_DEFAULT,
+    ):
+        """
+        Initialize the replay.
+
+        Args:
+            sources (Dict[str, Union[Source, List[Source]]]): Recorded data by kind.
+            persistences (List[PersistenceLayer]): List of persistence layers to replay into.
+            symbols (Optional[List[str]]): Symbols to replay from the readers. All symbols if not given.
+            start (Union[datetime, float, None]): Inclusive start time for the readers.
+            end (Union[datetime, float, None]): Exclusive end time for the readers.
+            speed (Optional[float]): Replay speed relative to real time. None for maximum speed.
+            batch_size (int): Maximum records per batch.
+            batch_window (float): Seconds of recorded time per batch when paced.
+            report_interval (Optional[float]): Seconds between throughput reports. None for none.
+        """
+        if speed is not None and speed <= 0:
+            raise ValueError("speed must be positive, or None for maximum speed")
+
+        super().__init__(
+            stocks=symbols or [], persistences=persistences, log_intervals=None
+        )
+
+        self._sources = sources
+        self._symbols = symbols
+        self._start = start
+        self._end = end
+        self._speed = speed
+        self._batch_size = batch_size
+        self._batch_window = batch_window
+        self._report_interval = report_interval
+
+        self._batches: Optional[Iterator[Tuple[float, pd.DataFrame]]] = None
+        self._records = 0
+        self._batch_count = 0
+        # Monotonic wall clock time and recorded time of the first batch
+        self._started_at: Optional[float] = None
+        self._origin: Optional[float] = None
+        self._reported_at = 0.0
+
+    def _chunks(self, source: Source) -> Iterator[pd.DataFrame]:
+        if isinstance(source, RecordedDataReader):
+            return source.iter_chunks(self._symbols, self._start, self._end)
+        return iter(source)
+
+    def connect(self):
+        """Open the sources."""
+        streams = []
+        for kind, sources in self._sources.items():
+            if not isinstance(sources, list) or (
+                sources and isinstance(sources[0], pd.DataFrame)
+            ):
+                # A single source (a list of DataFrames is the chunks of one)
+                sources = [sources]
+            streams.extend(_Stream(kind, self._chunks(source)) for source in sources)
+        self._batches = self._iter_batches(streams)
+        self._records = self._batch_count = 0
+        self._started_at = self._origin = None
+        self._reported_at = time.monotonic()
+
+    def _iter_batches(
+        self, streams: List[_Stream]
+    ) -> Iterator[Tuple[float, pd.DataFrame]]:
+        """(Recorded time of the first row, rows of one kind) in replay order."""
+        for step in merge_streams(streams):
+            if self._speed is None:
+                for _, rows, times in step:
+                    for i in range(0, len(rows), self._batch_size):
+                        yield times[i], rows.iloc[i : i + self._batch_size]
+                continue
+
+            # Paced: consecutive windows of recorded time, every kind per window
+            origin = min(times[0] for _, _, times in step)
+            windows = [
+                ((times - origin) // self._batch_window).astype(np.int64)
+                for _, _, times in step
+            ]
+            for window in np.unique(np.concatenate(windows)):
+                for (_, rows, times), kind_windows in zip(step, windows):
+                    first = int(np.searchsorted(kind_windows, window, side="left"))
+                    last = int(np.searchsorted(kind_windows, window, side="right"))
+                    for i in range(first, last, self._batch_size):
+                        j = min(i + self._batch_size, last)
+                        yield times[i], rows.iloc[i:j]
+
+    def _wait_for(self, recorded_time: float):
+        """Sleep until a batch is due, when paced."""
+        now = time.monotonic()
+        if self._started_at is None:
+            self._started_at, self._origin = now, recorded_time
+        if self._speed is None:
+            return
+        due = self._started_at + (recorded_time - self._origin) / self._speed
+        if due > now:
+            self._sleep(due - now)
+
+    def _get_records(self) -> pd.DataFrame:
+        """The next batch, once it is due. Empty when the replay is over."""
+        if self._batches is None:
+            self.connect()
+        batch = next(self._batches, None)
+        if batch is None:
+            return pd.DataFrame()
+        recorded_time, rows = batch
+        self._wait_for(recorded_time)
+        return rows
+
+    def _log_records(self) -> bool:
+        """Replay the next batch. Returns False when the replay is over."""
+        rows = self._get_records()
+        if not len(rows):
+            return False
+        for persistence in self._persistences:
+            persistence.save_data(rows)
+        self._records += len(rows)
+        self._batch_count += 1
+
+        if self._report_interval is not None:
+            now = time.monotonic()
+            if now - self._reported_at >= self._report_interval:
+                self._reported_at = now
+                self._report()
+        return True
+
+    def stats(self) -> dict:
+        """Records and batches replayed so far, and the throughput in records per second."""
+        elapsed = (
+            time.monotonic() - self._started_at if self._started_at is not None else 0.0
+        )
+        return {
+            "records": self._records,
+            "batches": self._batch_count,
+            "seconds": elapsed,
+            "records_per_second": self._records / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def _report(self):
+        stats = self.stats()
+        print(
+            f"Replayed {stats['records']:,} records in {stats['batches']:,} batches, "
+            f"{stats['records_per_second']:,.0f} records/s"
+        )
+
+    def run(self) -> dict:
+        """
+        Replay all sources into the persistence layers.
+
+        Returns:
+            dict: The final stats(), including records per second.
+        """
+        self.connect()
+        try:
+            while self._log_records():
+                pass
+        except KeyboardInterrupt:
+            print("Stopping replay...")
+        finally:
+            self._close_persistences()
+            self.disconnect()
+        self._report()
+        return self.stats()
+
+    def disconnect(self):
+        self._batches = None
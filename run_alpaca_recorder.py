@@ -2,6 +2,7 @@ from google.cloud import secretmanager
 
 from recorders.alpaca_recorder import AlpacaSnapshotRecorder
 from persistence.gcp_cloud_storage import GCSPersistence
+from persistence.spool import SpooledPersistence
 
 PROJECT_ID = 797853389585
 
@@ -19,12 +20,16 @@ def main():
         "secret": access_secret(PROJECT_ID, "ALPACA_SECRET"),
     }
 
-    pl = GCSPersistence(
-        bucket_name="alpaca_intraday_data",
-        gcs_prefix="stocks/intraday_data",
-        filename="snapshots_logs",
-        format="json",
-        file_per_day=True,
+    # Write through a local spool so that GCS outages do not stall or lose ticks
+    pl = SpooledPersistence(
+        GCSPersistence(
+            bucket_name="alpaca_intraday_data",
+            gcs_prefix="stocks/intraday_data",
+            filename="snapshots_logs",
+            format="json",
+            file_per_day=True,
+        ),
+        spool_dir="spool/snapshots_logs",
     )
 
     alpaca_recorder = AlpacaSnapshotRecorder(
@@ -0,0 +1,61 @@
+import pandas as pd
+import pytest
+
+from recorders.adaptive_polling import AdaptivePollingPolicy
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _quotes(symbol: str, tick: int) -> pd.DataFrame:
+    """A new quote on every poll, with a mid moving by far more than the spread."""
+    mid = 100.0 * (1.01 if tick % 2 else 1.0)
+    return pd.DataFrame(
+        {
+            "symbol": [symbol],
+            "bid": [mid - 0.005],
+            "ask": [mid + 0.005],
+            "timestamp": [float(tick)],
+        }
+    )
+
+
+def test_groups_with_the_same_activity_share_the_budget_equally():
+    clock = FakeClock()
+    policy = AdaptivePollingPolicy(
+        {"a": ["A"], "b": ["B"]}, requests_per_minute=60, clock=clock
+    )
+
+    # Each poll only observes its own group
+    for tick in range(200):
+        clock.now += 1.0
+        for symbol in ("A", "B"):
+            policy.observe(_quotes(symbol, tick))
+
+    intervals = policy.intervals()
+    assert intervals["a"] == pytest.approx(intervals["b"])
+    assert sum(60 / interval for interval in intervals.values()) == pytest.approx(60)
+
+
+def test_stretched_intervals_are_capped_and_the_rest_use_the_budget():
+    clock = FakeClock()
+    policy = AdaptivePollingPolicy(
+        ["A", "B", "C"],
+        max_interval=10,
+        requests_per_minute=24,
+        initial_interval=5,
+        clock=clock,
+    )
+
+    # The stretched intervals of B and C reach max_interval; A gets the rest of the budget
+    for tick in range(50):
+        clock.now += 1.0
+        policy.observe(_quotes("A", tick))
+    intervals = policy.intervals()
+    assert intervals["B"] == intervals["C"] == pytest.approx(10)
+    assert sum(60 / interval for interval in intervals.values()) == pytest.approx(24)
@@ -0,0 +1,59 @@
+import math
+
+from analytics.bar_aggregation import BarAggregator
+from brokerage_systems.alpaca_br.alpaca_defs import AlpacaSnapshot
+from definitions import BarData, QuoteData, TradeData
+from persistence.persistence import PersistenceLayer
+
+
+class CollectingPersistence(PersistenceLayer):
+    def __init__(self):
+        super().__init__()
+        self.bars = []
+
+    def save_data(self, data):
+        self.bars.extend(data)
+
+
+def _snapshot(symbol, trade_time, price, size, trade_id, quote_time, bid, ask):
+    bar = BarData(*([math.nan] * 4), symbol, math.nan, math.nan, math.nan, math.nan)
+    return AlpacaSnapshot(
+        daily_bar=bar,
+        latest_quote=QuoteData(
+            "V", ask, 1.0, "V", bid, 1.0, [], symbol, "C", quote_time
+        ),
+        latest_trade=TradeData([], "V", trade_id, price, size, symbol, "C", trade_time),
+        minute_bar=bar,
+        previous_daily_bar=bar,
+        symbol=symbol,
+    )
+
+
+def test_quote_lagging_its_trade_does_not_evict_the_open_bar():
+    sink = CollectingPersistence()
+    aggregator = BarAggregator({1: [sink]}, allowed_lateness=2.0)
+
+    # The quote lags its own trade by more than the span of the ring (4 slots)
+    aggregator.save_data([_snapshot("SPY", 100.5, 11.0, 3.0, 1, 96.2, 9.0, 9.2)])
+    aggregator.save_data([_snapshot("SPY", 100.7, 12.0, 4.0, 2, 96.2, 9.0, 9.2)])
+    aggregator.close()
+
+    bars = [bar for bar in sink.bars if bar.timestamp == 100.0]
+    assert len(bars) == 1
+    assert bars[0].open == 11.0
+    assert bars[0].close == 12.0
+    assert bars[0].volume == 7.0
+    assert bars[0].trade_count == 2.0
+    assert aggregator.late_events == 1
+
+
+def test_events_within_the_allowed_lateness_are_aggregated():
+    sink = CollectingPersistence()
+    aggregator = BarAggregator({1: [sink]}, allowed_lateness=2.0)
+
+    aggregator.add_trade("SPY", 100.5, 11.0, 1.0)
+    aggregator.add_trade("SPY", 99.2, 10.0, 1.0)
+    aggregator.close()
+
+    assert [bar.timestamp for bar in sink.bars] == [99.0, 100.0]
+    assert aggregator.late_events == 0
@@ -0,0 +1,59 @@
+import pandas as pd
+
+from definitions import TickerRecord
+from persistence.gcp_bigquery import BigQueryLoadPersistence, LocalBigQueryClient
+
+TABLE = "project.dataset.ticks"
+
+
+def _records(count, start=0):
+    return [
+        TickerRecord(1735830000.0 + i, "SPY", *([1.0] * 11))
+        for i in range(start, start + count)
+    ]
+
+
+def _persistence(client, **kwargs):
+    return BigQueryLoadPersistence(
+        "project", "dataset", "ticks", client=client, **kwargs
+    )
+
+
+def test_rows_are_buffered_until_max_rows(tmp_path):
+    client = LocalBigQueryClient(str(tmp_path))
+    persistence = _persistence(client, max_rows=5)
+
+    persistence.save_data(_records(3))
+    assert client.load_jobs == []
+    assert persistence.has_buffered_data()
+
+    persistence.save_data(_records(3, start=3))
+    assert [rows for _, _, rows in client.load_jobs] == [6]
+    assert not persistence.has_buffered_data()
+    assert TABLE in client.tables
+
+
+def test_close_loads_the_buffered_rows(tmp_path):
+    client = LocalBigQueryClient(str(tmp_path))
+    persistence = _persistence(client, partition_field="timestamp")
+
+    persistence.save_data(_records(2))
+    persistence.save_data(_records(2, start=2))
+    persistence.close()
+
+    assert len(client.load_jobs) == 1
+    table = client.read_table(TABLE)
+    assert table["symbol"].tolist() == ["SPY"] * 4
+    # Float epoch timestamps are loaded as TIMESTAMP
+    assert table["timestamp"].iloc[0] == pd.Timestamp(1735830000, unit="s", tz="UTC")
+    assert client.tables[TABLE].time_partitioning.field == "timestamp"
+
+
+def test_rows_older_than_max_latency_are_loaded_on_rotation(tmp_path):
+    client = LocalBigQueryClient(str(tmp_path))
+    persistence = _persistence(client, max_latency=0)
+
+    persistence.save_data(_records(2))
+    persistence._rotate_files()
+
+    assert [rows for _, _, rows in client.load_jobs] == [2]
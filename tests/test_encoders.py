@@ -0,0 +1,44 @@
+import json
+import math
+
+from definitions import BarData, TradeData
+from persistence.encoders import (
+    encode_csv,
+    encode_json,
+    encode_json_items,
+    encode_ndjson,
+)
+from persistence.gcp_cloud_storage import recursive_asdict
+from persistence.record_batch import RecordBatch
+
+BAR = BarData(101.0, 102.0, 100.0, 100.5, "SPY", 1735830000.0, 12, 3400, 101.2)
+TRADE = TradeData(["@", "I"], "V", 7, 101.0, 5.0, "SPY", "C", 1735830000.5)
+
+
+def test_json_matches_json_dumps():
+    records = [BAR, BAR._replace(symbol="VOO")]
+    assert (
+        encode_json(records)
+        == json.dumps([recursive_asdict(record) for record in records]).encode()
+    )
+    assert encode_json([TRADE]) == json.dumps([recursive_asdict(TRADE)]).encode()
+
+
+def test_missing_and_infinite_values_are_null():
+    bar = BAR._replace(vwap=math.nan, high=math.inf)
+
+    (item,) = json.loads(encode_json([bar]))
+    assert item["vwap"] is None
+    assert item["high"] is None
+    lines = encode_ndjson([bar, BAR]).decode().splitlines()
+    assert [json.loads(line)["vwap"] for line in lines] == [None, 101.2]
+
+
+def test_record_batches_encode_like_records():
+    batch = RecordBatch.from_records([TRADE, TRADE._replace(id=8)])
+    assert encode_json_items(batch) == encode_json_items(list(batch.to_records()))
+    assert encode_csv(batch) == encode_csv([TRADE, TRADE._replace(id=8)])
+    assert encode_csv([TRADE]).decode().splitlines() == [
+        "conditions,exchange,id,price,size,symbol,tape,timestamp",
+        '"[""@"", ""I""]",V,7,101.0,5.0,SPY,C,1735830000.5',
+    ]
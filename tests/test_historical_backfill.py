@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+
+from brokerage_systems.ibkr.fake_ib import FakeIB
+from brokerage_systems.ibkr.historical_backfill import (
+    BackfillCheckpoint,
+    IBKRHistoricalBackfill,
+    PacingLimiter,
+    split_range,
+)
+from persistence.persistence import PersistenceLayer
+
+START = datetime(2025, 1, 2, 14, 30, tzinfo=timezone.utc)
+END = datetime(2025, 1, 2, 15, 30, tzinfo=timezone.utc)  # Two chunks of 1 secs bars
+
+
+class CollectingPersistence(PersistenceLayer):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def save_data(self, data):
+        self.batches.append(data)
+
+
+def _backfill(ib, tmp_path, retries=3):
+    persistence = CollectingPersistence()
+    backfill = IBKRHistoricalBackfill(
+        ib,
+        [persistence],
+        concurrency=1,
+        retries=retries,
+        checkpoint_path=str(tmp_path / "backfill.json"),
+        limiter=PacingLimiter(identical_interval=0),
+        timeout=0.01,
+    )
+    return backfill, persistence
+
+
+def test_timed_out_chunk_is_retried(tmp_path):
+    ib = FakeIB()
+    ib.fail_historical()
+    backfill, persistence = _backfill(ib, tmp_path)
+
+    totals = backfill.run([("SPY", "1 secs", START, END)])
+
+    assert totals["chunks"] == 2
+    assert totals["failed"] == 0
+    assert totals["bars"] == 3600
+    assert ib.requests.count("reqHistoricalData") == 3
+    assert len(BackfillCheckpoint(str(tmp_path / "backfill.json"))) == 2
+
+
+def test_chunk_failing_every_attempt_is_not_checkpointed(tmp_path):
+    ib = FakeIB()
+    # Both chunks fail once, then the first one fails its retry too
+    ib.fail_historical(
+        count=3, error_code=366, error_string="No historical data query found"
+    )
+    backfill, _ = _backfill(ib, tmp_path, retries=1)
+
+    totals = backfill.run([("SPY", "1 secs", START, END)])
+
+    assert totals["failed"] == 1
+    assert totals["chunks"] == 1
+    checkpoint = BackfillCheckpoint(str(tmp_path / "backfill.json"))
+    first, second = split_range("SPY", "1 secs", START, END)
+    assert first not in checkpoint
+    assert second in checkpoint
+
+
+def test_chunk_without_data_is_completed(tmp_path):
+    ib = FakeIB()
+    ib.fail_historical(
+        error_code=162,
+        error_string="Historical Market Data Service error message:HMDS query returned no data",
+    )
+    backfill, _ = _backfill(ib, tmp_path)
+
+    totals = backfill.run([("SPY", "1 secs", START, END)])
+
+    assert totals["chunks"] == 2
+    assert totals["bars"] == 1800
+    assert ib.requests.count("reqHistoricalData") == 2
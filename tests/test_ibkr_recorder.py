@@ -0,0 +1,93 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from brokerage_systems.ibkr.fake_ib import FakeIB
+from persistence.persistence import PersistenceLayer
+from recorders.ibkr_recorder import POLL, SNAPSHOT, STREAM, IBKRTickerPriceLogger
+
+SYMBOLS = ["SPY", "VOO"]
+TIME = datetime(2025, 1, 2, 15, 0, tzinfo=timezone.utc)
+
+
+class CollectingPersistence(PersistenceLayer):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def save_data(self, data):
+        self.batches.append(list(data))
+
+
+def _recorder(mode):
+    ib = FakeIB()
+    persistence = CollectingPersistence()
+    recorder = IBKRTickerPriceLogger(
+        stocks=SYMBOLS, persistences=[persistence], mode=mode, ib=ib
+    )
+    recorder.connect()
+    return recorder, ib, persistence
+
+
+def test_poll_mode_requests_the_tickers_at_every_tick():
+    recorder, ib, persistence = _recorder(POLL)
+
+    recorder._log_records()
+    recorder._log_records()
+
+    assert ib.requests.count("reqTickers") == 2
+    assert "reqMktData" not in ib.requests
+    assert [[record.symbol for record in batch] for batch in persistence.batches] == [
+        SYMBOLS,
+        SYMBOLS,
+    ]
+
+
+def test_snapshot_mode_records_the_state_table():
+    recorder, ib, persistence = _recorder(SNAPSHOT)
+    assert ib.requests.count("reqMktData") == 2
+
+    ib.push("SPY", TIME, bid=600.1, ask=600.2, bidSize=3, askSize=4)
+    ib.push("SPY", TIME, bid=600.2, ask=600.3)
+    recorder._log_records()
+
+    (batch,) = persistence.batches
+    (record,) = batch
+    assert record.symbol == "SPY"
+    assert (record.bid, record.ask, record.bid_size) == (600.2, 600.3, 3)
+    assert record.timestamp == TIME.timestamp()
+    assert recorder._state["SPY"] == record
+
+    # Without new updates, the next tick records the same state
+    recorder._log_records()
+    assert persistence.batches[1] == batch
+    assert "reqTickers" not in ib.requests
+
+
+def test_stream_mode_saves_micro_batches_as_updates_arrive():
+    recorder, ib, persistence = _recorder(STREAM)
+
+    ib.push("SPY", TIME, last=600.1, lastSize=100)
+    recorder._sleep(0)
+    ib.push("SPY", TIME, last=600.2)
+    ib.push("VOO", TIME, last=550.0)
+    recorder._sleep(0)
+    recorder._log_records()
+
+    assert [len(batch) for batch in persistence.batches] == [1, 2]
+    assert persistence.batches[0][0].last == 600.1
+    assert sorted(record.symbol for record in persistence.batches[1]) == SYMBOLS
+    assert recorder._state["SPY"].last == 600.2
+
+
+@pytest.mark.parametrize("mode", [SNAPSHOT, STREAM])
+def test_disconnect_cancels_the_subscriptions(mode):
+    recorder, ib, persistence = _recorder(mode)
+
+    recorder.disconnect()
+
+    assert ib.requests.count("cancelMktData") == 2
+    assert not ib.isConnected()
+    with pytest.raises(KeyError):
+        ib.push("SPY", TIME, bid=600.1)
+    assert len(ib.pendingTickersEvent) == 0
@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+from benchmarks.import_time import (
+    DEFERRED_MODULES,
+    ENTRY_POINT_DEFAULT,
+    import_seconds,
+    imported_modules,
+)
+
+# Cold start budget of the Cloud Run snapshot recorder (about 0.25 s when deferred)
+IMPORT_BUDGET_SECONDS = 0.5
+REPEAT = 3
+
+
+def test_entry_point_defers_heavy_modules():
+    assert imported_modules(ENTRY_POINT_DEFAULT, DEFERRED_MODULES) == []
+
+
+@pytest.mark.skipif(
+    not os.environ.get("CHECK_IMPORT_TIME"),
+    reason="Wall clock check, flaky on loaded machines: set CHECK_IMPORT_TIME=1 to run it",
+)
+def test_entry_point_import_time_within_budget():
+    # Best of a few fresh interpreters, so that a noisy run does not fail the check
+    best = min(import_seconds(ENTRY_POINT_DEFAULT) for _ in range(REPEAT))
+    assert best < IMPORT_BUDGET_SECONDS, (
+        f"Importing {ENTRY_POINT_DEFAULT} took {best * 1e3:.0f} ms, "
+        f"over the budget of {IMPORT_BUDGET_SECONDS * 1e3:.0f} ms"
+    )
@@ -0,0 +1,57 @@
+import math
+
+import pandas as pd
+
+from brokerage_systems.alpaca_br.alpaca_defs import AlpacaSnapshot
+from definitions import BarData, QuoteData, TradeData
+from persistence.latest_state import LatestStateCache
+from persistence.record_batch import RecordBatch
+
+NAN_BAR = BarData(*([math.nan] * 4), None, math.nan, math.nan, math.nan, math.nan)
+
+
+def _bar(timestamp, close):
+    return BarData(close, close, close, close, "SPY", timestamp, 1, 100, close)
+
+
+def _snapshot(timestamp, minute_bar):
+    return AlpacaSnapshot(
+        daily_bar=_bar(timestamp, 100.0),
+        latest_quote=QuoteData("V", 100.1, 1, "V", 100.0, 1, [], "SPY", "C", timestamp),
+        latest_trade=TradeData([], "V", 1, 100.0, 1, "SPY", "C", timestamp),
+        minute_bar=minute_bar,
+        previous_daily_bar=_bar(timestamp - 86400, 99.0),
+        symbol="SPY",
+    )
+
+
+def test_missing_section_does_not_replace_the_last_good_one():
+    cache = LatestStateCache()
+    cache.save_data([_snapshot(1000.0, _bar(960.0, 100.5))])
+
+    # Rebuilt from all-NaN columns, the minute bar of the next snapshot is missing
+    batch = RecordBatch.from_records([_snapshot(2000.0, NAN_BAR)])
+    cache.save_data(batch)
+
+    assert cache.get("SPY", "minute_bar")["close"] == 100.5
+    assert cache.get("SPY", "latest_quote")["timestamp"] == 2000.0
+
+
+def test_missing_section_is_left_out_of_a_new_state():
+    cache = LatestStateCache()
+    cache.save_data([_snapshot(1000.0, NAN_BAR)])
+
+    assert "minute_bar" not in cache.get("SPY")
+    assert cache.get("SPY", "latest_trade")["price"] == 100.0
+
+
+def test_missing_frame_rows_are_skipped():
+    cache = LatestStateCache()
+    cache.save_data(
+        pd.DataFrame({"symbol": ["SPY"], "timestamp": [1.0], "close": [5.0]})
+    )
+    cache.save_data(
+        pd.DataFrame({"symbol": ["SPY"], "timestamp": [None], "close": [math.nan]})
+    )
+
+    assert cache.get("SPY", "bar") == {"symbol": "SPY", "timestamp": 1.0, "close": 5.0}
@@ -0,0 +1,67 @@
+import os
+from datetime import date
+
+import pyarrow.parquet as pq
+
+from definitions import TickerRecord
+from persistence.parquet import ParquetPersistence
+
+DAY_1 = date(2025, 1, 2)
+DAY_2 = date(2025, 1, 3)
+
+
+def _records(count, start=0):
+    return [
+        TickerRecord(float(i), "SPY", *([1.0] * 11))
+        for i in range(start, start + count)
+    ]
+
+
+def _persistence(tmp_path, monkeypatch, **kwargs):
+    persistence = ParquetPersistence("ticks", directory=str(tmp_path), **kwargs)
+    today = {"date": DAY_1}
+    monkeypatch.setattr(persistence, "_current_date", lambda: today["date"])
+    return persistence, today
+
+
+def _rows(tmp_path, day):
+    path = os.path.join(tmp_path, f"ticks_{day.isoformat()}.parquet_0")
+    return pq.read_table(path).column("timestamp").to_pylist()
+
+
+def test_rows_of_the_previous_day_go_to_its_file(tmp_path, monkeypatch):
+    persistence, today = _persistence(tmp_path, monkeypatch)
+
+    persistence.save_data(_records(3))
+    today["date"] = DAY_2
+    persistence.save_data(_records(2, start=3))
+    persistence.close()
+
+    assert _rows(tmp_path, DAY_1) == [0.0, 1.0, 2.0]
+    assert _rows(tmp_path, DAY_2) == [3.0, 4.0]
+
+
+def test_rotation_notices_the_day_change_before_the_first_row_group(
+    tmp_path, monkeypatch
+):
+    persistence, today = _persistence(tmp_path, monkeypatch)
+
+    persistence.save_data(_records(3))
+    today["date"] = DAY_2
+    persistence._rotate_files()
+
+    assert _rows(tmp_path, DAY_1) == [0.0, 1.0, 2.0]
+    assert not persistence.has_buffered_data()
+
+
+def test_rows_older_than_max_latency_are_written(tmp_path, monkeypatch):
+    persistence, _ = _persistence(tmp_path, monkeypatch, max_latency=0)
+
+    persistence.save_data(_records(3))
+    assert persistence._pending == []
+    persistence.save_data(_records(2, start=3))
+    persistence.close()
+
+    metadata = pq.ParquetFile(os.path.join(tmp_path, "ticks_2025-01-02.parquet_0"))
+    assert metadata.metadata.num_row_groups == 2
+    assert _rows(tmp_path, DAY_1) == [0.0, 1.0, 2.0, 3.0, 4.0]
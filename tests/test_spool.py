@@ -0,0 +1,74 @@
+import time
+
+from definitions import TickerRecord
+from persistence.persistence import PersistenceLayer
+from persistence.spool import SpooledPersistence, WriteAheadSpool
+
+
+class BufferingPersistence(PersistenceLayer):
+    """Holds the saved records in memory until it is closed, like a batching sink."""
+
+    def __init__(self):
+        super().__init__()
+        self.buffered = []
+        self.stored = []
+
+    def save_data(self, data):
+        self.buffered.extend(data)
+
+    def has_buffered_data(self) -> bool:
+        return bool(self.buffered)
+
+    def close(self):
+        self.stored.extend(self.buffered)
+        self.buffered = []
+
+
+def _records(count, start=0):
+    return [TickerRecord(i, "SPY", *([1.0] * 11)) for i in range(start, start + count)]
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.01)
+
+
+def test_buffered_batches_are_not_committed(tmp_path):
+    sink = BufferingPersistence()
+    spooled = SpooledPersistence(sink, str(tmp_path), fsync=False, poll_interval=0.01)
+    spooled.save_data(_records(3))
+    _wait_for(lambda: len(sink.buffered) == 3)
+
+    # The sink only buffers the batch: a crash now must replay it
+    spooled._replayer.stop()
+    spooled._spool.close()
+    spool = WriteAheadSpool(str(tmp_path), fsync=False)
+    batches, _ = spool.read_batches()
+    assert [record.timestamp for batch in batches for record in batch] == [0, 1, 2]
+    spool.close()
+
+
+def test_close_commits_once_the_sink_stored_the_batches(tmp_path):
+    sink = BufferingPersistence()
+    spooled = SpooledPersistence(sink, str(tmp_path), fsync=False, poll_interval=0.01)
+    spooled.save_data(_records(3))
+    spooled.save_data(_records(2, start=3))
+    spooled.close()
+
+    assert [record.timestamp for record in sink.stored] == [0, 1, 2, 3, 4]
+    spool = WriteAheadSpool(str(tmp_path), fsync=False)
+    assert spool.read_batches()[0] == []
+    spool.close()
+
+
+def test_saving_after_close_reopens_the_spool(tmp_path):
+    sink = BufferingPersistence()
+    spooled = SpooledPersistence(sink, str(tmp_path), fsync=False, poll_interval=0.01)
+    spooled.save_data(_records(2))
+    spooled.close()
+    spooled.save_data(_records(1, start=2))
+    spooled.close()
+
+    assert [record.timestamp for record in sink.stored] == [0, 1, 2]